@@ -1,3 +1,10 @@
+import os
+import logging
+import threading
+import time
+from typing import Iterable, List, Optional
+from app.utils.geoip import GeoIPTable
+
 TRANSLATIONS = {
     "US": "Welcome", "GB": "Welcome", "FR": "Bienvenue",
     "ES": "Bienvenido", "DE": "Willkommen", "CN": "欢迎",
@@ -10,12 +17,66 @@ IP_TO_COUNTRY = {
     "14.": "CN", "16.": "JP", "20.": "IN", "25.": "MY"
 }
 
-def get_country_from_ip(ip: str) -> str:
+logger = logging.getLogger(__name__)
+
+_table: Optional[GeoIPTable] = None
+_table_key: Optional[str] = None
+_table_lock = threading.Lock()
+# A path that failed to load is not retried until this many seconds have passed.
+_RETRY_INTERVAL = float(os.environ.get("GEOIP_RETRY_INTERVAL", "300"))
+_failed_key: Optional[str] = None
+_failed_until = 0.0
+
+def get_table() -> Optional[GeoIPTable]:
+    """Range table from GEOIP_DB_PATH (memory-mapped) or GEOIP_CSV_PATH; None if neither is set.
+
+    A table that cannot be loaded also yields None, so lookups fall back to the
+    prefix map; the failure is logged once and the load retried only after
+    GEOIP_RETRY_INTERVAL seconds.
+    """
+    global _table, _table_key, _failed_key, _failed_until
+    db_path = os.environ.get("GEOIP_DB_PATH") or ""
+    csv_path = os.environ.get("GEOIP_CSV_PATH") or ""
+    key = db_path or csv_path
+    with _table_lock:
+        if key != _table_key:
+            if key == _failed_key and time.monotonic() < _failed_until:
+                return None
+            try:
+                if db_path:
+                    table = GeoIPTable.load(db_path)
+                elif csv_path:
+                    table = GeoIPTable.from_csv(csv_path)
+                else:
+                    table = None
+            except (OSError, ValueError) as e:
+                if key != _failed_key:
+                    logger.error("could not load GeoIP table %s, using prefix fallback: %s", key, e)
+                _failed_key, _failed_until = key, time.monotonic() + _RETRY_INTERVAL
+                return None
+            _table, _table_key = table, key
+            _failed_key = None
+        return _table
+
+def _from_prefixes(ip: str) -> str:
     for prefix, country in IP_TO_COUNTRY.items():
         if ip.startswith(prefix):
             return country
     return "default"
 
+def get_country_from_ip(ip: str) -> str:
+    table = get_table()
+    if table is None:
+        return _from_prefixes(ip)
+    return table.lookup(ip) or "default"
+
+def get_countries_from_ips(ips: Iterable[str]) -> List[str]:
+    ips = list(ips)
+    table = get_table()
+    if table is None:
+        return [_from_prefixes(ip) for ip in ips]
+    return [c or "default" for c in table.lookup_many(ips)]
+
 def translate_welcome(ip: str) -> str:
     country = get_country_from_ip(ip)
     return TRANSLATIONS.get(country, TRANSLATIONS["default"])
@@ -1,7 +1,19 @@
 from fastapi import APIRouter
+from app.services import llm_gateway
+from app.utils import admission
 
 router = APIRouter()
 
 @router.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@router.get("/health/admission")
+def admission_stats():
+    """In-flight and queued requests per upstream pool."""
+    return admission.stats()
+
+@router.get("/health/upstream")
+def upstream_stats():
+    """Circuit breaker state per LLM model."""
+    return llm_gateway.breaker_stats()
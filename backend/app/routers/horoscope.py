@@ -1,13 +1,24 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional
-from app.services.horoscope_service import generate_daily
+import asyncio
+import json
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, Iterator, List, Optional
+from app.services.horoscope_service import generate_daily, generate_daily_async, cache_stats
 from app.services.email_service import send_email
-from app.utils.storage import add_subscriber, remove_subscriber, list_subscribers
+from app.services.mailing_service import render_email, start_daily_job, resume_job, job_status
+from app.utils.storage import add_subscriber, add_subscribers, remove_subscriber, iter_subscribers
+from app.utils.auth import require_admin
 from datetime import datetime
 
 router = APIRouter(prefix="/api/horoscope", tags=["Horoscope"])
 
+# Bulk NDJSON import: rows per write transaction and per-line size guard.
+_IMPORT_BATCH_SIZE = int(os.environ.get("SUBSCRIBERS_IMPORT_BATCH_SIZE", "500"))
+_IMPORT_MAX_LINE = 64 * 1024
+_IMPORT_MAX_ERRORS = 100
+
 class Preferences(BaseModel):
     tone: Optional[str] = Field(default="neutral")
     focus: Optional[str] = Field(default="self-care")
@@ -57,12 +68,51 @@ class SubscribeRequest(BaseModel):
 class SubscribeResponse(BaseModel):
     ok: bool
 
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResponse(BaseModel):
+    imported: int
+    failed: int
+    errors: List[BulkImportError]
+
 class UnsubscribeRequest(BaseModel):
     email: str
 
 class SendDailyResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    shards: int
+
+class MailingJobStatus(BaseModel):
+    job_id: str
+    day: str
+    status: str
+    total: int
     sent: int
     failed: int
+    pending: int
+    shards: int
+    shards_done: int
+    unique_profiles: int
+    cache_hits: int
+    elapsed_s: float
+    throughput_per_s: float
+
+class CacheStatsResponse(BaseModel):
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: Optional[int] = None
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    hit_ratio: float
+    coalesced: int
+    store_hits: int
 
 def _validate(req: HoroscopeRequest) -> None:
     p = req.philosophy.lower()
@@ -80,12 +130,16 @@ def _validate(req: HoroscopeRequest) -> None:
         raise HTTPException(status_code=400, detail="birth_date and birth_time are required for advanced mode")
 
 @router.post("/daily", response_model=HoroscopeResponse)
-def daily(req: HoroscopeRequest) -> HoroscopeResponse:
+async def daily(req: HoroscopeRequest) -> HoroscopeResponse:
     _validate(req)
     prefs = (req.preferences.dict() if req.preferences else {})
-    result = generate_daily(req.philosophy.lower(), req.mode.lower(), req.inputs, prefs)
+    result = await generate_daily_async(req.philosophy.lower(), req.mode.lower(), req.inputs, prefs)
     return HoroscopeResponse(**result)
 
+@router.get("/cache-stats", response_model=CacheStatsResponse)
+def horoscope_cache_stats() -> CacheStatsResponse:
+    return CacheStatsResponse(**cache_stats())
+
 @router.post("/email", response_model=EmailResponse)
 def email_update(req: EmailRequest) -> EmailResponse:
     # Validate using same rules
@@ -99,24 +153,10 @@ def email_update(req: EmailRequest) -> EmailResponse:
     _validate(tmp)
     prefs = (req.preferences.dict() if req.preferences else {})
     result = generate_daily(req.philosophy.lower(), req.mode.lower(), req.inputs, prefs)
-    text = result.get("text", "")
-    mood = result.get("mood", "")
-    energy = result.get("energy", 3)
-    focus = result.get("focus", "self-care")
-    body = (
-        f"Your Daily Horoscope\n\n"
-        f"Philosophy: {result.get('philosophy')}\n"
-        f"Mode: {result.get('mode')}\n"
-        f"Mood: {mood}\nEnergy: {energy}\nFocus: {focus}\n\n"
-        f"{text}\n\n"
-        f"Do: {result.get('do')}\nDon't: {result.get('dont')}\n\n"
-        f"Lucky Color: {result.get('lucky_color')}\nLucky Number: {result.get('lucky_number')}\n"
-    )
-    ok = send_email(req.email, "Your Daily Horoscope", body)
+    ok = send_email(req.email, "Your Daily Horoscope", render_email(result))
     return EmailResponse(ok=ok)
 
-@router.post("/subscribe", response_model=SubscribeResponse)
-def subscribe(req: SubscribeRequest) -> SubscribeResponse:
+def _subscriber_item(req: SubscribeRequest) -> Dict[str, Any]:
     tmp = HoroscopeRequest(
         philosophy=req.philosophy,
         mode=req.mode,
@@ -125,7 +165,7 @@ def subscribe(req: SubscribeRequest) -> SubscribeResponse:
         consent=None,
     )
     _validate(tmp)
-    item = {
+    return {
         "email": req.email,
         "philosophy": req.philosophy.lower(),
         "mode": req.mode.lower(),
@@ -133,40 +173,97 @@ def subscribe(req: SubscribeRequest) -> SubscribeResponse:
         "preferences": (req.preferences.dict() if req.preferences else {}),
         "created_at": datetime.utcnow().isoformat(),
     }
-    ok = add_subscriber(item)
+
+@router.post("/subscribe", response_model=SubscribeResponse)
+def subscribe(req: SubscribeRequest) -> SubscribeResponse:
+    ok = add_subscriber(_subscriber_item(req))
     return SubscribeResponse(ok=ok)
 
+@router.post("/subscribers/import", response_model=BulkImportResponse, dependencies=[Depends(require_admin)])
+async def import_subscribers(request: Request) -> BulkImportResponse:
+    """Stream NDJSON subscribe rows; each is validated like /subscribe and written in batches."""
+    imported = 0
+    failed = 0
+    errors: List[BulkImportError] = []
+    batch: List[Dict[str, Any]] = []
+    line_no = 0
+
+    def _fail(msg: str) -> None:
+        nonlocal failed
+        failed += 1
+        if len(errors) < _IMPORT_MAX_ERRORS:
+            errors.append(BulkImportError(line=line_no, error=msg))
+
+    async def _flush() -> None:
+        nonlocal imported, batch
+        if batch:
+            imported += await asyncio.to_thread(add_subscribers, batch)
+            batch = []
+
+    async def _handle(raw: bytes) -> None:
+        nonlocal line_no
+        line_no += 1
+        if not raw.strip():
+            return
+        try:
+            req = SubscribeRequest(**json.loads(raw))
+            batch.append(_subscriber_item(req))
+        except HTTPException as e:
+            _fail(str(e.detail))
+        except ValidationError as e:
+            _fail("; ".join(err.get("msg", "invalid") for err in e.errors()))
+        except Exception:
+            _fail("invalid JSON")
+        if len(batch) >= _IMPORT_BATCH_SIZE:
+            await _flush()
+
+    buf = b""
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for raw in lines:
+            await _handle(raw)
+        if len(buf) > _IMPORT_MAX_LINE:
+            raise HTTPException(status_code=413, detail=f"line {line_no + 1} exceeds {_IMPORT_MAX_LINE} bytes")
+    if buf:
+        await _handle(buf)
+    await _flush()
+    return BulkImportResponse(imported=imported, failed=failed, errors=errors)
+
+@router.get("/subscribers/export", dependencies=[Depends(require_admin)])
+def export_subscribers() -> StreamingResponse:
+    def _rows() -> Iterator[bytes]:
+        for s in iter_subscribers():
+            yield (json.dumps(s, ensure_ascii=False) + "\n").encode("utf-8")
+
+    return StreamingResponse(_rows(), media_type="application/x-ndjson")
+
 @router.post("/unsubscribe", response_model=SubscribeResponse)
 def unsubscribe(req: UnsubscribeRequest) -> SubscribeResponse:
     ok = remove_subscriber(req.email)
     return SubscribeResponse(ok=ok)
 
-@router.post("/send-daily", response_model=SendDailyResponse)
-def send_daily() -> SendDailyResponse:
-    subs = list_subscribers()
-    sent = 0
-    failed = 0
-    for s in subs:
-        try:
-            prefs = s.get("preferences", {})
-            out = generate_daily(s.get("philosophy"), s.get("mode"), s.get("inputs"), prefs)
-            text = out.get("text", "")
-            mood = out.get("mood", "")
-            energy = out.get("energy", 3)
-            focus = out.get("focus", "self-care")
-            body = (
-                f"Your Daily Horoscope\n\n"
-                f"Philosophy: {out.get('philosophy')}\n"
-                f"Mode: {out.get('mode')}\n"
-                f"Mood: {mood}\nEnergy: {energy}\nFocus: {focus}\n\n"
-                f"{text}\n\n"
-                f"Do: {out.get('do')}\nDon't: {out.get('dont')}\n\n"
-                f"Lucky Color: {out.get('lucky_color')}\nLucky Number: {out.get('lucky_number')}\n"
-            )
-            if send_email(s.get("email"), "Your Daily Horoscope", body):
-                sent += 1
-            else:
-                failed += 1
-        except Exception:
-            failed += 1
-    return SendDailyResponse(sent=sent, failed=failed)
\ No newline at end of file
+@router.post("/send-daily", response_model=SendDailyResponse, status_code=202)
+def send_daily(shards: int = 1, force: bool = False, x_admin_token: Optional[str] = Header(default=None)) -> SendDailyResponse:
+    if force:
+        # A forced run mails every subscriber again, so only operators may ask for one.
+        require_admin(x_admin_token)
+    if shards < 1 or shards > 256:
+        raise HTTPException(status_code=400, detail="shards must be between 1 and 256")
+    job_id = start_daily_job(shards=shards, force=force)
+    st = job_status(job_id)
+    return SendDailyResponse(job_id=job_id, status=st["status"], total=st["total"], shards=st["shards"])
+
+@router.get("/jobs/{job_id}", response_model=MailingJobStatus)
+def mailing_job_status(job_id: str) -> MailingJobStatus:
+    st = job_status(job_id)
+    if st is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return MailingJobStatus(**st)
+
+@router.post("/jobs/{job_id}/resume", response_model=MailingJobStatus)
+def mailing_job_resume(job_id: str) -> MailingJobStatus:
+    # Any worker may call this to pick up unleased or expired shards of the job.
+    if not resume_job(job_id):
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return MailingJobStatus(**job_status(job_id))
@@ -1,12 +1,51 @@
-from fastapi import APIRouter, Request, HTTPException
+import asyncio
+import json
+import logging
+import os
+from fastapi import APIRouter, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
-from app.services.scribe_service import summarize_note, attribute_dialogue
-from app.utils.uploads import init_upload, write_chunk, finalize_upload
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from app.services.scribe_service import (
+    get_cache,
+    summarize_note_async,
+    attribute_dialogue_async,
+    summarize_note_stream,
+    attribute_dialogue_stream,
+)
+from app.services.scribe_job_service import submit, job_state, queue_stats, QueueFull, InvalidCallback
+from app.services.scribe_session_service import (
+    create_session,
+    append_segments,
+    session_state,
+    update_session_note,
+    delete_session,
+)
+from app.utils.uploads import (
+    init_upload,
+    expect_bytes,
+    write_chunk_stream,
+    finalize_upload_result,
+    uploaded_bytes,
+    chunk_status,
+    StreamAppender,
+    MAX_CHUNK_BYTES,
+    ChunkTooLarge,
+    ChecksumMismatch,
+    UploadIncomplete,
+    janitor,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/scribe", tags=["Scribe"])
 router_public = APIRouter(tags=["Scribe"])
 
+# Frames buffered between the socket reader and the disk writer before reads pause.
+_STREAM_QUEUE_FRAMES = int(os.environ.get("SCRIBE_STREAM_QUEUE_FRAMES", "16"))
+
 class Segment(BaseModel):
     ts: Optional[float] = None
     text: str
@@ -17,13 +56,28 @@ class UploadInitResponse(BaseModel):
 class UploadFinalizeRequest(BaseModel):
     uploadId: str
     filename: Optional[str] = None
+    totalChunks: Optional[int] = None
+    totalBytes: Optional[int] = None
 
 class UploadFinalizeResponse(BaseModel):
     fileId: str
+    contentHash: Optional[str] = None
+    deduplicated: bool = False
+
+class UploadStatusResponse(BaseModel):
+    uploadId: str
+    received: List[int]
+    missing: List[int]
+    checksums: Dict[str, str]
+    totalBytes: int
+    ranges: List[List[int]] = []
+    missingRanges: List[List[int]] = []
+    expectedBytes: Optional[int] = None
 
 class AttributeRequest(BaseModel):
     segments: Optional[List[Segment]] = None
     fileId: Optional[str] = None
+    cache: bool = True
 
 class AttributeResponse(BaseModel):
     dialogue: Any
@@ -33,11 +87,46 @@ class SummarizeRequest(BaseModel):
     transcript: str = Field(default="")
     dialogue: Optional[str] = None
     audioFileId: Optional[str] = None
+    cache: bool = True
 
 class SummarizeResponse(BaseModel):
     note: Any
     provider: str
 
+class AttributeJobRequest(AttributeRequest):
+    callbackUrl: Optional[str] = None
+
+class SummarizeJobRequest(SummarizeRequest):
+    callbackUrl: Optional[str] = None
+
+class JobResponse(BaseModel):
+    jobId: str
+    op: str
+    status: str
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    callbackUrl: Optional[str] = None
+    callbackStatus: Optional[str] = None
+    createdAt: float
+    startedAt: Optional[float] = None
+    finishedAt: Optional[float] = None
+
+class SessionCreateResponse(BaseModel):
+    sessionId: str
+
+class SessionAppendRequest(BaseModel):
+    segments: List[Segment] = Field(default_factory=list)
+    update: bool = True
+
+class SessionResponse(BaseModel):
+    sessionId: str
+    note: Optional[str] = None
+    summarized: int
+    segments: int
+    provider: Optional[str] = None
+    dialogue: Optional[str] = None
+
 @router.post("/upload_init", response_model=UploadInitResponse)
 @router_public.post("/upload_init", response_model=UploadInitResponse)
 def upload_init():
@@ -46,29 +135,282 @@ def upload_init():
 
 @router.post("/upload_chunk")
 @router_public.post("/upload_chunk")
-async def upload_chunk(request: Request, uploadId: Optional[str] = None, index: Optional[int] = None):
-    if not uploadId or index is None:
+async def upload_chunk(
+    request: Request,
+    uploadId: Optional[str] = None,
+    index: Optional[int] = None,
+    offset: Optional[int] = None,
+    sha256: Optional[str] = None,
+    totalBytes: Optional[int] = None,
+):
+    if not uploadId or (index is None and offset is None):
         raise HTTPException(status_code=400, detail={"error": "Missing uploadId or index"})
-    data = await request.body()
-    write_chunk(uploadId, index, data)
-    return {"ok": True, "index": index}
+    if (index is not None and index < 0) or (offset is not None and offset < 0):
+        raise HTTPException(status_code=400, detail={"error": "Invalid index"})
+    try:
+        if totalBytes is not None:
+            await run_in_threadpool(expect_bytes, uploadId, totalBytes)
+        checksum = sha256 or request.headers.get("x-chunk-sha256")
+        n = await write_chunk_stream(uploadId, index or 0, request.stream(), offset=offset, sha256=checksum)
+    except ChunkTooLarge as e:
+        raise HTTPException(status_code=413, detail={"error": str(e)})
+    except ChecksumMismatch as e:
+        raise HTTPException(status_code=422, detail={"error": str(e)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+    total = await run_in_threadpool(uploaded_bytes, uploadId)
+    return {"ok": True, "index": index, "bytes": n, "totalBytes": total}
+
+@router.get("/upload_status", response_model=UploadStatusResponse)
+@router_public.get("/upload_status", response_model=UploadStatusResponse)
+def upload_status(uploadId: Optional[str] = None, totalChunks: Optional[int] = None):
+    if not uploadId:
+        raise HTTPException(status_code=400, detail={"error": "Missing uploadId"})
+    try:
+        return chunk_status(uploadId, totalChunks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
 
+@router.get("/upload_janitor")
+def upload_janitor():
+    """Disk usage and eviction counters from the background upload reaper."""
+    return janitor.stats()
+
+# Sync on purpose: FastAPI runs it in the threadpool, keeping file assembly off the event loop.
 @router.post("/upload_finalize", response_model=UploadFinalizeResponse)
 @router_public.post("/upload_finalize", response_model=UploadFinalizeResponse)
 def upload_finalize(payload: UploadFinalizeRequest):
     if not payload.uploadId:
         raise HTTPException(status_code=400, detail={"error": "Missing uploadId"})
-    file_id = finalize_upload(payload.uploadId, payload.filename)
-    return {"fileId": file_id}
+    try:
+        result = finalize_upload_result(payload.uploadId, payload.filename, payload.totalChunks, payload.totalBytes)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail={"error": str(e)})
+    except UploadIncomplete as e:
+        raise HTTPException(status_code=409, detail={"error": str(e)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+    return result
+
+@router.websocket("/upload_stream")
+@router_public.websocket("/upload_stream")
+async def upload_stream(websocket: WebSocket, uploadId: Optional[str] = None):
+    """Live ingest: binary frames are appended to the upload in order.
+
+    Send `{"type": "finalize", "filename": ...}` to assemble the file; the reply is
+    `{"type": "finalized", "fileId": ...}`. If the socket just drops, the bytes
+    stay put and a reconnect with the same uploadId continues appending.
+    """
+    await websocket.accept()
+    if not uploadId:
+        uploadId = await run_in_threadpool(init_upload)
+    try:
+        appender = StreamAppender(uploadId)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=1008)
+        return
+    # Bounded queue: when the disk falls behind, the reader stops pulling frames
+    # and TCP flow control pushes back on the client.
+    queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=_STREAM_QUEUE_FRAMES)
+
+    async def _writer() -> None:
+        async with appender:
+            await websocket.send_json({"type": "ready", "uploadId": uploadId, "offset": appender.start})
+            while True:
+                data = await queue.get()
+                if data is None:
+                    return
+                await appender.write(data)
+                await websocket.send_json({"type": "ack", "bytes": appender.total})
+
+    writer = asyncio.create_task(_writer())
+
+    async def _unless_writer_died(aw: Any) -> Tuple[bool, Any]:
+        # Never block on the queue or the socket after the writer has stopped.
+        task = asyncio.ensure_future(aw)
+        await asyncio.wait({task, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return True, task.result()
+        task.cancel()
+        return False, None
+
+    finalize: Optional[Dict[str, Any]] = None
+    oversize = False
+    try:
+        while True:
+            alive, msg = await _unless_writer_died(websocket.receive())
+            if not alive or msg["type"] == "websocket.disconnect":
+                break
+            data = msg.get("bytes")
+            if data is not None:
+                if len(data) > MAX_CHUNK_BYTES:
+                    oversize = True
+                    break
+                alive, _ = await _unless_writer_died(queue.put(data))
+                if not alive:
+                    break
+                continue
+            try:
+                control = json.loads(msg.get("text") or "{}")
+            except ValueError:
+                control = {}
+            if control.get("type") == "finalize":
+                finalize = control
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if not writer.done():
+            await _unless_writer_died(queue.put(None))
+        try:
+            await writer
+            failed = False
+        except Exception as e:
+            logger.warning("upload_stream %s: writer stopped: %s", uploadId, e)
+            failed = True
+    # Only closed once the writer is finished, so it never races a send_json.
+    if failed or oversize:
+        try:
+            if failed:
+                await websocket.send_json({"type": "error", "error": "write failed"})
+            await websocket.close(code=1011 if failed else 1009)
+        except Exception:
+            pass
+        return
+    if finalize is None:
+        return
+    try:
+        result = await run_in_threadpool(finalize_upload_result, uploadId, finalize.get("filename"))
+        await websocket.send_json({"type": "finalized", **result})
+        await websocket.close(code=1000)
+    except (ValueError, OSError) as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=1011)
+
+def _use_cache(payload: Any, request: Request) -> bool:
+    # Opt out per request with {"cache": false} or a Cache-Control: no-cache / no-store header.
+    cc = request.headers.get("cache-control", "").lower()
+    return payload.cache and "no-cache" not in cc and "no-store" not in cc
 
 @router.post("/attribute", response_model=AttributeResponse)
 @router_public.post("/attribute", response_model=AttributeResponse)
-def attribute(payload: AttributeRequest):
-    result = attribute_dialogue(segments=payload.segments, audio_file_id=payload.fileId)
+async def attribute(payload: AttributeRequest, request: Request):
+    result = await attribute_dialogue_async(
+        segments=payload.segments, audio_file_id=payload.fileId, use_cache=_use_cache(payload, request)
+    )
     return result
 
 @router.post("/summarize", response_model=SummarizeResponse)
 @router_public.post("/summarize", response_model=SummarizeResponse)
-def summarize(payload: SummarizeRequest):
-    result = summarize_note(transcript=payload.transcript, dialogue=payload.dialogue, audio_file_id=payload.audioFileId)
+async def summarize(payload: SummarizeRequest, request: Request):
+    result = await summarize_note_async(
+        transcript=payload.transcript,
+        dialogue=payload.dialogue,
+        audio_file_id=payload.audioFileId,
+        use_cache=_use_cache(payload, request),
+    )
     return result
+
+@router.get("/cache-stats")
+def cache_stats():
+    return get_cache().stats()
+
+@router.post("/session", response_model=SessionCreateResponse)
+@router_public.post("/session", response_model=SessionCreateResponse)
+def session_create():
+    return {"sessionId": create_session()}
+
+@router.get("/session/{session_id}", response_model=SessionResponse)
+@router_public.get("/session/{session_id}", response_model=SessionResponse)
+def session_get(session_id: str, dialogue: bool = False):
+    state = session_state(session_id, with_dialogue=dialogue)
+    if state is None:
+        raise HTTPException(status_code=404, detail={"error": "Unknown session"})
+    return state
+
+@router.post("/session/{session_id}/segments", response_model=SessionResponse)
+@router_public.post("/session/{session_id}/segments", response_model=SessionResponse)
+async def session_append(session_id: str, payload: SessionAppendRequest):
+    """Append transcript segments and, unless `update` is false, fold them into the note."""
+    if await run_in_threadpool(append_segments, session_id, payload.segments) is None:
+        raise HTTPException(status_code=404, detail={"error": "Unknown session"})
+    if payload.update:
+        return await update_session_note(session_id)
+    return await run_in_threadpool(session_state, session_id)
+
+@router.post("/session/{session_id}/update", response_model=SessionResponse)
+@router_public.post("/session/{session_id}/update", response_model=SessionResponse)
+async def session_update(session_id: str):
+    state = await update_session_note(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail={"error": "Unknown session"})
+    return state
+
+@router.delete("/session/{session_id}")
+@router_public.delete("/session/{session_id}")
+def session_delete(session_id: str):
+    if not delete_session(session_id):
+        raise HTTPException(status_code=404, detail={"error": "Unknown session"})
+    return {"ok": True}
+
+def _submit_job(op: str, payload: Any) -> Dict[str, Any]:
+    try:
+        job_id = submit(op, jsonable_encoder(payload, exclude={"callbackUrl"}), payload.callbackUrl)
+    except InvalidCallback as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail={"error": str(e)}, headers={"Retry-After": "5"})
+    return job_state(job_id)
+
+# Queue the work and return 202 at once; poll GET /jobs/{jobId} or pass a callbackUrl.
+@router.post("/jobs/attribute", response_model=JobResponse, status_code=202)
+@router_public.post("/jobs/attribute", response_model=JobResponse, status_code=202)
+def attribute_job(payload: AttributeJobRequest):
+    return _submit_job("attribute", payload)
+
+@router.post("/jobs/summarize", response_model=JobResponse, status_code=202)
+@router_public.post("/jobs/summarize", response_model=JobResponse, status_code=202)
+def summarize_job(payload: SummarizeJobRequest):
+    return _submit_job("summarize", payload)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+@router_public.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: str):
+    state = job_state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail={"error": "Unknown job"})
+    return state
+
+@router.get("/job_stats")
+def job_stats():
+    return queue_stats()
+
+def _sse(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> StreamingResponse:
+    async def body():
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    # X-Accel-Buffering stops nginx-style proxies from holding tokens back.
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/attribute/stream")
+@router_public.post("/attribute/stream")
+async def attribute_stream(payload: AttributeRequest, request: Request):
+    return _sse(attribute_dialogue_stream(
+        segments=payload.segments, audio_file_id=payload.fileId, use_cache=_use_cache(payload, request)
+    ))
+
+@router.post("/summarize/stream")
+@router_public.post("/summarize/stream")
+async def summarize_stream(payload: SummarizeRequest, request: Request):
+    return _sse(summarize_note_stream(
+        transcript=payload.transcript,
+        dialogue=payload.dialogue,
+        audio_file_id=payload.audioFileId,
+        use_cache=_use_cache(payload, request),
+    ))
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Request
+from functools import lru_cache
+from fastapi import APIRouter, Request, Response
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/welcome", tags=["Welcome Translator"])
@@ -13,44 +14,69 @@ class WelcomeOutput(BaseModel):
     ip_used: str
     source: str
 
+SUPPORTED = frozenset(["en", "es", "fr", "de", "pt", "ur", "ar", "zh", "ja"])
+MESSAGES = {
+    "en": "Welcome.",
+    "es": "Bienvenido.",
+    "fr": "Bienvenue.",
+    "de": "Willkommen.",
+    "pt": "Bem-vindo.",
+    "ur": "خوش آمدید۔",
+    "ar": "مرحبًا.",
+    "zh": "欢迎。",
+    "ja": "ようこそ。",
+}
+# Headers longer than this are negotiated without being memoized.
+_MEMO_MAX_HEADER = 256
+
+def _negotiate(src: str) -> str:
+    """Highest-q supported language (exact tag, then its base); ties keep header order."""
+    best, best_q = "en", None
+    for part in src.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lang, sep, q = part.partition(";q=")
+        lang = lang.strip().lower()
+        try:
+            weight = float(q) if sep else 1.0
+        except ValueError:
+            return "en"
+        if best_q is not None and weight <= best_q:
+            continue
+        if lang in SUPPORTED:
+            best, best_q = lang, weight
+        else:
+            base = lang.split("-", 1)[0]
+            if base in SUPPORTED:
+                best, best_q = base, weight
+    return best
+
+_negotiate_memo = lru_cache(maxsize=1024)(_negotiate)
+
+def pick_lang(accept_language: str) -> str:
+    if len(accept_language) > _MEMO_MAX_HEADER:
+        return _negotiate(accept_language)
+    return _negotiate_memo(accept_language)
+
+def _country(request: Request) -> str:
+    return request.headers.get("x-vercel-ip-country") or request.headers.get("cf-ipcountry") or "US"
+
 @router.post("/", response_model=WelcomeOutput)
-def welcome(payload: WelcomeInput, request: Request):
-    al = request.headers.get("accept-language") or ""
-    country = request.headers.get("x-vercel-ip-country") or request.headers.get("cf-ipcountry") or "US"
+def welcome(payload: WelcomeInput, request: Request, response: Response):
     ip_hdr = request.headers.get("x-forwarded-for")
     client_ip = ip_hdr.split(",")[0].strip() if ip_hdr else (request.client.host if request.client else "")
     ip = payload.ip or client_ip or ""
-    supported = ["en", "es", "fr", "de", "pt", "ur", "ar", "zh", "ja"]
-    def pick_lang(src: str) -> str:
-        try:
-            parts = [p.strip() for p in src.split(",") if p.strip()]
-            prefs = []
-            for p in parts:
-                if ";q=" in p:
-                    lang, q = p.split(";q=", 1)
-                    prefs.append((lang.strip().lower(), float(q)))
-                else:
-                    prefs.append((p.strip().lower(), 1.0))
-            prefs.sort(key=lambda x: x[1], reverse=True)
-            for lang, _ in prefs:
-                base = lang.split("-")[0]
-                for candidate in [lang, base]:
-                    if candidate in supported:
-                        return candidate
-        except:
-            pass
-        return "en"
-    lang = pick_lang(al)
-    messages = {
-        "en": "Welcome.",
-        "es": "Bienvenido.",
-        "fr": "Bienvenue.",
-        "de": "Willkommen.",
-        "pt": "Bem-vindo.",
-        "ur": "خوش آمدید۔",
-        "ar": "مرحبًا.",
-        "zh": "欢迎。",
-        "ja": "ようこそ。",
-    }
-    msg = messages.get(lang, "Welcome.")
-    return {"message": msg, "language": lang, "country_code": country, "ip_used": ip, "source": "header"}
+    lang = pick_lang(request.headers.get("accept-language") or "")
+    # The body echoes the caller's IP, so only the browser may keep it.
+    response.headers["Cache-Control"] = "private, max-age=300"
+    response.headers["Vary"] = "Accept-Language"
+    return {"message": MESSAGES[lang], "language": lang, "country_code": _country(request), "ip_used": ip, "source": "header"}
+
+@router.get("/", response_model=WelcomeOutput)
+def welcome_cacheable(request: Request, response: Response):
+    """IP-free variant of POST /welcome/ that a CDN can cache per language and country."""
+    lang = pick_lang(request.headers.get("accept-language") or "")
+    response.headers["Cache-Control"] = "public, max-age=3600, s-maxage=86400"
+    response.headers["Vary"] = "Accept-Language, X-Vercel-IP-Country, CF-IPCountry"
+    return {"message": MESSAGES[lang], "language": lang, "country_code": _country(request), "ip_used": "", "source": "header"}
@@ -1,7 +1,10 @@
 import os
+import queue
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
 def _smtp_config():
     host = os.environ.get("SMTP_HOST")
@@ -11,20 +14,217 @@ def _smtp_config():
     sender = os.environ.get("SMTP_FROM_EMAIL")
     return host, port, user, pwd, sender
 
-def send_email(to_email: str, subject: str, body_text: str) -> bool:
+def _starttls() -> bool:
+    # Disable only for local SMTP stand-ins (e.g. aiosmtpd in tests).
+    return os.environ.get("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+
+def _auth_required() -> bool:
+    # Sending without SMTP_USERNAME/SMTP_PASSWORD must be opted into explicitly.
+    return os.environ.get("SMTP_AUTH", "true").lower() not in ("0", "false", "no")
+
+
+class SMTPPool:
+    """Reusable authenticated SMTP sessions.
+
+    Connections are handed out LIFO so the warmest one is reused; a connection
+    that has been idle longer than `idle_check` is NOOP-probed first, and a
+    dropped session is reopened once before the message counts as failed.
+    A closed pool lets checked-out sessions finish and quits them on return.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        pwd: Optional[str] = None,
+        size: int = 4,
+        starttls: bool = True,
+        timeout: float = 30.0,
+        idle_check: float = 30.0,
+        max_messages: int = 500,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.pwd = pwd
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.max_messages = max_messages
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, float, int]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.connects = 0
+        self.reconnects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        s = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                s.starttls()
+            if self.user and self.pwd:
+                s.login(self.user, self.pwd)
+        except BaseException:
+            self._quit(s)
+            raise
+        self.connects += 1
+        return s
+
+    @staticmethod
+    def _quit(s: smtplib.SMTP) -> None:
+        try:
+            s.quit()
+        except Exception:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _checkout(self) -> Tuple[smtplib.SMTP, int]:
+        while True:
+            try:
+                s, last_used, sent = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), 0
+            if time.monotonic() - last_used < self.idle_check:
+                return s, sent
+            try:
+                if s.noop()[0] == 250:
+                    return s, sent
+            except Exception:
+                pass
+            self._quit(s)
+
+    def _checkin(self, s: smtplib.SMTP, sent: int) -> None:
+        with self._lock:
+            if sent < self.max_messages and not self._closed:
+                self._idle.put((s, time.monotonic(), sent))
+                return
+        self._quit(s)
+
+    def send_batch(self, messages: Sequence[EmailMessage]) -> List[bool]:
+        """Send every message over one pooled session, reconnecting if the server drops it.
+
+        Each message gets its own result; one failing never discards the results
+        of messages already sent.
+        """
+        results: List[bool] = []
+        with self._slots:
+            try:
+                s: Optional[smtplib.SMTP]
+                s, sent = self._checkout()
+            except Exception:
+                return [False] * len(messages)
+            finished = False
+            try:
+                for msg in messages:
+                    ok = False
+                    for attempt in range(2):
+                        if s is None:
+                            try:
+                                s, sent = self._connect(), 0
+                                self.reconnects += 1
+                            except Exception:
+                                return results + [False] * (len(messages) - len(results))
+                        try:
+                            s.send_message(msg)
+                            sent += 1
+                            ok = True
+                            break
+                        except (smtplib.SMTPServerDisconnected, OSError):
+                            self._quit(s)
+                            s = None
+                            if attempt:
+                                break
+                        except smtplib.SMTPException:
+                            break
+                        except Exception:
+                            # The session is in an unknown state: close it and
+                            # continue the batch on a fresh one.
+                            self._quit(s)
+                            s = None
+                            break
+                    results.append(ok)
+                finished = True
+            finally:
+                if s is not None:
+                    if finished:
+                        self._checkin(s, sent)
+                    else:
+                        self._quit(s)
+        return results
+
+    def send(self, msg: EmailMessage) -> bool:
+        return self.send_batch([msg])[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                s, _, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(s)
+
+
+_pool: Optional[SMTPPool] = None
+_pool_key: Optional[tuple] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> Optional[SMTPPool]:
+    global _pool, _pool_key
     host, port, user, pwd, sender = _smtp_config()
-    if not host or not port or not user or not pwd or not sender:
-        return False
+    if not host or not port or not sender:
+        return None
+    if _auth_required() and not (user and pwd):
+        return None
+    key = (host, port, user, pwd, _starttls())
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None:
+                _pool.close()
+            _pool = SMTPPool(
+                host,
+                port,
+                user,
+                pwd,
+                size=int(os.environ.get("SMTP_POOL_SIZE", "4")),
+                starttls=_starttls(),
+            )
+            _pool_key = key
+        return _pool
+
+def _message(sender: str, to_email: str, subject: str, body_text: str) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = sender
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(body_text)
+    return msg
+
+def send_batch(items: Sequence[Tuple[str, str, str]]) -> List[bool]:
+    """Send (to_email, subject, body_text) items through one pooled SMTP session."""
+    pool = _get_pool()
+    sender = _smtp_config()[4]
+    if pool is None or not sender:
+        return [False] * len(items)
+    results: List[bool] = [False] * len(items)
+    sendable: List[Tuple[int, EmailMessage]] = []
+    for i, (to, subject, body) in enumerate(items):
+        try:
+            sendable.append((i, _message(sender, to, subject, body)))
+        except Exception:
+            pass
+    sent = pool.send_batch([msg for _, msg in sendable])
+    for (i, _), ok in zip(sendable, sent):
+        results[i] = ok
+    return results
+
+def send_email(to_email: str, subject: str, body_text: str) -> bool:
     try:
-        with smtplib.SMTP(host, port) as s:
-            s.starttls()
-            s.login(user, pwd)
-            s.send_message(msg)
-        return True
+        return send_batch([(to_email, subject, body_text)])[0]
     except Exception:
-        return False
\ No newline at end of file
+        return False
@@ -1,42 +1,97 @@
 import os
 import json
 import hashlib
+import asyncio
+import logging
 import threading
+import time
 from datetime import datetime
 from typing import Any, Dict, Optional
-import requests
+from app.services import llm_gateway
+from app.utils.cache import BoundedCache
+from app.utils.singleflight import SingleFlight
+from app.utils.result_store import SQLiteResultStore
 
-_cache: Dict[str, Dict[str, Any]] = {}
-_lock = threading.Lock()
+logger = logging.getLogger(__name__)
 
-def _hf_key() -> Optional[str]:
-    return os.environ.get("HF_API_KEY")
 
-def _hf_model() -> str:
-    return os.environ.get("HF_MODEL", "moonshotai/Kimi-K2-Instruct:novita")
+# Per-call budget for upstream generation (seconds).
+_LLM_TIMEOUT = float(os.environ.get("HOROSCOPE_LLM_TIMEOUT", "30"))
 
 def _hf_chat(messages: Any) -> Optional[str]:
-    key = _hf_key()
-    if not key:
+    return llm_gateway.chat(messages, timeout=_LLM_TIMEOUT)
+
+async def _hf_chat_async(messages: Any) -> Optional[str]:
+    return await llm_gateway.chat_async(messages, timeout=_LLM_TIMEOUT)
+
+def _today_key() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+# Bounded by entry count and bytes; everything is dropped when the UTC day changes.
+_cache: BoundedCache[Dict[str, Any]] = BoundedCache(
+    max_entries=int(os.environ.get("HOROSCOPE_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=int(os.environ.get("HOROSCOPE_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.environ.get("HOROSCOPE_CACHE_TTL", "86400")),
+    epoch=_today_key,
+)
+
+# Concurrent misses for the same key share one upstream generation.
+_flight = SingleFlight()
+
+# Optional on-disk store shared by all workers (enabled by HOROSCOPE_STORE_PATH).
+_store: Optional[SQLiteResultStore] = None
+_store_lock = threading.Lock()
+_store_hits = 0
+_hits_lock = threading.Lock()
+_STORE_POLL = 0.25
+
+def _get_store() -> Optional[SQLiteResultStore]:
+    global _store
+    path = os.environ.get("HOROSCOPE_STORE_PATH")
+    if not path:
         return None
-    url = "https://router.huggingface.co/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-    body = {"model": _hf_model(), "messages": messages}
+    with _store_lock:
+        if _store is None or _store.path != path:
+            try:
+                _store = SQLiteResultStore(path)
+            except Exception as e:
+                logger.warning("horoscope store unavailable at %s: %s", path, e)
+                return None
+        return _store
+
+def _store_get(store: SQLiteResultStore, hashed: str) -> Optional[Dict[str, Any]]:
+    global _store_hits
     try:
-        r = requests.post(url, headers=headers, json=body, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        if isinstance(data, dict) and "choices" in data:
-            ch = data["choices"]
-            if isinstance(ch, list) and ch:
-                msg = ch[0].get("message", {})
-                return msg.get("content")
+        hit = store.get(hashed)
     except Exception:
         return None
-    return None
+    if hit is not None:
+        with _hits_lock:
+            _store_hits += 1
+    return hit
 
-def _today_key() -> str:
-    return datetime.utcnow().strftime("%Y-%m-%d")
+def _store_put(store: SQLiteResultStore, hashed: str, shaped: Dict[str, Any]) -> None:
+    try:
+        store.put(hashed, _today_key(), shaped)
+    except Exception as e:
+        logger.warning("horoscope store write failed: %s", e)
+
+def _store_claim(store: SQLiteResultStore, hashed: str) -> bool:
+    try:
+        return store.claim(hashed, _LLM_TIMEOUT + 5)
+    except Exception:
+        return True
+
+def _store_release(store: SQLiteResultStore, hashed: str) -> None:
+    try:
+        store.release(hashed)
+    except Exception:
+        pass
+
+def cache_stats() -> Dict[str, Any]:
+    with _hits_lock:
+        store_hits = _store_hits
+    return {**_cache.stats(), "coalesced": _flight.stats()["shared"], "store_hits": store_hits}
 
 def _hash_inputs(d: Dict[str, Any]) -> str:
     s = json.dumps(d, sort_keys=True, ensure_ascii=False)
@@ -80,29 +135,134 @@ def _fallback(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: D
         "inputs_used": {k: inputs.get(k) for k in ("sign", "birth_year", "birth_date", "birth_time", "location") if k in inputs},
     }
 
-def _shape(data: Any, philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
+def _shape(data: Any, philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The upstream reply as a horoscope, or None if it is missing or incomplete."""
     try:
         obj = json.loads(data) if isinstance(data, str) else {}
     except Exception:
         obj = {}
     required = ["text", "mood", "energy", "focus", "lucky_color", "lucky_number", "do", "dont", "method_note"]
     if not all(k in obj for k in required):
-        return _fallback(philosophy, mode, inputs, preferences)
+        return None
     obj["philosophy"] = philosophy
     obj["mode"] = mode
     obj["inputs_used"] = {k: inputs.get(k) for k in ("sign", "birth_year", "birth_date", "birth_time", "location") if k in inputs}
     return obj
 
-def generate_daily(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
+def _cache_key(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> str:
     day = _today_key()
     key_data = {"philosophy": philosophy, "mode": mode, "inputs": inputs, "preferences": preferences, "day": day}
-    hashed = _hash_inputs(key_data)
-    with _lock:
-        if hashed in _cache:
-            return _cache[hashed]
-    msgs = _prompt(philosophy, mode, inputs, preferences)
-    content = _hf_chat(msgs)
-    shaped = _shape(content, philosophy, mode, inputs, preferences)
-    with _lock:
-        _cache[hashed] = shaped
-    return shaped
\ No newline at end of file
+    return _hash_inputs(key_data)
+
+def _cache_get(hashed: str) -> Optional[Dict[str, Any]]:
+    return _cache.get(hashed)
+
+def _cache_put(hashed: str, shaped: Dict[str, Any]) -> None:
+    _cache.put(hashed, shaped)
+
+def _generate_shared(hashed: str, produce: Any) -> Optional[Dict[str, Any]]:
+    """Store-backed generation; None (never persisted) when upstream gave no usable result."""
+    store = _get_store()
+    if store is None:
+        return produce()
+    hit = _store_get(store, hashed)
+    if hit is not None:
+        return hit
+    if not _store_claim(store, hashed):
+        # Another worker is generating this key; wait for its row to land, and take
+        # over as soon as its claim is released (it failed) or expires.
+        deadline = time.monotonic() + _LLM_TIMEOUT + 5
+        while time.monotonic() < deadline:
+            time.sleep(_STORE_POLL)
+            hit = _store_get(store, hashed)
+            if hit is not None:
+                return hit
+            if _store_claim(store, hashed):
+                break
+    try:
+        shaped = produce()
+    except BaseException:
+        _store_release(store, hashed)
+        raise
+    if shaped is None:
+        _store_release(store, hashed)
+    else:
+        _store_put(store, hashed, shaped)
+    return shaped
+
+async def _generate_shared_async(hashed: str, produce: Any) -> Optional[Dict[str, Any]]:
+    store = await asyncio.to_thread(_get_store)
+    if store is None:
+        return await produce()
+    hit = await asyncio.to_thread(_store_get, store, hashed)
+    if hit is not None:
+        return hit
+    if not await asyncio.to_thread(_store_claim, store, hashed):
+        deadline = time.monotonic() + _LLM_TIMEOUT + 5
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_STORE_POLL)
+            hit = await asyncio.to_thread(_store_get, store, hashed)
+            if hit is not None:
+                return hit
+            if await asyncio.to_thread(_store_claim, store, hashed):
+                break
+    try:
+        shaped = await produce()
+    except BaseException:
+        await asyncio.to_thread(_store_release, store, hashed)
+        raise
+    if shaped is None:
+        await asyncio.to_thread(_store_release, store, hashed)
+    else:
+        await asyncio.to_thread(_store_put, store, hashed, shaped)
+    return shaped
+
+def peek_daily(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return today's in-memory result for these inputs without generating or counting a lookup."""
+    return _cache.peek(_cache_key(philosophy, mode, inputs, preferences))
+
+def generate_daily(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
+    hashed = _cache_key(philosophy, mode, inputs, preferences)
+    cached = _cache_get(hashed)
+    if cached is not None:
+        return cached
+
+    def _produce() -> Optional[Dict[str, Any]]:
+        msgs = _prompt(philosophy, mode, inputs, preferences)
+        return _shape(_hf_chat(msgs), philosophy, mode, inputs, preferences)
+
+    def _generate() -> Dict[str, Any]:
+        # A previous flight may have filled the cache between our miss and joining.
+        done = _cache.peek(hashed)
+        if done is not None:
+            return done
+        shaped = _generate_shared(hashed, _produce)
+        if shaped is None:
+            # Fallbacks are served but never cached, so an outage isn't pinned for the day.
+            return _fallback(philosophy, mode, inputs, preferences)
+        _cache_put(hashed, shaped)
+        return shaped
+
+    return _flight.do(hashed, _generate)
+
+async def generate_daily_async(philosophy: str, mode: str, inputs: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
+    hashed = _cache_key(philosophy, mode, inputs, preferences)
+    cached = _cache_get(hashed)
+    if cached is not None:
+        return cached
+
+    async def _produce() -> Optional[Dict[str, Any]]:
+        msgs = _prompt(philosophy, mode, inputs, preferences)
+        return _shape(await _hf_chat_async(msgs), philosophy, mode, inputs, preferences)
+
+    async def _generate() -> Dict[str, Any]:
+        done = _cache.peek(hashed)
+        if done is not None:
+            return done
+        shaped = await _generate_shared_async(hashed, _produce)
+        if shaped is None:
+            return _fallback(philosophy, mode, inputs, preferences)
+        _cache_put(hashed, shaped)
+        return shaped
+
+    return await _flight.do_async(hashed, _generate)
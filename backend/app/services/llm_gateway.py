@@ -0,0 +1,422 @@
+import os
+import asyncio
+import atexit
+import inspect
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import httpx
+from app.utils.circuit import CircuitBreaker
+
+API_URL = "https://router.huggingface.co/v1/chat/completions"
+
+# Default per-call budget (seconds) when a caller does not pass its own.
+DEFAULT_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))
+
+# Circuit breaker per model: trip on LLM_BREAKER_FAILURE_RATIO failures (or calls
+# slower than LLM_BREAKER_SLOW_CALL) over the last LLM_BREAKER_WINDOW calls, then
+# probe every LLM_BREAKER_COOLDOWN seconds (doubling up to _PROBE_MAX) until it answers.
+_BREAKER_WINDOW = int(os.environ.get("LLM_BREAKER_WINDOW", "20"))
+_BREAKER_MIN_CALLS = int(os.environ.get("LLM_BREAKER_MIN_CALLS", "5"))
+_BREAKER_FAILURE_RATIO = float(os.environ.get("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+_BREAKER_SLOW_CALL = float(os.environ.get("LLM_BREAKER_SLOW_CALL", "20"))
+_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "10"))
+_PROBE_MAX = 120.0
+_PROBE_TIMEOUT = 10.0
+# With a secondary model set, a primary call still pending after this many seconds is hedged.
+_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER", "5"))
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+def _hf_key() -> Optional[str]:
+    return os.environ.get("HF_API_KEY")
+
+
+def default_model() -> str:
+    return os.environ.get("HF_MODEL", "moonshotai/Kimi-K2-Instruct:novita")
+
+
+def secondary_model() -> Optional[str]:
+    """Model used for hedged retries and while the primary's breaker is open."""
+    m = os.environ.get("HF_SECONDARY_MODEL") or None
+    return m if m != default_model() else None
+
+
+class HFRouterProvider:
+    """Chat-completions provider backed by one keep-alive httpx.AsyncClient pool."""
+
+    name = "huggingface"
+
+    def __init__(self, url: str = API_URL) -> None:
+        self.url = url
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.environ.get("LLM_MAX_KEEPALIVE", "10")),
+                keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60")),
+            )
+            self._client = httpx.AsyncClient(limits=limits)
+        return self._client
+
+    async def complete(self, body: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        key = _hf_key()
+        if not key:
+            return None
+        headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+        r = await self._get_client().post(
+            self.url,
+            headers=headers,
+            json=body,
+            timeout=httpx.Timeout(timeout, connect=min(5.0, timeout)),
+        )
+        r.raise_for_status()
+        return r.json()
+
+    async def stream(self, body: Dict[str, Any], timeout: float) -> AsyncIterator[str]:
+        """Yield content deltas from a `stream: true` completion; `timeout` bounds each read."""
+        key = _hf_key()
+        if not key:
+            return
+        headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json", "Accept": "text/event-stream"}
+        async with self._get_client().stream(
+            "POST",
+            self.url,
+            headers=headers,
+            json={**body, "stream": True},
+            timeout=httpx.Timeout(timeout, connect=min(5.0, timeout)),
+        ) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                piece = _delta(json.loads(data))
+                if piece:
+                    yield piece
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class StubProvider:
+    """Local provider for tests: `responder(body)` returns content text, a full payload or None."""
+
+    name = "stub"
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], Any]) -> None:
+        self.responder = responder
+        self.calls: List[Dict[str, Any]] = []
+
+    async def complete(self, body: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        self.calls.append(body)
+        out = self.responder(body)
+        if inspect.isawaitable(out):
+            out = await out
+        if isinstance(out, str):
+            return {"choices": [{"message": {"role": "assistant", "content": out}}]}
+        return out
+
+    async def stream(self, body: Dict[str, Any], timeout: float) -> AsyncIterator[str]:
+        # Text responses are replayed word by word; a list of strings is replayed as given.
+        self.calls.append(body)
+        out = self.responder(body)
+        if inspect.isawaitable(out):
+            out = await out
+        if isinstance(out, dict):
+            out = _content(out)
+        pieces = re.findall(r"\S+\s*|\s+", out) if isinstance(out, str) else (out or [])
+        for piece in pieces:
+            yield piece
+
+    async def aclose(self) -> None:
+        return None
+
+
+_provider: Any = HFRouterProvider()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    # All upstream I/O runs on one dedicated loop so the pool is shared by sync
+    # threadpool callers and async routes alike.
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            t = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+            t.start()
+            _loop = loop
+        return _loop
+
+
+def _submit(coro: Awaitable[Any]) -> "Future[Any]":
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def get_provider() -> Any:
+    return _provider
+
+
+def set_provider(provider: Any) -> Any:
+    """Swap the active provider (e.g. a StubProvider in tests). Returns the previous one.
+
+    Breaker state belongs to the provider, so it starts fresh.
+    """
+    global _provider
+    prev = _provider
+    _provider = provider
+    with _breakers_lock:
+        _breakers.clear()
+        _probing.clear()
+    return prev
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_probing: Dict[str, bool] = {}
+_breakers_lock = threading.Lock()
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        b = _breakers.get(model)
+        if b is None:
+            b = CircuitBreaker(_BREAKER_WINDOW, _BREAKER_MIN_CALLS, _BREAKER_FAILURE_RATIO, _BREAKER_SLOW_CALL)
+            _breakers[model] = b
+        return b
+
+
+def breaker_stats() -> Dict[str, Any]:
+    with _breakers_lock:
+        items = list(_breakers.items())
+    return {model: b.stats() for model, b in items}
+
+
+def _is_failure(e: BaseException) -> bool:
+    # Client errors (bad request, auth) say nothing about upstream health.
+    if isinstance(e, httpx.HTTPStatusError):
+        code = e.response.status_code
+        return code >= 500 or code in (408, 429)
+    return not isinstance(e, asyncio.CancelledError)
+
+
+async def _probe(model: str, provider: Any) -> None:
+    # Runs on the gateway loop while the breaker is open; user requests never wait on it.
+    delay = _BREAKER_COOLDOWN
+    body = {"model": model, "messages": [{"role": "user", "content": "ping"}], "max_tokens": 1}
+    try:
+        while _provider is provider and _breaker(model).is_open:
+            await asyncio.sleep(delay)
+            try:
+                await asyncio.wait_for(provider.complete(body, _PROBE_TIMEOUT), _PROBE_TIMEOUT)
+                _breaker(model).close()
+                return
+            except Exception:
+                delay = min(delay * 2, _PROBE_MAX)
+    finally:
+        with _breakers_lock:
+            _probing.pop(model, None)
+
+
+def _start_probe(model: str) -> None:
+    with _breakers_lock:
+        if _probing.get(model):
+            return
+        _probing[model] = True
+    _get_loop().call_soon_threadsafe(lambda: asyncio.ensure_future(_probe(model, _provider)))
+
+
+def _record(model: str, ok: bool, started: float) -> None:
+    if _breaker(model).record(ok, time.monotonic() - started):
+        _start_probe(model)
+
+
+def _models(payload: Dict[str, Any]) -> List[str]:
+    """Models allowed to serve this call, primary first; raises CircuitOpen if none is."""
+    primary = payload.get("model") or default_model()
+    candidates = [primary]
+    second = secondary_model()
+    if second and second != primary:
+        candidates.append(second)
+    allowed = [m for m in candidates if _breaker(m).allow()]
+    if not allowed:
+        raise CircuitOpen(f"upstream circuit open for {', '.join(candidates)}")
+    return allowed
+
+
+async def _attempt(model: str, payload: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+    started = time.monotonic()
+    try:
+        out = await asyncio.wait_for(_provider.complete({**payload, "model": model}, timeout), timeout)
+    except BaseException as e:
+        if _is_failure(e):
+            _record(model, False, started)
+        raise
+    if out is not None:
+        _record(model, True, started)
+    return out
+
+
+async def _complete(payload: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+    models = _models(payload)
+    if len(models) == 1:
+        return await _attempt(models[0], payload, timeout)
+    # Hedge: give the primary a head start, then race the secondary against it.
+    started = time.monotonic()
+    first = asyncio.ensure_future(_attempt(models[0], payload, timeout))
+    await asyncio.wait({first}, timeout=_HEDGE_AFTER)
+    if first.done() and first.exception() is None:
+        return first.result()
+    remaining = max(1.0, timeout - (time.monotonic() - started))
+    pending = {asyncio.ensure_future(_attempt(models[1], payload, remaining))}
+    if not first.done():
+        pending.add(first)
+    error: Optional[BaseException] = first.exception() if first.done() else None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                error = t.exception()
+        assert error is not None
+        raise error
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+def _content(data: Any) -> Optional[str]:
+    if isinstance(data, dict) and "choices" in data:
+        ch = data["choices"]
+        if isinstance(ch, list) and ch:
+            msg = ch[0].get("message", {})
+            return msg.get("content")
+    return None
+
+
+def _delta(chunk: Any) -> Optional[str]:
+    if isinstance(chunk, dict) and chunk.get("choices"):
+        return (chunk["choices"][0].get("delta") or {}).get("content")
+    return None
+
+
+def _body(messages: Any, model: Optional[str]) -> Dict[str, Any]:
+    return {"model": model or default_model(), "messages": messages}
+
+
+def chat_completion(payload: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Raw chat-completions call. Returns None when no provider key is set; raises on upstream errors."""
+    return _submit(_complete(payload, timeout or DEFAULT_TIMEOUT)).result()
+
+
+async def chat_completion_async(payload: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    return await asyncio.wrap_future(_submit(_complete(payload, timeout or DEFAULT_TIMEOUT)))
+
+
+def run(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine on the gateway loop from synchronous code and wait for its result.
+
+    Safe on threads that already have a running loop, unlike asyncio.run; must
+    not be called from the gateway loop itself.
+    """
+    return _submit(coro).result()
+
+
+def chat(messages: Any, model: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
+    """Return the first choice's content, or None on any failure."""
+    try:
+        return _content(chat_completion(_body(messages, model), timeout))
+    except Exception:
+        return None
+
+
+async def chat_async(messages: Any, model: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
+    try:
+        return _content(await chat_completion_async(_body(messages, model), timeout))
+    except Exception:
+        return None
+
+
+async def chat_stream(
+    messages: Any, model: Optional[str] = None, timeout: Optional[float] = None
+) -> AsyncIterator[str]:
+    """Yield completion text as the upstream produces it; raises on upstream errors.
+
+    The provider runs on the gateway loop and hands pieces to the caller's loop,
+    so the keep-alive pool stays shared with the non-streaming calls. Closing the
+    iterator early cancels the upstream request.
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue[Any]" = asyncio.Queue()
+    done = object()
+    budget = timeout or DEFAULT_TIMEOUT
+
+    def hand(item: Any) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # caller's loop already closed
+
+    async def pump() -> None:
+        body = _body(messages, model)
+        started = time.monotonic()
+        chosen = body["model"]
+        first = True
+        try:
+            # No hedging mid-stream; an open primary breaker routes to the secondary model.
+            chosen = _models(body)[0]
+            async for piece in _provider.stream({**body, "model": chosen}, budget):
+                if first:
+                    # Judged on time to first token; long completions are not slow calls.
+                    _record(chosen, True, started)
+                    first = False
+                hand(piece)
+            hand(done)
+        except BaseException as e:
+            if first and not isinstance(e, CircuitOpen) and _is_failure(e):
+                _record(chosen, False, started)
+            hand(e)
+            raise
+
+    fut = _submit(pump())
+    try:
+        while True:
+            item = await asyncio.wait_for(queue.get(), budget)
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        fut.cancel()
+
+
+def shutdown() -> None:
+    global _loop
+    with _loop_lock:
+        loop = _loop
+        _loop = None
+    if loop is None or loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_provider.aclose(), loop).result(timeout=5)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,388 @@
+import os
+import json
+import asyncio
+import logging
+import secrets
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.services.horoscope_service import generate_daily_async, peek_daily
+from app.services.email_service import send_batch
+from app.utils.storage import iter_subscribers
+from app.utils.sqlite import ThreadLocalSQLite
+
+logger = logging.getLogger(__name__)
+
+SUBJECT = "Your Daily Horoscope"
+
+# Bounded fan-out per shard: concurrent LLM generations and SMTP batch deliveries.
+_GEN_CONCURRENCY = int(os.environ.get("HOROSCOPE_SEND_GEN_CONCURRENCY", "8"))
+_MAIL_CONCURRENCY = int(os.environ.get("HOROSCOPE_SEND_MAIL_CONCURRENCY", "4"))
+_BATCH_SIZE = int(os.environ.get("HOROSCOPE_SEND_BATCH_SIZE", "50"))
+# A shard whose worker stops checkpointing for this long can be claimed by another worker.
+_SHARD_LEASE = float(os.environ.get("MAILING_SHARD_LEASE", "300"))
+# A failed recipient stays pending until it has been tried this many times; later failures are final.
+_MAX_ATTEMPTS = int(os.environ.get("MAILING_MAX_ATTEMPTS", "3"))
+_RETRY_DELAY = float(os.environ.get("MAILING_RETRY_DELAY", "30"))
+
+def render_email(result: Dict[str, Any]) -> str:
+    text = result.get("text", "")
+    mood = result.get("mood", "")
+    energy = result.get("energy", 3)
+    focus = result.get("focus", "self-care")
+    return (
+        f"Your Daily Horoscope\n\n"
+        f"Philosophy: {result.get('philosophy')}\n"
+        f"Mode: {result.get('mode')}\n"
+        f"Mood: {mood}\nEnergy: {energy}\nFocus: {focus}\n\n"
+        f"{text}\n\n"
+        f"Do: {result.get('do')}\nDon't: {result.get('dont')}\n\n"
+        f"Lucky Color: {result.get('lucky_color')}\nLucky Number: {result.get('lucky_number')}\n"
+    )
+
+def profile(s: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any], Dict[str, Any]]:
+    return (s.get("philosophy"), s.get("mode"), s.get("inputs") or {}, s.get("preferences") or {})
+
+def profile_key(s: Dict[str, Any]) -> str:
+    return json.dumps(profile(s), sort_keys=True, ensure_ascii=False)
+
+def _shard_of(email: str, shards: int) -> int:
+    return zlib.crc32(email.encode("utf-8")) % shards
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+class MailingJobStore:
+    """SQLite checkpoint store for daily mailing jobs.
+
+    A job snapshots its recipients at creation; each recipient row moves from
+    pending to sent/failed as batches complete, so a resumed shard only sees
+    what is still pending. Failed rows count their attempts and stay eligible
+    for delivery until they reach the retry limit. Shards are leased so several
+    workers can split a job.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = ThreadLocalSQLite(path)
+        conn = self._db.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, day TEXT NOT NULL, shards INTEGER NOT NULL, total INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, finished_at REAL, unique_profiles INTEGER NOT NULL DEFAULT 0, "
+            "cache_hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_day ON jobs(day)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "job_id TEXT NOT NULL, email TEXT NOT NULL, shard INTEGER NOT NULL, subscriber TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', updated_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (job_id, email))"
+        )
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(deliveries)").fetchall()}
+        if "attempts" not in columns:
+            conn.execute("ALTER TABLE deliveries ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS deliveries_shard ON deliveries(job_id, shard, status)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shard_leases ("
+            "job_id TEXT NOT NULL, shard INTEGER NOT NULL, owner TEXT, lease_until REAL NOT NULL DEFAULT 0, "
+            "done INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (job_id, shard))"
+        )
+
+    def job_for_day(self, day: str) -> Optional[str]:
+        row = self._db.conn().execute(
+            "SELECT id FROM jobs WHERE day = ? ORDER BY created_at DESC LIMIT 1", (day,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def create_job(self, day: str, subscribers: Iterable[Dict[str, Any]], shards: int) -> str:
+        job_id = secrets.token_hex(8)
+        now = time.time()
+        rows = {}
+        profiles = set()
+        for s in subscribers:
+            email = s.get("email")
+            if email:
+                rows[email] = (job_id, email, _shard_of(email, shards), json.dumps(s, ensure_ascii=False))
+                profiles.add(profile_key(s))
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO jobs(id, day, shards, total, created_at, unique_profiles) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, day, shards, len(rows), now, len(profiles)),
+            )
+            conn.executemany(
+                "INSERT INTO deliveries(job_id, email, shard, subscriber) VALUES (?, ?, ?, ?)", rows.values()
+            )
+            conn.executemany(
+                "INSERT INTO shard_leases(job_id, shard) VALUES (?, ?)", [(job_id, i) for i in range(shards)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def claim_shard(self, job_id: str, owner: str, lease: float) -> Optional[int]:
+        now = time.time()
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT shard FROM shard_leases WHERE job_id = ? AND done = 0 AND lease_until < ? ORDER BY shard LIMIT 1",
+                (job_id, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE shard_leases SET owner = ?, lease_until = ? WHERE job_id = ? AND shard = ?",
+                    (owner, now + lease, job_id, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def renew(self, job_id: str, shard: int, owner: str, lease: float) -> bool:
+        """Extend `owner`'s lease on a shard; False once the shard has passed to another owner."""
+        cur = self._db.conn().execute(
+            "UPDATE shard_leases SET lease_until = ? WHERE job_id = ? AND shard = ? AND owner = ? AND done = 0",
+            (time.time() + lease, job_id, shard, owner),
+        )
+        return cur.rowcount > 0
+
+    def pending(self, job_id: str, shard: int, max_attempts: int = 1) -> List[Dict[str, Any]]:
+        """Recipients still to deliver: never tried, or failed fewer than `max_attempts` times."""
+        rows = self._db.conn().execute(
+            "SELECT subscriber FROM deliveries WHERE job_id = ? AND shard = ? "
+            "AND (status = 'pending' OR (status = 'failed' AND attempts < ?))",
+            (job_id, shard, max_attempts),
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def mark(self, job_id: str, results: List[Tuple[str, bool]], owner: Optional[str] = None) -> None:
+        """Record delivery results; with `owner`, only rows of shards that owner still leases change."""
+        now = time.time()
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if owner is None:
+                conn.executemany(
+                    "UPDATE deliveries SET status = ?, updated_at = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND email = ?",
+                    [("sent" if ok else "failed", now, job_id, email) for email, ok in results],
+                )
+            else:
+                conn.executemany(
+                    "UPDATE deliveries SET status = ?, updated_at = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND email = ? AND shard IN "
+                    "(SELECT shard FROM shard_leases WHERE job_id = ? AND owner = ?)",
+                    [("sent" if ok else "failed", now, job_id, email, job_id, owner) for email, ok in results],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add_cache_hits(self, job_id: str, cache_hits: int) -> None:
+        self._db.conn().execute(
+            "UPDATE jobs SET cache_hits = cache_hits + ? WHERE id = ?", (cache_hits, job_id)
+        )
+
+    def finish_shard(self, job_id: str, shard: int, owner: str) -> bool:
+        """Mark a shard done; False if its lease has since passed to another owner."""
+        conn = self._db.conn()
+        cur = conn.execute(
+            "UPDATE shard_leases SET done = 1 WHERE job_id = ? AND shard = ? AND owner = ?", (job_id, shard, owner)
+        )
+        if not cur.rowcount:
+            return False
+        left = conn.execute(
+            "SELECT COUNT(*) FROM shard_leases WHERE job_id = ? AND done = 0", (job_id,)
+        ).fetchone()[0]
+        if left == 0:
+            conn.execute(
+                "UPDATE jobs SET finished_at = COALESCE(finished_at, ?) WHERE id = ?", (time.time(), job_id)
+            )
+        return True
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._db.conn()
+        job = conn.execute(
+            "SELECT day, shards, total, created_at, finished_at, unique_profiles, cache_hits FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if job is None:
+            return None
+        day, shards, total, created_at, finished_at, unique_profiles, cache_hits = job
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM deliveries WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        last = conn.execute(
+            "SELECT MAX(updated_at) FROM deliveries WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        shards_done = conn.execute(
+            "SELECT COUNT(*) FROM shard_leases WHERE job_id = ? AND done = 1", (job_id,)
+        ).fetchone()[0]
+        sent = counts.get("sent", 0)
+        failed = counts.get("failed", 0)
+        elapsed = ((finished_at or last or created_at) - created_at) if (sent or failed) else 0.0
+        return {
+            "job_id": job_id,
+            "day": day,
+            "status": "completed" if finished_at else "running",
+            "total": total,
+            "sent": sent,
+            "failed": failed,
+            "pending": counts.get("pending", 0),
+            "shards": shards,
+            "shards_done": shards_done,
+            "unique_profiles": unique_profiles,
+            "cache_hits": cache_hits,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round((sent + failed) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+_store: Optional[MailingJobStore] = None
+_store_lock = threading.Lock()
+
+def _default_path() -> str:
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base, "data", "mailing_jobs.db")
+
+def get_store() -> MailingJobStore:
+    global _store
+    path = os.environ.get("MAILING_JOBS_PATH") or _default_path()
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = MailingJobStore(path)
+        return _store
+
+
+async def _heartbeat(store: MailingJobStore, job_id: str, shard: int, owner: str, lost: asyncio.Event) -> None:
+    # Keep the lease alive for the whole shard run, generation included.
+    while not lost.is_set():
+        await asyncio.sleep(_SHARD_LEASE / 3)
+        if not await asyncio.to_thread(store.renew, job_id, shard, owner, _SHARD_LEASE):
+            lost.set()
+
+async def _run_shard(store: MailingJobStore, job_id: str, shard: int, owner: str) -> None:
+    lost = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(store, job_id, shard, owner, lost))
+    try:
+        # Failed recipients stay pending, so each pass retries them until they
+        # are delivered or reach _MAX_ATTEMPTS.
+        first = True
+        while not lost.is_set():
+            subs = await asyncio.to_thread(store.pending, job_id, shard, _MAX_ATTEMPTS)
+            if not subs:
+                break
+            if not first:
+                await asyncio.sleep(_RETRY_DELAY)
+            first = False
+            await _process_shard(store, job_id, shard, owner, subs, lost)
+    finally:
+        heartbeat.cancel()
+    if lost.is_set() or not await asyncio.to_thread(store.finish_shard, job_id, shard, owner):
+        logger.warning("mailing job %s shard %s was reclaimed before it finished", job_id, shard)
+
+async def _process_shard(
+    store: MailingJobStore, job_id: str, shard: int, owner: str, subs: List[Dict[str, Any]], lost: asyncio.Event
+) -> None:
+    # Subscribers sharing a (philosophy, mode, inputs, preferences) profile share one generation.
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for s in subs:
+        groups.setdefault(profile_key(s), []).append(s)
+
+    gen_sem = asyncio.Semaphore(_GEN_CONCURRENCY)
+    cache_hits = 0
+
+    async def _generate(members: List[Dict[str, Any]]) -> Optional[str]:
+        nonlocal cache_hits
+        p = profile(members[0])
+        if peek_daily(*p) is not None:
+            cache_hits += 1
+        async with gen_sem:
+            try:
+                return render_email(await generate_daily_async(*p))
+            except Exception:
+                return None
+
+    keys = list(groups)
+    bodies = await asyncio.gather(*[_generate(groups[k]) for k in keys])
+    await asyncio.to_thread(store.add_cache_hits, job_id, cache_hits)
+    if lost.is_set():
+        return
+
+    failed_now: List[Tuple[str, bool]] = []
+    items: List[Tuple[str, str, str]] = []
+    for k, body in zip(keys, bodies):
+        if body is None:
+            failed_now.extend((s.get("email"), False) for s in groups[k])
+            continue
+        items.extend((s.get("email"), SUBJECT, body) for s in groups[k])
+    if failed_now:
+        await asyncio.to_thread(store.mark, job_id, failed_now, owner)
+
+    mail_sem = asyncio.Semaphore(_MAIL_CONCURRENCY)
+
+    async def _deliver(batch: List[Tuple[str, str, str]]) -> None:
+        # One pooled SMTP session per batch, checkpointed as soon as it returns.
+        async with mail_sem:
+            # Confirm ownership right before sending so a reclaimed shard is never delivered twice.
+            if lost.is_set() or not await asyncio.to_thread(store.renew, job_id, shard, owner, _SHARD_LEASE):
+                lost.set()
+                return
+            try:
+                results = await asyncio.to_thread(send_batch, batch)
+            except Exception:
+                results = [False] * len(batch)
+            await asyncio.to_thread(store.mark, job_id, [(to, ok) for (to, _, _), ok in zip(batch, results)], owner)
+
+    batches = [items[i:i + _BATCH_SIZE] for i in range(0, len(items), _BATCH_SIZE)]
+    await asyncio.gather(*[_deliver(b) for b in batches])
+
+async def run_job(job_id: str) -> None:
+    """Claim and process shards of `job_id` until none are left unleased."""
+    store = get_store()
+    owner = f"{os.getpid()}:{secrets.token_hex(4)}"
+    while True:
+        shard = await asyncio.to_thread(store.claim_shard, job_id, owner, _SHARD_LEASE)
+        if shard is None:
+            return
+        await _run_shard(store, job_id, shard, owner)
+
+def start_runner(job_id: str) -> threading.Thread:
+    def _target() -> None:
+        try:
+            asyncio.run(run_job(job_id))
+        except Exception as e:
+            logger.exception("mailing job %s failed: %s", job_id, e)
+
+    t = threading.Thread(target=_target, name=f"mailing-{job_id}", daemon=True)
+    t.start()
+    return t
+
+def start_daily_job(shards: int = 1, force: bool = False) -> str:
+    """Create (or resume) today's mailing job and start processing it in the background."""
+    store = get_store()
+    day = _today()
+    job_id = None if force else store.job_for_day(day)
+    if job_id is None:
+        job_id = store.create_job(day, iter_subscribers(), max(1, shards))
+    start_runner(job_id)
+    return job_id
+
+def resume_job(job_id: str) -> bool:
+    if get_store().status(job_id) is None:
+        return False
+    start_runner(job_id)
+    return True
+
+def job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_store().status(job_id)
@@ -0,0 +1,368 @@
+import os
+import json
+import asyncio
+import ipaddress
+import logging
+import secrets
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional
+import httpx
+from app.services.scribe_service import attribute_dialogue_async, summarize_note_async
+from app.utils.sqlite import ThreadLocalSQLite
+
+logger = logging.getLogger(__name__)
+
+# Jobs processed concurrently by this process; further jobs wait in the table.
+_WORKERS = int(os.environ.get("SCRIBE_JOB_WORKERS", "4"))
+# Queued jobs beyond this are refused so the backlog stays bounded.
+_MAX_QUEUED = int(os.environ.get("SCRIBE_JOB_MAX_QUEUED", "200"))
+# A running job whose worker disappears is retried after its lease expires.
+_LEASE = float(os.environ.get("SCRIBE_JOB_LEASE", "300"))
+_MAX_ATTEMPTS = 3
+# Finished jobs are kept this long for polling.
+_TTL = float(os.environ.get("SCRIBE_JOB_TTL", "86400"))
+# Workers also poll, to pick up jobs queued by other processes.
+_POLL = 1.0
+
+OPS = ("attribute", "summarize")
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+def _callback_hosts() -> set:
+    # Hosts trusted as callback targets even if they resolve to private addresses.
+    return {h.strip().lower() for h in os.environ.get("SCRIBE_CALLBACK_HOSTS", "").split(",") if h.strip()}
+
+def validate_callback(url: str) -> str:
+    """Check a callbackUrl: a well-formed http(s) URL on an allowlisted host or on public addresses only.
+
+    Loopback, private, link-local (cloud metadata) and other non-global targets
+    are refused unless the host is listed in SCRIBE_CALLBACK_HOSTS, so job
+    results cannot be posted into the server's own network.
+    """
+    try:
+        parsed = httpx.URL(url)
+    except Exception:
+        raise InvalidCallback("callbackUrl is not a valid URL")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise InvalidCallback("callbackUrl must be an http(s) URL")
+    host = parsed.host.lower()
+    if host in _callback_hosts():
+        return str(parsed)
+    try:
+        infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError):
+        raise InvalidCallback("callbackUrl host does not resolve")
+    for info in infos:
+        if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+            raise InvalidCallback("callbackUrl must point to a public address")
+    return str(parsed)
+
+
+class ScribeJobStore:
+    """SQLite table of scribe jobs, shared by every worker process.
+
+    Jobs move queued -> running -> completed/failed. A running job holds a lease;
+    when the worker that claimed it disappears the lease expires and another
+    worker picks it up, up to a few attempts.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = ThreadLocalSQLite(path)
+        conn = self._db.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, op TEXT NOT NULL, params TEXT NOT NULL, callback_url TEXT, "
+            "status TEXT NOT NULL DEFAULT 'queued', result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "owner TEXT, lease_until REAL, callback_status TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+
+    def create(self, op: str, params: Dict[str, Any], callback_url: Optional[str] = None) -> str:
+        conn = self._db.conn()
+        now = time.time()
+        job_id = secrets.token_hex(8)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - _TTL,))
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= _MAX_QUEUED:
+                conn.execute("COMMIT")
+                raise QueueFull(f"{queued} jobs already queued")
+            conn.execute(
+                "INSERT INTO jobs(id, op, params, callback_url, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, op, json.dumps(params, ensure_ascii=False), callback_url, now),
+            )
+            conn.execute("COMMIT")
+        except QueueFull:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def claim(self, owner: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Take the oldest queued job (or one whose lease expired) for `lease` seconds.
+
+        A job whose lease ran out `_MAX_ATTEMPTS` times is failed instead and
+        returned as {"id", "lost": True}, so the caller can still fire its callback.
+        """
+        conn = self._db.conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, op, params, attempts FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, op, params, attempts = row
+            if attempts >= _MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker lost', finished_at = ? WHERE id = ?",
+                    (now, job_id),
+                )
+                conn.execute("COMMIT")
+                return {"id": job_id, "lost": True}
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (owner, now + lease, now, job_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {"id": job_id, "op": op, "params": json.loads(params)}
+
+    def finish(self, job_id: str, owner: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> bool:
+        cur = self._db.conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND owner = ? AND status = 'running'",
+            (
+                "failed" if error else "completed",
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                time.time(),
+                job_id,
+                owner,
+            ),
+        )
+        return (cur.rowcount or 0) > 0
+
+    def renew(self, job_id: str, owner: str, lease: float) -> bool:
+        cur = self._db.conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (time.time() + lease, job_id, owner),
+        )
+        return (cur.rowcount or 0) > 0
+
+    def set_callback_status(self, job_id: str, status: str) -> None:
+        self._db.conn().execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._db.conn().execute(
+            "SELECT op, status, result, error, attempts, callback_url, callback_status, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        op, status, result, error, attempts, callback_url, callback_status, created, started, finished = row
+        return {
+            "jobId": job_id,
+            "op": op,
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "attempts": attempts,
+            "callbackUrl": callback_url,
+            "callbackStatus": callback_status,
+            "createdAt": created,
+            "startedAt": started,
+            "finishedAt": finished,
+        }
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._db.conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+_store: Optional[ScribeJobStore] = None
+_store_lock = threading.Lock()
+
+def _default_path() -> str:
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base, "data", "scribe_jobs.db")
+
+def get_store() -> ScribeJobStore:
+    global _store
+    path = os.environ.get("SCRIBE_JOBS_PATH") or _default_path()
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = ScribeJobStore(path)
+        return _store
+
+
+async def _execute(op: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    if op == "attribute":
+        return await attribute_dialogue_async(
+            segments=params.get("segments"), audio_file_id=params.get("fileId"), use_cache=params.get("cache", True)
+        )
+    return await summarize_note_async(
+        transcript=params.get("transcript") or "",
+        dialogue=params.get("dialogue"),
+        audio_file_id=params.get("audioFileId"),
+        use_cache=params.get("cache", True),
+    )
+
+async def _callback(client: httpx.AsyncClient, store: ScribeJobStore, job_id: str) -> None:
+    state = await asyncio.to_thread(store.get, job_id)
+    if not state or not state["callbackUrl"]:
+        return
+    status = "failed"
+    for attempt in range(3):
+        try:
+            # Re-checked at send time: the host may resolve differently than at submit.
+            url = await asyncio.to_thread(validate_callback, state["callbackUrl"])
+            r = await client.post(url, json=state, timeout=10.0)
+            if r.status_code < 400:
+                status = "delivered"
+                break
+        except InvalidCallback as e:
+            logger.warning("scribe job %s callback refused: %s", job_id, e)
+            status = "refused"
+            break
+        except Exception as e:
+            logger.info("scribe job %s callback attempt %d failed: %s", job_id, attempt + 1, e)
+        await asyncio.sleep(0.5 * 2 ** attempt)
+    await asyncio.to_thread(store.set_callback_status, job_id, status)
+
+
+class JobRunner:
+    """Bounded pool of asyncio workers on one background loop thread.
+
+    Submitting wakes an idle worker immediately; workers otherwise poll the
+    shared table so jobs queued by other processes are picked up too.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = max(1, workers)
+        self.owner = f"{os.getpid()}:{secrets.token_hex(4)}"
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self.busy = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run() -> None:
+                asyncio.set_event_loop(loop)
+                self._wake = asyncio.Event()
+                self._client = httpx.AsyncClient()
+                for _ in range(self.workers):
+                    loop.create_task(self._worker())
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=_run, name="scribe-jobs", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+
+    def notify(self) -> None:
+        self.start()
+        assert self._loop is not None and self._wake is not None
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _worker(self) -> None:
+        assert self._wake is not None
+        while True:
+            # Cleared before claiming, so a submit that lands mid-claim still wakes us.
+            self._wake.clear()
+            try:
+                store = get_store()
+                job = await asyncio.to_thread(store.claim, self.owner, _LEASE)
+            except Exception as e:
+                logger.warning("scribe job claim failed: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), _POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.busy += 1
+            try:
+                # Nothing may escape: a dead worker task is never replaced.
+                if job.get("lost"):
+                    await _callback(self._client, store, job["id"])
+                    continue
+                heartbeat = asyncio.ensure_future(self._heartbeat(store, job["id"]))
+                try:
+                    result, error = await _execute(job["op"], job["params"]), None
+                except Exception as e:
+                    result, error = None, str(e) or e.__class__.__name__
+                finally:
+                    heartbeat.cancel()
+                if await asyncio.to_thread(store.finish, job["id"], self.owner, result, error):
+                    await _callback(self._client, store, job["id"])
+            except Exception as e:
+                logger.exception("scribe job %s: finish/callback failed: %s", job["id"], e)
+            finally:
+                self.busy -= 1
+
+    async def _heartbeat(self, store: ScribeJobStore, job_id: str) -> None:
+        # Keep the lease alive while a long job (e.g. a map-reduce summary) runs.
+        while True:
+            await asyncio.sleep(_LEASE / 3)
+            try:
+                await asyncio.to_thread(store.renew, job_id, self.owner, _LEASE)
+            except Exception as e:
+                logger.warning("scribe job %s lease renewal failed: %s", job_id, e)
+
+
+_runner = JobRunner(_WORKERS)
+
+def submit(op: str, params: Dict[str, Any], callback_url: Optional[str] = None) -> str:
+    """Queue a job and wake a worker; raises QueueFull when the backlog is at its limit."""
+    if op not in OPS:
+        raise ValueError(f"Unknown job type: {op}")
+    if callback_url:
+        callback_url = validate_callback(callback_url)
+    job_id = get_store().create(op, params, callback_url)
+    _runner.notify()
+    return job_id
+
+def job_state(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_store().get(job_id)
+
+def queue_stats() -> Dict[str, Any]:
+    counts = get_store().counts()
+    return {
+        "workers": _runner.workers,
+        "busy": _runner.busy,
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "completed": counts.get("completed", 0),
+        "failed": counts.get("failed", 0),
+        "max_queued": _MAX_QUEUED,
+    }
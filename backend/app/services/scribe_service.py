@@ -1,58 +1,152 @@
 import os
-import requests
-from typing import Optional, List, Dict, Any
+import re
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from app.services import llm_gateway
+from app.utils.disk_cache import SQLiteLRUCache
+from app.utils.uploads import content_id
 
-def _hf_key() -> Optional[str]:
-    return os.environ.get("HF_API_KEY")
+# Per-call budget for upstream completions (seconds).
+_LLM_TIMEOUT = float(os.environ.get("SCRIBE_LLM_TIMEOUT", "30"))
 
-def _hf_model() -> str:
-    return os.environ.get("HF_MODEL", "moonshotai/Kimi-K2-Instruct:novita")
+# Transcripts longer than one window are summarized map-reduce style.
+_WINDOW_TOKENS = int(os.environ.get("SCRIBE_WINDOW_TOKENS", "3000"))
+_MAP_CONCURRENCY = int(os.environ.get("SCRIBE_MAP_CONCURRENCY", "4"))
 
 def _hf_chat(messages: List[Dict[str, str]]) -> Optional[str]:
-    key = _hf_key()
-    if not key:
+    return llm_gateway.chat(messages, timeout=_LLM_TIMEOUT)
+
+async def _hf_chat_async(messages: List[Dict[str, str]]) -> Optional[str]:
+    return await llm_gateway.chat_async(messages, timeout=_LLM_TIMEOUT)
+
+# Bump when prompts or result shapes change so older cached results stop matching.
+_PROMPT_VERSION = 1
+
+_cache: Optional[SQLiteLRUCache] = None
+_cache_lock = threading.Lock()
+
+def _cache_path() -> str:
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.environ.get("SCRIBE_CACHE_PATH") or os.path.join(base, "data", "scribe_cache.db")
+
+def get_cache() -> SQLiteLRUCache:
+    global _cache
+    path = _cache_path()
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            _cache = SQLiteLRUCache(
+                path,
+                max_entries=int(os.environ.get("SCRIBE_CACHE_MAX_ENTRIES", "5000")),
+                max_bytes=int(os.environ.get("SCRIBE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                ttl=float(os.environ.get("SCRIBE_CACHE_TTL", str(7 * 86400))),
+            )
+        return _cache
+
+def _normalize(text: str) -> str:
+    # Whitespace-only differences (trailing spaces, CRLF, blank lines) share one entry.
+    return "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+
+def _result_key(op: str, messages: List[Dict[str, str]], audio_file_id: Optional[str], has_text: bool) -> Optional[str]:
+    """Cache key over prompt version, model and normalized input; None when there is nothing to key on."""
+    if has_text:
+        content = _normalize(messages[-1]["content"])
+    else:
+        # File-only requests are keyed by the upload's content hash, not its path.
+        cid = content_id(audio_file_id)
+        if not cid:
+            return None
+        content = f"file:{cid}"
+    basis = {
+        "v": _PROMPT_VERSION,
+        "op": op,
+        "model": llm_gateway.default_model(),
+        "provider": getattr(llm_gateway.get_provider(), "name", ""),
+        "system": messages[0]["content"],
+        "content": content,
+    }
+    return hashlib.sha256(json.dumps(basis, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cached(key: Optional[str]) -> Optional[Dict[str, Any]]:
+    if key is None:
         return None
-    url = "https://router.huggingface.co/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-    body = {"model": _hf_model(), "messages": messages}
+    hit = get_cache().get(key)
+    return {**hit, "provider": "cache"} if hit is not None else None
+
+def _remember(key: Optional[str], result: Dict[str, Any]) -> Dict[str, Any]:
+    if key is not None and result.get("provider") == "huggingface":
+        get_cache().put(key, result)
+    return result
+
+async def _cached_async(key: Optional[str]) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(_cached, key) if key else None
+
+async def _remember_async(key: Optional[str], result: Dict[str, Any]) -> Dict[str, Any]:
+    return await asyncio.to_thread(_remember, key, result) if key else result
+
+async def _stream_result(
+    key: Optional[Any],
+    messages: Union[List[Dict[str, str]], Callable[[], Awaitable[Optional[List[Dict[str, str]]]]]],
+    field: str,
+    result_of: Callable[[Optional[str]], Dict[str, Any]],
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ("delta", {"text"}) events as the completion arrives, then ("done", result).
+
+    Concatenating the deltas always gives result[field]: cached and fallback
+    results are sent as a single delta. An upstream failure after text has
+    been sent ends the stream with ("error", {"error"}) instead. `messages` may
+    be an async builder, run only on a cache miss; None from it means fallback.
+    """
+    hit = await _cached_async(key)
+    if hit is not None:
+        yield "delta", {"text": hit[field]}
+        yield "done", hit
+        return
+    if callable(messages):
+        messages = await messages()
+    parts: List[str] = []
     try:
-        r = requests.post(url, headers=headers, json=body, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        if isinstance(data, dict) and "choices" in data:
-            ch = data["choices"]
-            if isinstance(ch, list) and ch:
-                msg = ch[0].get("message", {})
-                return msg.get("content")
-    except Exception:
-        return None
-    return None
-
-def attribute_dialogue(segments: Optional[List[Any]] = None, audio_file_id: Optional[str] = None) -> Dict[str, Any]:
-    def _seg_text(s: Any) -> str:
-        if isinstance(s, dict):
-            return str(s.get("text", ""))
-        # Pydantic BaseModel (v1/v2) or simple object
-        t = getattr(s, "text", None)
-        if t is None:
+        if messages is not None:
+            async for piece in llm_gateway.chat_stream(messages, timeout=_LLM_TIMEOUT):
+                parts.append(piece)
+                yield "delta", {"text": piece}
+    except Exception as e:
+        if parts:
+            yield "error", {"error": str(e) or e.__class__.__name__}
+            return
+    result = result_of("".join(parts) or None)
+    if not parts and result[field]:
+        yield "delta", {"text": result[field]}
+    yield "done", await _remember_async(key, result)
+
+def _seg_text(s: Any) -> str:
+    if isinstance(s, dict):
+        return str(s.get("text", ""))
+    # Pydantic BaseModel (v1/v2) or simple object
+    t = getattr(s, "text", None)
+    if t is None:
+        try:
+            # v2: model_dump
+            t = s.model_dump().get("text")  # type: ignore[attr-defined]
+        except Exception:
             try:
-                # v2: model_dump
-                t = s.model_dump().get("text")  # type: ignore[attr-defined]
+                # v1: dict
+                t = s.dict().get("text")  # type: ignore[attr-defined]
             except Exception:
-                try:
-                    # v1: dict
-                    t = s.dict().get("text")  # type: ignore[attr-defined]
-                except Exception:
-                    t = None
-        return str(t or "")
+                t = None
+    return str(t or "")
 
+def _attribute_messages(segments: Optional[List[Any]], audio_file_id: Optional[str]) -> List[Dict[str, str]]:
     content = "\n".join([_seg_text(s) for s in (segments or [])]).strip()
     sys_prompt = (
         "You are a medical scribe. Convert the conversation into labeled dialogue with lines prefixed as [Clinician] or [Patient]. "
         "Preserve chronological order and keep text unchanged except for labels."
     )
-    messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content or f"Audio file: {audio_file_id or ''}"}]
-    llm = _hf_chat(messages)
+    return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content or f"Audio file: {audio_file_id or ''}"}]
+
+def _attribute_result(llm: Optional[str], segments: Optional[List[Any]]) -> Dict[str, Any]:
     if llm:
         return {"dialogue": llm, "provider": "huggingface"}
     # Fallback minimal behavior
@@ -68,18 +162,222 @@ def attribute_dialogue(segments: Optional[List[Any]] = None, audio_file_id: Opti
         return {"dialogue": "\n".join(lines), "provider": "fallback"}
     return {"dialogue": "", "provider": "fallback"}
 
-def summarize_note(transcript: str, dialogue: Optional[str] = None, audio_file_id: Optional[str] = None) -> Dict[str, Any]:
+def attribute_dialogue(
+    segments: Optional[List[Any]] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
+    messages = _attribute_messages(segments, audio_file_id)
+    key = _result_key("attribute", messages, audio_file_id, bool(segments)) if use_cache else None
+    hit = _cached(key)
+    if hit is not None:
+        return hit
+    return _remember(key, _attribute_result(_hf_chat(messages), segments))
+
+async def attribute_dialogue_async(
+    segments: Optional[List[Any]] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
+    messages = _attribute_messages(segments, audio_file_id)
+    key = _result_key("attribute", messages, audio_file_id, bool(segments)) if use_cache else None
+    hit = await _cached_async(key)
+    if hit is not None:
+        return hit
+    return await _remember_async(key, _attribute_result(await _hf_chat_async(messages), segments))
+
+def attribute_dialogue_stream(
+    segments: Optional[List[Any]] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    messages = _attribute_messages(segments, audio_file_id)
+    return _stream_result(
+        _result_key("attribute", messages, audio_file_id, bool(segments)) if use_cache else None,
+        messages,
+        "dialogue",
+        lambda llm: _attribute_result(llm, segments),
+    )
+
+def _summarize_messages(transcript: str, dialogue: Optional[str]) -> List[Dict[str, str]]:
     content = dialogue or transcript or ""
     sys_prompt = (
         "You are a clinical scribe. Generate a clear, concise SOAP note (Subjective, Objective, Assessment, Plan) from the provided dialogue/transcript. "
         "Return markdown with section headings."
     )
-    messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content}]
-    llm = _hf_chat(messages)
+    return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content}]
+
+def _summarize_result(llm: Optional[str]) -> Dict[str, Any]:
     if llm:
         return {"note": llm, "provider": "huggingface"}
     # Minimal fallback
     note = (
         "# Subjective\n- N/A\n\n# Objective\n- N/A\n\n# Assessment\n- N/A\n\n# Plan\n- N/A"
     )
-    return {"note": note, "provider": "fallback"}
\ No newline at end of file
+    return {"note": note, "provider": "fallback"}
+
+def _tokens(text: str) -> int:
+    # Rough estimate (~4 characters per token); no tokenizer dependency needed for budgeting.
+    return len(text) // 4 + 1
+
+_TURN = re.compile(r"^\s*\[[^\]]+\]")
+
+def _turns(content: str) -> List[str]:
+    """Split a transcript into speaker turns; unlabelled lines continue the previous turn."""
+    turns: List[str] = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        if turns and not _TURN.match(line) and _TURN.match(turns[-1]):
+            turns[-1] += "\n" + line
+        else:
+            turns.append(line)
+    return turns
+
+def _windows(content: str, budget: int) -> List[str]:
+    """Pack whole turns into windows of at most `budget` tokens, splitting only oversized turns."""
+    limit = budget * 4
+    pieces: List[str] = []
+    for turn in _turns(content):
+        while _tokens(turn) > budget:
+            cut = turn.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            pieces.append(turn[:cut])
+            turn = turn[cut:].lstrip()
+        if turn:
+            pieces.append(turn)
+    return ["\n".join(group) for group in _pack(pieces, budget)]
+
+def _pack(pieces: List[str], budget: int) -> List[List[str]]:
+    groups: List[List[str]] = []
+    size = 0
+    for p in pieces:
+        t = _tokens(p)
+        if not groups or size + t > budget:
+            groups.append([])
+            size = 0
+        groups[-1].append(p)
+        size += t
+    return groups
+
+def _partial_messages(window: str, part: int, total: int) -> List[Dict[str, str]]:
+    sys_prompt = (
+        f"You are a clinical scribe. This is part {part} of {total} of one consultation. "
+        "Extract every clinically relevant fact as concise bullet points grouped under Subjective, Objective, Assessment and Plan. "
+        "Do not invent information."
+    )
+    return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": window}]
+
+def _merge_messages(partials: List[str]) -> List[Dict[str, str]]:
+    sys_prompt = (
+        "You are a clinical scribe. Merge these notes, taken from consecutive parts of one consultation, into a single clear, concise SOAP note "
+        "(Subjective, Objective, Assessment, Plan). Remove duplicates and keep chronology. Return markdown with section headings."
+    )
+    content = "\n\n".join(f"## Part {i}\n{p}" for i, p in enumerate(partials, 1))
+    return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content}]
+
+async def _map(prompts: List[List[Dict[str, str]]]) -> Optional[List[str]]:
+    """Run prompts in parallel, retrying each once; None if any still fails.
+
+    A note missing a window would silently drop part of the visit, so one
+    failed window fails the whole map.
+    """
+    sem = asyncio.Semaphore(max(1, _MAP_CONCURRENCY))
+
+    async def one(messages: List[Dict[str, str]]) -> Optional[str]:
+        for _ in range(2):
+            async with sem:
+                out = await _hf_chat_async(messages)
+            if out:
+                return out
+        return None
+
+    out = await asyncio.gather(*(one(m) for m in prompts))
+    return None if any(o is None for o in out) else list(out)
+
+async def _reduce_messages(content: str) -> Optional[List[Dict[str, str]]]:
+    """Summarize windows in parallel, folding the partials until they fit one merge call.
+
+    Returns the final merge prompt, or None when any window or merge failed.
+    """
+    windows = _windows(content, _WINDOW_TOKENS)
+    partials = await _map([_partial_messages(w, i, len(windows)) for i, w in enumerate(windows, 1)])
+    while partials and len(partials) > 1 and _tokens("\n\n".join(partials)) > _WINDOW_TOKENS:
+        groups = _pack(partials, _WINDOW_TOKENS)
+        if len(groups) >= len(partials):
+            break
+        partials = await _map([_merge_messages(g) for g in groups])
+    return _merge_messages(partials) if partials else None
+
+def _is_long(content: str) -> bool:
+    return _tokens(content) > _WINDOW_TOKENS
+
+async def _summarize_long_async(content: str) -> Optional[str]:
+    messages = await _reduce_messages(content)
+    return await _hf_chat_async(messages) if messages else None
+
+def _summarize_key(
+    transcript: str, dialogue: Optional[str], audio_file_id: Optional[str], use_cache: bool
+) -> Optional[str]:
+    if not use_cache:
+        return None
+    return _result_key("summarize", _summarize_messages(transcript, dialogue), audio_file_id, bool(dialogue or transcript))
+
+def summarize_note(
+    transcript: str, dialogue: Optional[str] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
+    key = _summarize_key(transcript, dialogue, audio_file_id, use_cache)
+    hit = _cached(key)
+    if hit is not None:
+        return hit
+    content = dialogue or transcript or ""
+    if _is_long(content):
+        # On the gateway loop, so this also works from threads that run their own loop.
+        return _remember(key, _summarize_result(llm_gateway.run(_summarize_long_async(content))))
+    return _remember(key, _summarize_result(_hf_chat(_summarize_messages(transcript, dialogue))))
+
+async def summarize_note_async(
+    transcript: str, dialogue: Optional[str] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> Dict[str, Any]:
+    key = _summarize_key(transcript, dialogue, audio_file_id, use_cache)
+    hit = await _cached_async(key)
+    if hit is not None:
+        return hit
+    content = dialogue or transcript or ""
+    if _is_long(content):
+        return await _remember_async(key, _summarize_result(await _summarize_long_async(content)))
+    return await _remember_async(key, _summarize_result(await _hf_chat_async(_summarize_messages(transcript, dialogue))))
+
+def summarize_note_stream(
+    transcript: str, dialogue: Optional[str] = None, audio_file_id: Optional[str] = None, use_cache: bool = True
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    # Long transcripts stream only the final merge; the map phase runs first.
+    content = dialogue or transcript or ""
+    return _stream_result(
+        _summarize_key(transcript, dialogue, audio_file_id, use_cache),
+        (lambda: _reduce_messages(content)) if _is_long(content) else _summarize_messages(transcript, dialogue),
+        "note",
+        _summarize_result,
+    )
+
+def _update_messages(previous_note: str, delta: str) -> List[Dict[str, str]]:
+    sys_prompt = (
+        "You are a clinical scribe maintaining a live SOAP note (Subjective, Objective, Assessment, Plan). "
+        "Update the current note with the new part of the consultation: add new facts, correct anything the new dialogue revises, "
+        "and keep everything else unchanged. Return the complete updated note as markdown with section headings."
+    )
+    content = f"Current note:\n{previous_note}\n\nNew dialogue:\n{delta}"
+    return [{"role": "system", "content": sys_prompt}, {"role": "user", "content": content}]
+
+async def update_note_async(previous_note: Optional[str], delta: str) -> Optional[str]:
+    """Fold newly transcribed dialogue into an existing note; None when the upstream fails.
+
+    The prompt holds only the previous note and the delta, so an update costs
+    the same late in a visit as early on. An oversized delta is condensed
+    window by window (in parallel) before the update.
+    """
+    if not previous_note:
+        if _is_long(delta):
+            return await _summarize_long_async(delta)
+        return await _hf_chat_async(_summarize_messages(delta, None))
+    if _is_long(delta):
+        windows = _windows(delta, _WINDOW_TOKENS)
+        partials = await _map([_partial_messages(w, i, len(windows)) for i, w in enumerate(windows, 1)])
+        if partials is None:
+            return None
+        delta = "\n\n".join(partials)
+    return await _hf_chat_async(_update_messages(previous_note, delta))
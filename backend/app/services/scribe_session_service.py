@@ -0,0 +1,164 @@
+import os
+import asyncio
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from app.services.scribe_service import update_note_async, _seg_text
+from app.utils.sqlite import ThreadLocalSQLite
+
+# Sessions untouched for this long are deleted when new sessions are created.
+_SESSION_TTL = float(os.environ.get("SCRIBE_SESSION_TTL", str(12 * 3600)))
+
+
+class ScribeSessionStore:
+    """Running dialogue and current note of live scribe sessions, in SQLite.
+
+    Segments are append-only and numbered; `summarized` records how many of
+    them the stored note already covers, so an update only needs the rest.
+    Notes are written compare-and-set on that counter, which keeps two
+    concurrent updates (from any worker) from applying the same delta twice.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = ThreadLocalSQLite(path)
+        conn = self._db.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, note TEXT, summarized INTEGER NOT NULL DEFAULT 0, "
+            "segments INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, ts REAL, text TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, seq))"
+        )
+
+    def create(self) -> str:
+        self.prune(time.time() - _SESSION_TTL)
+        session_id = secrets.token_hex(8)
+        now = time.time()
+        self._db.conn().execute(
+            "INSERT INTO sessions(id, created_at, updated_at) VALUES (?, ?, ?)", (session_id, now, now)
+        )
+        return session_id
+
+    def append(self, session_id: str, segments: List[Dict[str, Any]]) -> Optional[int]:
+        """Append segments; returns the new segment count, or None for an unknown session."""
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT segments FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            start = row[0]
+            conn.executemany(
+                "INSERT INTO segments(session_id, seq, ts, text) VALUES (?, ?, ?, ?)",
+                [(session_id, start + i, s.get("ts"), s.get("text") or "") for i, s in enumerate(segments)],
+            )
+            total = start + len(segments)
+            conn.execute(
+                "UPDATE sessions SET segments = ?, updated_at = ? WHERE id = ?", (total, time.time(), session_id)
+            )
+            conn.execute("COMMIT")
+            return total
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._db.conn().execute(
+            "SELECT note, summarized, segments FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"sessionId": session_id, "note": row[0], "summarized": row[1], "segments": row[2]}
+
+    def texts(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[str]:
+        rows = self._db.conn().execute(
+            "SELECT text FROM segments WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (session_id, start, end if end is not None else 2 ** 62),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def set_note(self, session_id: str, note: str, expected: int, summarized: int) -> bool:
+        """Store `note` as covering `summarized` segments, only if nobody advanced past `expected`."""
+        cur = self._db.conn().execute(
+            "UPDATE sessions SET note = ?, summarized = ?, updated_at = ? WHERE id = ? AND summarized = ?",
+            (note, summarized, time.time(), session_id, expected),
+        )
+        return (cur.rowcount or 0) > 0
+
+    def delete(self, session_id: str) -> bool:
+        conn = self._db.conn()
+        conn.execute("DELETE FROM segments WHERE session_id = ?", (session_id,))
+        cur = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        return (cur.rowcount or 0) > 0
+
+    def prune(self, before: float) -> int:
+        conn = self._db.conn()
+        stale = [r[0] for r in conn.execute("SELECT id FROM sessions WHERE updated_at < ?", (before,)).fetchall()]
+        for session_id in stale:
+            self.delete(session_id)
+        return len(stale)
+
+
+_store: Optional[ScribeSessionStore] = None
+_store_lock = threading.Lock()
+
+def _default_path() -> str:
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base, "data", "scribe_sessions.db")
+
+def get_store() -> ScribeSessionStore:
+    global _store
+    path = os.environ.get("SCRIBE_SESSIONS_PATH") or _default_path()
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = ScribeSessionStore(path)
+        return _store
+
+def create_session() -> str:
+    return get_store().create()
+
+def append_segments(session_id: str, segments: List[Any]) -> Optional[int]:
+    items = [{"ts": s.get("ts") if isinstance(s, dict) else getattr(s, "ts", None), "text": _seg_text(s)} for s in segments]
+    return get_store().append(session_id, items)
+
+def session_state(session_id: str, with_dialogue: bool = False) -> Optional[Dict[str, Any]]:
+    store = get_store()
+    state = store.get(session_id)
+    if state is not None and with_dialogue:
+        state["dialogue"] = "\n".join(store.texts(session_id))
+    return state
+
+def delete_session(session_id: str) -> bool:
+    return get_store().delete(session_id)
+
+async def update_session_note(session_id: str) -> Optional[Dict[str, Any]]:
+    """Bring the session note up to date with the segments appended since the last update.
+
+    Returns the session state plus `provider`: "huggingface" when the note was
+    advanced, "unchanged" when there was nothing new (or a concurrent update
+    covered it first) and "fallback" when the upstream failed, in which case
+    the previous note is kept and the delta stays pending for the next call.
+    """
+    store = get_store()
+    state = await asyncio.to_thread(store.get, session_id)
+    if state is None:
+        return None
+    start, end = state["summarized"], state["segments"]
+    if start >= end:
+        return {**state, "provider": "unchanged"}
+    delta = "\n".join(await asyncio.to_thread(store.texts, session_id, start, end)).strip()
+    if delta:
+        note = await update_note_async(state["note"], delta)
+        if not note:
+            return {**state, "provider": "fallback"}
+    else:
+        note = state["note"] or ""
+    stored = await asyncio.to_thread(store.set_note, session_id, note, start, end)
+    fresh = await asyncio.to_thread(store.get, session_id)
+    return {**(fresh or state), "provider": "huggingface" if stored else "unchanged"}
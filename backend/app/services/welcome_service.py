@@ -1,11 +1,9 @@
 import os
-import requests
 from typing import Dict, Any, Optional
-from collections import defaultdict
-import threading
-import ipaddress
 import json as _json
 import re as _re
+from app.services import llm_gateway
+from app.utils.ip_cache import PrefixCache
 
 # --- Environment & Configuration ---
 
@@ -24,71 +22,39 @@ if current_env == 'development':
 else:
     print(f"Environment: {current_env.capitalize()}. Using Vercel environment variables.")
 
-API_URL = "https://router.huggingface.co/v1/chat/completions"
+# Per-call budget for the welcome LLM lookup (seconds)
+_LLM_TIMEOUT = float(os.environ.get("WELCOME_LLM_TIMEOUT", "15"))
 
-# Global placeholder for the key, retrieved safely inside query()
-_HF_API_KEY_CACHE: Optional[str] = None 
-
-# Thread-safe in-memory cache: {ip_prefix (first 3 octets): {country_code: {message, language}}}
-_ip_cache = {}
-_cache_lock = threading.Lock()
-
-
-def _get_hf_headers() -> Optional[Dict[str, str]]:
-    """Retrieves the API key safely and returns the header dict."""
-    global _HF_API_KEY_CACHE
-    
-    if not _HF_API_KEY_CACHE:
-        # FIX 1: Use .get() to avoid crashing on startup (KeyError)
-        key = os.environ.get("HF_API_KEY")
-        if not key:
-            print("ERROR: HF_API_KEY is missing from environment variables.")
-            return None
-        _HF_API_KEY_CACHE = key
-
-    return {
-        "Authorization": f"Bearer {_HF_API_KEY_CACHE}",
-    }
-
-
-def _ip_prefix(ip: str, prefix_octets: int = 3) -> str:
-    """Return the first N octets of the IPv4 address as a prefix string."""
-    try:
-        parts = ip.split('.')
-        if len(parts) != 4:
-            # We don't handle IPv6 here, return empty string which will bypass cache
-            return ""
-        return '.'.join(parts[:prefix_octets])
-    except Exception:
-        return ""
+# Thread-safe, bounded cache of LLM answers per network: {ip prefix: {country_code, language, message}}
+_ip_cache: PrefixCache[Dict[str, str]] = PrefixCache(
+    v4_prefix=int(os.environ.get("WELCOME_IP_CACHE_V4_PREFIX", "24")),
+    v6_prefix=int(os.environ.get("WELCOME_IP_CACHE_V6_PREFIX", "48")),
+    max_entries=int(os.environ.get("WELCOME_IP_CACHE_MAX_ENTRIES", "4096")),
+    ttl=float(os.environ.get("WELCOME_IP_CACHE_TTL", "86400")),
+)
 
 
 def _find_in_cache(ip: str):
-    """Try to find a cached welcome for similar (same /24) IP."""
-    prefix = _ip_prefix(ip)
-    with _cache_lock:
-        return _ip_cache.get(prefix)
+    """Try to find a cached welcome for a nearby IP (same /24 for IPv4, /48 for IPv6 by default)."""
+    return _ip_cache.get(ip)
 
 
 def _add_to_cache(ip: str, country_code: str, language: str, message: str):
-    prefix = _ip_prefix(ip)
-    # Store whole result under this prefix
-    with _cache_lock:
-        _ip_cache[prefix] = {
-            "country_code": country_code,
-            "language": language,
-            "message": message,
-        }
+    # Store whole result under this address's network prefix; invalid IPs are not cached
+    _ip_cache.put(ip, {
+        "country_code": country_code,
+        "language": language,
+        "message": message,
+    })
+
+
+def ip_cache_stats() -> Dict[str, Any]:
+    return _ip_cache.stats()
 
 def query(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    """Queries the Hugging Face API."""
-    headers = _get_hf_headers()
-    if not headers:
-        return None # Return None if key is missing
-        
-    response = requests.post(API_URL, headers=headers, json=payload, timeout=15)
-    response.raise_for_status()
-    return response.json()
+    """Queries the Hugging Face API through the shared LLM gateway."""
+    # Returns None if the key is missing; upstream errors propagate to the caller
+    return llm_gateway.chat_completion(payload, timeout=_LLM_TIMEOUT)
 
 
 def instruct_get_localized_welcome_from_ip(ip: str) -> Dict[str, str]:
@@ -0,0 +1,214 @@
+import os
+import re
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Pattern, Tuple
+
+
+class Saturated(Exception):
+    def __init__(self, status: int, retry_after: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("loop", "fut", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.fut: "asyncio.Future[None]" = loop.create_future()
+        self.granted = False
+
+
+def _wake(fut: "asyncio.Future[None]") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class AdmissionLimiter:
+    """At most `limit` requests in flight, at most `queue` more waiting up to `wait` seconds.
+
+    A full queue is refused at once (429) and a wait that runs out is refused
+    with 503; both carry a Retry-After estimated from recent hold times. Slots
+    are handed to waiters FIFO. State is guarded by a thread lock rather than
+    asyncio primitives, so one limiter serves callers on any event loop.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, wait: float) -> None:
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue = max(0, queue)
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._waiters: Deque[_Waiter] = deque()
+        self._active = 0
+        self._hold = 1.0  # EWMA of seconds a slot is held
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._peak_queue = 0
+        self._wait_total = 0.0
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self) -> int:
+        return max(1, min(60, math.ceil(self._hold * (len(self._waiters) + 1) / self.limit)))
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                return
+            if len(self._waiters) >= self.queue:
+                self._rejected += 1
+                raise Saturated(429, self._retry_after(), f"{self.name} queue full")
+            w = _Waiter(loop)
+            self._waiters.append(w)
+            self._peak_queue = max(self._peak_queue, len(self._waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait({w.fut}, timeout=self.wait)
+        except BaseException:
+            # Cancelled (e.g. client went away): give back a slot handed over meanwhile.
+            with self._lock:
+                granted = w.granted
+                if not granted:
+                    self._waiters.remove(w)
+            if granted:
+                self.release(0.0)
+            raise
+        with self._lock:
+            self._wait_total += time.monotonic() - started
+            if not w.granted:
+                self._waiters.remove(w)
+                self._timed_out += 1
+                raise Saturated(503, self._retry_after(), f"{self.name} busy")
+            self._admitted += 1
+
+    def release(self, held: float) -> None:
+        with self._lock:
+            self._hold = 0.8 * self._hold + 0.2 * held
+            if self._waiters:
+                # The slot passes straight to the next waiter; _active is unchanged.
+                w = self._waiters.popleft()
+                w.granted = True
+                try:
+                    w.loop.call_soon_threadsafe(_wake, w.fut)
+                except RuntimeError:
+                    pass
+            else:
+                self._active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "max_queue": self.queue,
+                "active": self._active,
+                "queued": len(self._waiters),
+                "peak_queued": self._peak_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_hold_s": round(self._hold, 3),
+                "avg_wait_s": round(self._wait_total / self._admitted, 4) if self._admitted else 0.0,
+            }
+
+
+# Defaults per upstream pool: (concurrency, queue length, max wait seconds).
+_DEFAULTS: Dict[str, Tuple[int, int, float]] = {
+    "horoscope": (16, 64, 10.0),
+    "scribe": (8, 32, 10.0),
+}
+
+_pools: Dict[str, AdmissionLimiter] = {}
+_pools_lock = threading.Lock()
+
+def pool(name: str) -> AdmissionLimiter:
+    """Limiter for one upstream, sized by ADMISSION_<NAME>_CONCURRENCY / _QUEUE / _WAIT."""
+    with _pools_lock:
+        p = _pools.get(name)
+        if p is None:
+            limit, queue, wait = _DEFAULTS.get(name, (8, 32, 10.0))
+            env = f"ADMISSION_{name.upper()}"
+            p = AdmissionLimiter(
+                name,
+                int(os.environ.get(f"{env}_CONCURRENCY", str(limit))),
+                int(os.environ.get(f"{env}_QUEUE", str(queue))),
+                float(os.environ.get(f"{env}_WAIT", str(wait))),
+            )
+            _pools[name] = p
+        return p
+
+def set_pool(name: str, limiter: AdmissionLimiter) -> Optional[AdmissionLimiter]:
+    """Replace a pool (e.g. with a tiny one in tests). Returns the previous limiter."""
+    with _pools_lock:
+        prev = _pools.get(name)
+        _pools[name] = limiter
+        return prev
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    for name in _DEFAULTS:
+        pool(name)
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {name: p.stats() for name, p in pools}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting matching requests through their upstream's pool.
+
+    Waiting happens on the event loop, before a threadpool worker is taken, and
+    the slot is held until the response body (including streams) is sent.
+    Unmatched routes such as /health are never queued.
+    """
+
+    def __init__(self, app: Any, rules: Iterable[Tuple[str, str, str]]) -> None:
+        self.app = app
+        self.rules: List[Tuple[str, Pattern[str], str]] = [
+            (method.upper(), re.compile(path), name) for method, path, name in rules
+        ]
+
+    def _match(self, scope: Dict[str, Any]) -> Optional[str]:
+        method, path = scope.get("method", ""), scope.get("path", "")
+        for m, rx, name in self.rules:
+            if (m == "*" or m == method) and rx.fullmatch(path):
+                return name
+        return None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        name = self._match(scope) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        limiter = pool(name)
+        try:
+            await limiter.acquire()
+        except Saturated as e:
+            body = json.dumps({"detail": {"error": e.reason, "retry_after": e.retry_after}}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": e.status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    (b"retry-after", str(e.retry_after).encode("ascii")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
@@ -0,0 +1,16 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import Header, HTTPException
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Dependency for operator-only routes: X-Admin-Token must equal ADMIN_API_TOKEN.
+
+    With no ADMIN_API_TOKEN configured the routes are disabled (403) rather than open.
+    """
+    expected = os.environ.get("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+def json_size(value: Any) -> int:
+    """Approximate the in-memory weight of a JSON-like value by its encoded length."""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except Exception:
+        return 0
+
+
+class BoundedCache(Generic[V]):
+    """Thread-safe LRU cache bounded by entry count and approximate bytes.
+
+    Entries expire after `ttl` seconds (if set) and are all dropped whenever
+    `epoch()` returns a new value, e.g. when the UTC day rolls over.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        epoch: Optional[Callable[[], Hashable]] = None,
+        sizeof: Callable[[Any], int] = json_size,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._epoch_fn = epoch
+        self._epoch = epoch() if epoch else None
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[V, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _check_epoch(self) -> None:
+        if self._epoch_fn is None:
+            return
+        current = self._epoch_fn()
+        if current != self._epoch:
+            self.expirations += len(self._data)
+            self._data.clear()
+            self._bytes = 0
+            self._epoch = current
+
+    def _drop(self, key: Hashable) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            self._check_epoch()
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = item
+            if expires_at and expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """Like get() but without touching counters or recency."""
+        with self._lock:
+            self._check_epoch()
+            item = self._data.get(key)
+            if item is None or (item[1] and item[1] <= time.monotonic()):
+                return None
+            return item[0]
+
+    def put(self, key: Hashable, value: V) -> None:
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            self._check_epoch()
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker.
+
+    Outcomes of the last `window` calls are kept; once at least `min_calls` are
+    recorded and the share of failures (errors, or calls slower than
+    `slow_call`) reaches `failure_ratio`, the breaker opens and `allow()`
+    answers False until `close()` is called, typically by a recovery probe.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_ratio: float = 0.5,
+        slow_call: float = 20.0,
+    ) -> None:
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call = slow_call
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self._open = False
+        self._opened_at = 0.0
+        self._trips = 0
+        self._short_circuited = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._open:
+                self._short_circuited += 1
+                return False
+            return True
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._open
+
+    def record(self, ok: bool, latency: float) -> bool:
+        """Record one call; returns True if this call tripped the breaker."""
+        failed = not ok or latency > self.slow_call
+        with self._lock:
+            self._outcomes.append((failed, latency))
+            if self._open or len(self._outcomes) < self.min_calls:
+                return False
+            failures = sum(1 for f, _ in self._outcomes if f)
+            if failures / len(self._outcomes) < self.failure_ratio:
+                return False
+            self._open = True
+            self._opened_at = time.monotonic()
+            self._trips += 1
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._open = False
+            self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = len(self._outcomes)
+            failures = sum(1 for f, _ in self._outcomes if f)
+            latencies = sorted(lat for _, lat in self._outcomes)
+            return {
+                "state": "open" if self._open else "closed",
+                "open_for_s": round(time.monotonic() - self._opened_at, 1) if self._open else 0.0,
+                "calls": n,
+                "failure_ratio": round(failures / n, 3) if n else 0.0,
+                "p50_latency_s": round(latencies[n // 2], 3) if n else 0.0,
+                "max_latency_s": round(latencies[-1], 3) if n else 0.0,
+                "trips": self._trips,
+                "short_circuited": self._short_circuited,
+            }
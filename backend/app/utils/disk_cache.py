@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.utils.sqlite import ThreadLocalSQLite
+
+
+class SQLiteLRUCache:
+    """JSON values in one SQLite file, bounded by entries, bytes and TTL.
+
+    Entries are evicted least-recently-used first. The file survives restarts
+    and is shared by every worker process; hit/miss counters are per process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._db = ThreadLocalSQLite(path)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        conn = self._db.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(used_at)")
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._db.conn()
+        row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            if row is not None:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(False)
+            return None
+        conn.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, key))
+        self._count(True)
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        self._db.conn().execute(
+            "INSERT OR REPLACE INTO entries(key, value, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            (key, data, size, now, now),
+        )
+        self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        conn = self._db.conn()
+        removed = 0
+        if self.ttl is not None:
+            removed += conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,)).rowcount or 0
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if entries > self.max_entries or total > self.max_bytes:
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY used_at"):
+                if entries <= self.max_entries and total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                entries -= 1
+                total -= size
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            removed += len(victims)
+        if removed:
+            with self._lock:
+                self._evictions += removed
+
+    def clear(self) -> None:
+        self._db.conn().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        entries, total = self._db.conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": total,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,198 @@
+import bisect
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+from typing import Iterable, List, Optional, Sequence, Tuple
+from app.utils.ip_cache import parse_ip
+
+# File layout (all offsets 8-byte aligned):
+#   header  : magic (8) | n4 uint32 LE | n6 uint32 LE
+#   IPv4    : starts n4*u32 LE | ends n4*u32 LE | countries n4*2 ASCII | pad
+#   IPv6    : starts n6*16 BE  | ends n6*16 BE  | countries n6*2 ASCII
+MAGIC = b"GEOIPv1\0"
+_HEADER = struct.Struct("<8sII")
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class _Column(Sequence[int]):
+    """Read-only view of fixed-width big-endian integers, indexable for bisect."""
+
+    def __init__(self, buf: memoryview, width: int) -> None:
+        self._buf = buf
+        self._width = width
+        self._n = len(buf) // width
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):  # type: ignore[override]
+        w = self._width
+        return int.from_bytes(self._buf[i * w:(i + 1) * w], "big")
+
+
+class _LEColumn(_Column):
+    def __init__(self, buf: memoryview) -> None:
+        super().__init__(buf, 4)
+
+    def __getitem__(self, i):  # type: ignore[override]
+        return int.from_bytes(self._buf[i * 4:(i + 1) * 4], "little")
+
+
+def _u32(buf: memoryview) -> Sequence[int]:
+    # On little-endian hosts the column is used in place as a native uint32 array.
+    if sys.byteorder == "little":
+        return buf.cast("I")
+    return _LEColumn(buf)
+
+
+def _parse_bound(raw: str) -> Optional[Tuple[int, int]]:
+    """(version, integer) for an address or a decimal integer bound."""
+    raw = raw.strip().strip('"')
+    if not raw:
+        return None
+    if raw.isdigit():
+        n = int(raw)
+        if n <= 0xFFFFFFFF:
+            return 4, n
+        addr = ipaddress.IPv6Address(n)
+    else:
+        try:
+            addr = ipaddress.ip_address(raw)
+        except ValueError:
+            return None
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        return 4, int(addr.ipv4_mapped)
+    return addr.version, int(addr)
+
+
+def parse_csv(path: str) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, int, str]]]:
+    """Read `start,end,country[,...]` rows (addresses or integers) into sorted v4 and v6 ranges.
+
+    Header lines, malformed rows and unknown countries ("-", "ZZ") are skipped.
+    """
+    v4: List[Tuple[int, int, str]] = []
+    v6: List[Tuple[int, int, str]] = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            start, end = _parse_bound(row[0]), _parse_bound(row[1])
+            cc = row[2].strip().strip('"').upper()
+            if start is None or end is None or start[0] != end[0] or len(cc) != 2 or cc == "ZZ":
+                continue
+            if end[1] < start[1]:
+                continue
+            (v4 if start[0] == 4 else v6).append((start[1], end[1], cc))
+    v4.sort()
+    v6.sort()
+    return v4, v6
+
+
+def encode(v4: List[Tuple[int, int, str]], v6: List[Tuple[int, int, str]]) -> bytes:
+    parts = [_HEADER.pack(MAGIC, len(v4), len(v6))]
+    parts.append(struct.pack(f"<{len(v4)}I", *(s for s, _, _ in v4)))
+    parts.append(struct.pack(f"<{len(v4)}I", *(e for _, e, _ in v4)))
+    parts.append("".join(cc for _, _, cc in v4).encode("ascii"))
+    parts.append(b"\0" * _pad(len(v4) * 10))
+    parts.append(b"".join(s.to_bytes(16, "big") for s, _, _ in v6))
+    parts.append(b"".join(e.to_bytes(16, "big") for _, e, _ in v6))
+    parts.append("".join(cc for _, _, cc in v6).encode("ascii"))
+    return b"".join(parts)
+
+
+def build(csv_path: str, out_path: str) -> Tuple[int, int]:
+    """Convert a range CSV into the binary table (written atomically). Returns (n4, n6)."""
+    v4, v6 = parse_csv(csv_path)
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode(v4, v6))
+    os.replace(tmp, out_path)
+    return len(v4), len(v6)
+
+
+class GeoIPTable:
+    """IP range -> country lookups over sorted start/end columns with bisect.
+
+    Backed by the binary format above, either memory-mapped from a file (pages
+    are shared between worker processes and loaded lazily) or held in bytes.
+    A lookup costs O(log n) probes and no allocation beyond the parsed address.
+    """
+
+    def __init__(self, data, source: str = "") -> None:
+        self.source = source
+        self._data = data
+        buf = memoryview(data)
+        magic, n4, n6 = _HEADER.unpack_from(buf, 0) if len(buf) >= _HEADER.size else (None, 0, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a GeoIP table: {source or 'buffer'}")
+        if len(buf) < _HEADER.size + 10 * n4 + _pad(n4 * 10) + 34 * n6:
+            raise ValueError(f"truncated GeoIP table: {source or 'buffer'}")
+        off = _HEADER.size
+        self._v4_starts = _u32(buf[off:off + 4 * n4])
+        off += 4 * n4
+        self._v4_ends = _u32(buf[off:off + 4 * n4])
+        off += 4 * n4
+        self._v4_cc = buf[off:off + 2 * n4]
+        off += 2 * n4 + _pad(n4 * 10)
+        self._v6_starts = _Column(buf[off:off + 16 * n6], 16)
+        off += 16 * n6
+        self._v6_ends = _Column(buf[off:off + 16 * n6], 16)
+        off += 16 * n6
+        self._v6_cc = buf[off:off + 2 * n6]
+        self.n4, self.n6 = n4, n6
+
+    @classmethod
+    def load(cls, path: str) -> "GeoIPTable":
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mm, path)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "GeoIPTable":
+        return cls(encode(*parse_csv(path)), path)
+
+    def __len__(self) -> int:
+        return self.n4 + self.n6
+
+    def _columns(self, version: int):
+        if version == 4:
+            return self._v4_starts, self._v4_ends, self._v4_cc
+        return self._v6_starts, self._v6_ends, self._v6_cc
+
+    def _find(self, version: int, value: int, lo: int = 0) -> Tuple[Optional[str], int]:
+        starts, ends, ccs = self._columns(version)
+        i = bisect.bisect_right(starts, value, lo) - 1
+        if i >= 0 and value <= ends[i]:
+            return bytes(ccs[2 * i:2 * i + 2]).decode("ascii"), i
+        return None, max(i, 0)
+
+    def lookup(self, ip: str) -> Optional[str]:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        return self._find(*parsed)[0]
+
+    def lookup_many(self, ips: Iterable[str]) -> List[Optional[str]]:
+        """Batch lookup: addresses are resolved in sorted order, each bisect starting
+        where the previous one ended, and results come back in input order."""
+        ips = list(ips)
+        out: List[Optional[str]] = [None] * len(ips)
+        parsed = [(p, i) for i, p in ((i, parse_ip(ip)) for i, ip in enumerate(ips)) if p is not None]
+        parsed.sort()
+        lo = {4: 0, 6: 0}
+        for (version, value), i in parsed:
+            out[i], lo[version] = self._find(version, value, lo[version])
+        return out
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m app.utils.geoip <ranges.csv> <out.bin>")
+    n4, n6 = build(sys.argv[1], sys.argv[2])
+    print(f"wrote {sys.argv[2]}: {n4} IPv4 and {n6} IPv6 ranges")
@@ -0,0 +1,186 @@
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+_WIDTH = {4: 32, 6: 128}
+
+
+class _Node:
+    __slots__ = ("bits", "length", "children", "parent", "entry")
+
+    def __init__(self, bits: int, length: int, parent: Optional["_Node"] = None) -> None:
+        self.bits = bits  # prefix value, left-aligned in the family's width
+        self.length = length
+        self.children: list = [None, None]
+        self.parent = parent
+        self.entry: Optional[Tuple[Any, float]] = None  # (value, expires_at)
+
+
+def _mask(value: int, length: int, width: int) -> int:
+    if length <= 0:
+        return 0
+    return value >> (width - length) << (width - length)
+
+
+def _bit(value: int, pos: int, width: int) -> int:
+    return (value >> (width - 1 - pos)) & 1
+
+
+def _common(a: int, b: int, limit: int, width: int) -> int:
+    x = a ^ b
+    return min(limit, width - x.bit_length() if x else width)
+
+
+def parse_ip(ip: str) -> Optional[Tuple[int, int]]:
+    """(version, integer) for an address; IPv4-mapped IPv6 counts as IPv4. None if invalid."""
+    try:
+        addr = ipaddress.ip_address((ip or "").strip())
+    except ValueError:
+        return None
+    if addr.version == 6 and addr.ipv4_mapped is not None:
+        addr = addr.ipv4_mapped
+    return addr.version, int(addr)
+
+
+class PrefixCache(Generic[V]):
+    """Values cached per network prefix, in a path-compressed binary trie per IP family.
+
+    `put(ip, value)` stores under the address's /v4_prefix or /v6_prefix network
+    (or an explicit `prefix`); `get(ip)` returns the longest live prefix covering
+    the address. Both walk at most prefix-length bits, independent of size.
+    Entries expire after `ttl` seconds and the least recently used are evicted
+    beyond `max_entries`. All operations take one lock.
+    """
+
+    def __init__(self, v4_prefix: int = 24, v6_prefix: int = 48, max_entries: int = 4096, ttl: Optional[float] = None) -> None:
+        self.prefix = {4: v4_prefix, 6: v6_prefix}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._roots = {4: _Node(0, 0), 6: _Node(0, 0)}
+        self._lru: "OrderedDict[Tuple[int, int, int], _Node]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, ip: str) -> Optional[V]:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        version, value = parsed
+        width = _WIDTH[version]
+        now = time.monotonic()
+        with self._lock:
+            node: Optional[_Node] = self._roots[version]
+            best: Optional[_Node] = None
+            while node is not None and _mask(value, node.length, width) == node.bits:
+                if node.entry is not None:
+                    if node.entry[1] <= now:
+                        self._expirations += 1
+                        nxt = node.children[_bit(value, node.length, width)] if node.length < width else None
+                        self._remove(version, node)
+                        node = nxt
+                        continue
+                    best = node
+                if node.length >= width:
+                    break
+                node = node.children[_bit(value, node.length, width)]
+            if best is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._lru.move_to_end((version, best.bits, best.length))
+            return best.entry[0]  # type: ignore[index]
+
+    def put(self, ip: str, value: V, prefix: Optional[int] = None) -> bool:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return False
+        version, addr = parsed
+        width = _WIDTH[version]
+        length = max(0, min(width, prefix if prefix is not None else self.prefix[version]))
+        bits = _mask(addr, length, width)
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            node = self._insert(version, bits, length)
+            node.entry = (value, expires)
+            key = (version, bits, length)
+            self._lru[key] = node
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                (v, _, _), victim = next(iter(self._lru.items()))
+                self._remove(v, victim)
+                self._evictions += 1
+        return True
+
+    def _insert(self, version: int, bits: int, length: int) -> _Node:
+        width = _WIDTH[version]
+        node = self._roots[version]
+        while node.length < length:
+            b = _bit(bits, node.length, width)
+            child = node.children[b]
+            if child is None:
+                leaf = _Node(bits, length, node)
+                node.children[b] = leaf
+                return leaf
+            common = _common(bits, child.bits, min(length, child.length), width)
+            if common == child.length:
+                node = child
+                continue
+            # Split the compressed edge at the first differing bit.
+            mid = _Node(_mask(bits, common, width), common, node)
+            node.children[b] = mid
+            mid.children[_bit(child.bits, common, width)] = child
+            child.parent = mid
+            if common == length:
+                return mid
+            leaf = _Node(bits, length, mid)
+            mid.children[_bit(bits, common, width)] = leaf
+            return leaf
+        return node
+
+    def _remove(self, version: int, node: _Node) -> None:
+        node.entry = None
+        self._lru.pop((version, node.bits, node.length), None)
+        # Drop or splice out nodes that no longer carry an entry or a branch.
+        while node.parent is not None and node.entry is None:
+            kids = [c for c in node.children if c is not None]
+            if len(kids) > 1:
+                return
+            parent = node.parent
+            slot = parent.children.index(node)
+            if kids:
+                kids[0].parent = parent
+                parent.children[slot] = kids[0]
+                return
+            parent.children[slot] = None
+            node = parent
+
+    def clear(self) -> None:
+        with self._lock:
+            self._roots = {4: _Node(0, 0), 6: _Node(0, 0)}
+            self._lru.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lru)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "v4_prefix": self.prefix[4],
+                "v6_prefix": self.prefix[6],
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.utils.sqlite import ThreadLocalSQLite
+
+
+class SQLiteResultStore:
+    """Day-partitioned JSON result store shared by all workers through one SQLite file.
+
+    Runs in WAL mode so readers never block the single writer. Besides results it
+    keeps short-lived claims, letting one worker generate a key while the others
+    wait for the row to appear instead of calling upstream themselves.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000) -> None:
+        self.path = path
+        self._db = ThreadLocalSQLite(path, busy_timeout_ms)
+        self._pruned_day: Optional[str] = None
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, day TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_day ON results(day)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._db.conn()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except Exception:
+            return None
+
+    def put(self, key: str, day: str, value: Any) -> None:
+        self.prune(day)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO results(key, day, value, created_at) VALUES (?, ?, ?, ?)",
+            (key, day, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+        conn.execute("DELETE FROM claims WHERE key = ?", (key,))
+
+    def prune(self, current_day: str) -> int:
+        """Delete results from days before `current_day` (once per day per process)."""
+        if self._pruned_day == current_day:
+            return 0
+        conn = self._conn()
+        cur = conn.execute("DELETE FROM results WHERE day < ?", (current_day,))
+        conn.execute("DELETE FROM claims WHERE expires_at < ?", (time.time(),))
+        self._pruned_day = current_day
+        return cur.rowcount or 0
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """Try to become the generating worker for `key` for up to `ttl` seconds."""
+        now = time.time()
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT expires_at FROM claims WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO claims(key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + ttl),
+            )
+            conn.execute("COMMIT")
+            return True
+        except sqlite3.Error:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            return False
+
+    def release(self, key: str) -> None:
+        self._conn().execute("DELETE FROM claims WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        rows = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        claims = conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+        return {"path": self.path, "rows": rows, "claims": claims}
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs the work; callers arriving while
+    it is in flight wait on the same future and share its result or exception.
+    Sync and async callers may be mixed, from any thread or event loop.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def _join(self, key: Hashable) -> Tuple["Future[Any]", bool]:
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.shared += 1
+                return fut, False
+            fut = Future()
+            self._inflight[key] = fut
+            self.leaders += 1
+            return fut, True
+
+    def _finish(self, key: Hashable, fut: "Future[Any]") -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        fut, leader = self._join(key)
+        if not leader:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self._finish(key, fut)
+        fut.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        fut, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(fut)
+        try:
+            result = await fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            self._finish(key, fut)
+        fut.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"inflight": len(self._inflight), "leaders": self.leaders, "shared": self.shared}
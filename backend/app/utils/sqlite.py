@@ -0,0 +1,24 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalSQLite:
+    """One autocommit SQLite connection per thread for a WAL-mode database file."""
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000) -> None:
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn().execute("PRAGMA journal_mode=WAL")
+
+    def conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shareable across threads; keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
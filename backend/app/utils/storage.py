@@ -1,51 +1,143 @@
 import json
 import os
 import threading
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
+from app.utils.sqlite import ThreadLocalSQLite
 
-_lock = threading.Lock()
-
-def _path() -> str:
+def _data_dir() -> str:
     base = os.path.dirname(os.path.abspath(__file__))
     data_dir = os.path.join(os.path.dirname(base), "data")
     os.makedirs(data_dir, exist_ok=True)
-    return os.path.join(data_dir, "subscribers.json")
-
-def _read() -> List[Dict[str, Any]]:
-    p = _path()
-    if not os.path.exists(p):
-        return []
-    try:
-        with open(p, "r", encoding="utf-8") as f:
-            return json.load(f) or []
-    except Exception:
-        return []
-
-def _write(data: List[Dict[str, Any]]) -> None:
-    p = _path()
-    with open(p, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    return data_dir
+
+def _path() -> str:
+    # Legacy whole-file JSON store; only read once to migrate into SQLite.
+    return os.path.join(_data_dir(), "subscribers.json")
+
+def _db_path() -> str:
+    return os.environ.get("SUBSCRIBERS_DB_PATH") or os.path.join(_data_dir(), "subscribers.db")
+
+
+class SubscriberStore:
+    """Email-keyed subscriber table in SQLite.
+
+    Upserts and deletes touch one indexed row, and SQLite's file locking makes
+    writes safe across worker processes (not just threads).
+    """
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None) -> None:
+        self.path = path
+        self._db = ThreadLocalSQLite(path)
+        conn = self._db.conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers (email TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if legacy_json:
+            self.migrate_json(legacy_json)
+
+    def migrate_json(self, json_path: str) -> int:
+        """Import a legacy subscribers.json once; the file itself is left untouched."""
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done is not None:
+                conn.execute("COMMIT")
+                return 0
+            items: List[Dict[str, Any]] = []
+            if os.path.exists(json_path):
+                try:
+                    with open(json_path, "r", encoding="utf-8") as f:
+                        items = json.load(f) or []
+                except Exception:
+                    items = []
+            rows = [
+                (s["email"], json.dumps(s, ensure_ascii=False))
+                for s in items
+                if isinstance(s, dict) and s.get("email")
+            ]
+            conn.executemany("INSERT OR REPLACE INTO subscribers(email, data) VALUES (?, ?)", rows)
+            conn.execute("INSERT INTO meta(key, value) VALUES ('json_migrated', ?)", (json_path,))
+            conn.execute("COMMIT")
+            return len(rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def upsert(self, item: Dict[str, Any]) -> None:
+        self.upsert_many([item])
+
+    def upsert_many(self, items: List[Dict[str, Any]]) -> int:
+        """Merge a batch of subscribers in one transaction."""
+        conn = self._db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for item in items:
+                row = conn.execute("SELECT data FROM subscribers WHERE email = ?", (item.get("email"),)).fetchone()
+                merged = {**json.loads(row[0]), **item} if row else item
+                conn.execute(
+                    "INSERT OR REPLACE INTO subscribers(email, data) VALUES (?, ?)",
+                    (item.get("email"), json.dumps(merged, ensure_ascii=False)),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(items)
+
+    def delete(self, email: str) -> bool:
+        cur = self._db.conn().execute("DELETE FROM subscribers WHERE email = ?", (email,))
+        return (cur.rowcount or 0) > 0
+
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        row = self._db.conn().execute("SELECT data FROM subscribers WHERE email = ?", (email,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self) -> int:
+        return self._db.conn().execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    def iter_all(self, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        # Keyset pagination keeps memory flat and never holds a read cursor across yields,
+        # so a consumer may resume the iterator from another thread.
+        last = ""
+        while True:
+            rows = self._db.conn().execute(
+                "SELECT email, data FROM subscribers WHERE email > ? ORDER BY email LIMIT ?", (last, page_size)
+            ).fetchall()
+            if not rows:
+                return
+            for email, data in rows:
+                yield json.loads(data)
+            last = rows[-1][0]
+
+
+_store: Optional[SubscriberStore] = None
+_store_lock = threading.Lock()
+
+def _get_store() -> SubscriberStore:
+    global _store
+    path = _db_path()
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = SubscriberStore(path, legacy_json=_path())
+        return _store
 
 def add_subscriber(item: Dict[str, Any]) -> bool:
-    with _lock:
-        subs = _read()
-        if any(s.get("email") == item.get("email") for s in subs):
-            for s in subs:
-                if s.get("email") == item.get("email"):
-                    s.update(item)
-            _write(subs)
-            return True
-        subs.append(item)
-        _write(subs)
-        return True
+    _get_store().upsert(item)
+    return True
+
+def add_subscribers(items: List[Dict[str, Any]]) -> int:
+    return _get_store().upsert_many(items)
 
 def remove_subscriber(email: str) -> bool:
-    with _lock:
-        subs = _read()
-        new_subs = [s for s in subs if s.get("email") != email]
-        _write(new_subs)
-        return len(subs) != len(new_subs)
+    return _get_store().delete(email)
+
+def iter_subscribers() -> Iterator[Dict[str, Any]]:
+    return _get_store().iter_all()
+
+def count_subscribers() -> int:
+    return _get_store().count()
 
 def list_subscribers() -> List[Dict[str, Any]]:
-    with _lock:
-        return _read()
\ No newline at end of file
+    return list(iter_subscribers())
@@ -1,19 +1,63 @@
 import os
+import re
+import errno
+import hashlib
+import json
+import logging
+import shutil
+import threading
 import tempfile
 import secrets
 import time
 from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import anyio
+
+logger = logging.getLogger(__name__)
+
+# Largest single chunk accepted by /upload_chunk (bytes).
+MAX_CHUNK_BYTES = int(os.environ.get("SCRIBE_MAX_CHUNK_BYTES", str(16 * 1024 * 1024)))
+# Longest a parallel write waits for the writes before it so it can hash as it streams (seconds).
+_ORDER_WAIT = float(os.environ.get("SCRIBE_UPLOAD_ORDER_WAIT", "30"))
+
+_DATA_FILE = "data.bin"
+_TOTAL_FILE = "total_bytes"
+_UPLOAD_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class ChunkTooLarge(ValueError):
+    pass
+
+class ChecksumMismatch(ValueError):
+    pass
+
+class UploadIncomplete(ValueError):
+    pass
 
 def _root() -> Path:
     return Path(tempfile.gettempdir()) / "msa_uploads"
 
 def _upload_dir(upload_id: str) -> Path:
+    if not _UPLOAD_ID.match(upload_id or ""):
+        raise ValueError("Invalid uploadId")
     return _root() / f"upload_{upload_id}"
 
+def _chunk_name(index: int) -> str:
+    return f"chunk_{str(index).zfill(6)}"
+
+def _sum_name(index: int) -> str:
+    return f"sum_{str(index).zfill(6)}"
+
+def _read_sum(d: Path, index: int) -> Optional[str]:
+    try:
+        return (d / _sum_name(index)).read_text()
+    except OSError:
+        return None
+
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 def init_upload() -> str:
+    janitor.start()
     upload_id = secrets.token_hex(12)
     ensure_dir(_upload_dir(upload_id))
     return upload_id
@@ -21,25 +65,750 @@ def init_upload() -> str:
 def write_chunk(upload_id: str, index: int, data: bytes) -> None:
     d = _upload_dir(upload_id)
     ensure_dir(d)
-    name = f"chunk_{str(index).zfill(6)}"
-    (d / name).write_bytes(data)
+    (d / _chunk_name(index)).write_bytes(data)
+
+def _range_name(offset: int, length: int) -> str:
+    return f"range_{str(offset).zfill(14)}_{length}"
+
+def _ranges(d: Path) -> List[Tuple[int, int]]:
+    out = []
+    for p in d.glob("range_*"):
+        _, off, length = p.name.split("_")
+        out.append((int(off), int(length)))
+    return sorted(out)
+
+def _index_of(chunk: Path) -> int:
+    return int(chunk.name.split("_")[1])
 
-def finalize_upload(upload_id: str, filename: str | None = None) -> str:
+def _chunks(d: Path) -> List[Path]:
+    return sorted([p for p in d.glob("chunk_*") if not p.name.endswith(".part")])
+
+def uploaded_bytes(upload_id: str) -> int:
+    """Total bytes received so far for an upload (indexed chunks plus offset writes)."""
+    total = 0
+    try:
+        with os.scandir(_upload_dir(upload_id)) as it:
+            for e in it:
+                if e.name.startswith("chunk_") and not e.name.endswith(".part"):
+                    total += e.stat().st_size
+                elif e.name.startswith("range_"):
+                    total += int(e.name.rsplit("_", 1)[1])
+    except FileNotFoundError:
+        pass
+    return total
+
+def _expected_bytes(d: Path) -> Optional[int]:
+    try:
+        return int((d / _TOTAL_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+def expect_bytes(upload_id: str, total: int) -> None:
+    """Record an offset upload's final size, so finalize can tell a missing tail from a complete file."""
+    if total < 0:
+        raise ValueError("Invalid totalBytes")
     d = _upload_dir(upload_id)
-    ensure_dir(_root())
-    parts = sorted([p for p in d.glob("chunk_*")])
-    out_name = filename if filename else f"upload_{int(time.time()*1000)}.webm"
-    out_path = _root() / out_name
-    with out_path.open("wb") as w:
-        for p in parts:
-            w.write(p.read_bytes())
-    for p in parts:
+    ensure_dir(d)
+    known = _expected_bytes(d)
+    if known is not None and known != total:
+        raise ValueError(f"totalBytes {total} conflicts with {known} given earlier")
+    (d / _TOTAL_FILE).write_text(str(total))
+
+def _spans(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Acknowledged (start, end) byte spans, with touching or overlapping ranges merged."""
+    out: List[Tuple[int, int]] = []
+    for off, length in ranges:
+        if out and off <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], off + length))
+        else:
+            out.append((off, off + length))
+    return out
+
+def _gaps(spans: List[Tuple[int, int]], total: int) -> List[Tuple[int, int]]:
+    out = []
+    pos = 0
+    for start, end in spans:
+        if start > pos:
+            out.append((pos, min(start, total)))
+        pos = max(pos, end)
+        if pos >= total:
+            break
+    if pos < total:
+        out.append((pos, total))
+    return [g for g in out if g[0] < g[1]]
+
+def chunk_status(upload_id: str, total_chunks: Optional[int] = None) -> Dict[str, Any]:
+    """Which chunk indices (or, for offset uploads, byte spans) are present, and which are still missing."""
+    d = _upload_dir(upload_id)
+    present = sorted(_index_of(p) for p in _chunks(d))
+    sums = {}
+    for i in present:
+        try:
+            sums[str(i)] = (d / _sum_name(i)).read_text()
+        except OSError:
+            pass
+    expected = total_chunks if total_chunks is not None else ((present[-1] + 1) if present else 0)
+    have = set(present)
+    spans = _spans(_ranges(d)) if d.exists() else []
+    expected_bytes = _expected_bytes(d)
+    return {
+        "uploadId": upload_id,
+        "received": present,
+        "missing": [i for i in range(expected) if i not in have],
+        "checksums": sums,
+        "totalBytes": uploaded_bytes(upload_id),
+        "ranges": [list(sp) for sp in spans],
+        "missingRanges": [list(g) for g in _gaps(spans, expected_bytes)] if expected_bytes is not None else [],
+        "expectedBytes": expected_bytes,
+    }
+
+class _RunningDigest:
+    """SHA-256 of an upload's contiguous prefix, advanced as data is acknowledged.
+
+    `pos` is the next chunk index ("chunks" mode) or byte offset ("bytes" mode,
+    offset writes and streams) absorbed so far. In-order data is hashed while it
+    streams in; data that lands ahead of `pos` is hashed from disk once the gap
+    before it fills. The state is per process: finalize only falls back to
+    reading the file when it is missing or was invalidated by a rewrite.
+
+    Parallel writes are ordered by their start: a write waits for the in-flight
+    writes that start before it, so it forks an up-to-date hash instead of
+    being hashed from disk afterwards.
+    """
+
+    def __init__(self, mode: str) -> None:
+        self.mode = mode
+        self.h = hashlib.sha256()
+        self.pos = 0
+        self.valid = True
+        self.lock = threading.Lock()
+        # Start of each in-flight write; only touched on the event loop.
+        self._inflight: Dict[object, int] = {}
+        self._changed: Optional[anyio.Event] = None
+
+    def fork(self, at: int) -> Any:
+        """A copy of the hash to stream new data into, if that data starts exactly at `pos`."""
+        with self.lock:
+            return self.h.copy() if self.valid and self.pos == at else None
+
+    def register(self, at: int) -> object:
+        """Mark a write starting at `at` as in flight, before the request yields to other writes."""
+        token = object()
+        self._inflight[token] = at
+        return token
+
+    async def begin(self, token: object) -> Any:
+        """Wait for the in-flight writes that start before this one, then fork the hash for it."""
+        at = self._inflight[token]
+        with anyio.move_on_after(_ORDER_WAIT):
+            while any(start < at for start in self._inflight.values()):
+                if self._changed is None:
+                    self._changed = anyio.Event()
+                await self._changed.wait()
+        return self.fork(at)
+
+    def end(self, token: object) -> None:
+        """Unregister a write once its data has been absorbed (or rejected)."""
+        self._inflight.pop(token, None)
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+_digests: Dict[str, _RunningDigest] = {}
+_digests_lock = threading.Lock()
+
+def _digest_state(upload_id: str, mode: str) -> _RunningDigest:
+    with _digests_lock:
+        state = _digests.get(upload_id)
+        if state is None:
+            state = _digests[upload_id] = _RunningDigest(mode)
+        elif state.mode != mode:
+            state.valid = False
+        return state
+
+def _running_digest(upload_id: str, mode: str, pos: int) -> Optional[str]:
+    with _digests_lock:
+        state = _digests.get(upload_id)
+    if state is None:
+        return None
+    with state.lock:
+        if state.valid and state.mode == mode and state.pos == pos:
+            return state.h.hexdigest()
+    return None
+
+def _drop_digest(upload_id: str) -> None:
+    with _digests_lock:
+        _digests.pop(upload_id, None)
+
+def _advance_chunks(d: Path, state: _RunningDigest, index: int, running: Any, replaced: Optional[str], actual: str) -> None:
+    with state.lock:
+        if index < state.pos:
+            # A retried chunk that was already hashed must carry the same bytes.
+            if replaced != actual:
+                state.valid = False
+            return
+        if index == state.pos and running is not None:
+            state.h = running
+            state.pos += 1
+        while state.valid:
+            nxt = d / _chunk_name(state.pos)
+            if not nxt.exists():
+                break
+            _hash_into(state.h, nxt)
+            state.pos += 1
+
+def _catch_up_bytes(d: Path, state: _RunningDigest) -> None:
+    # Caller holds state.lock. Hashes data that arrived ahead of the running position.
+    end = _contiguous_end(_ranges(d))
+    if state.valid and end > state.pos:
+        _hash_into(state.h, d / _DATA_FILE, end - state.pos, state.pos)
+        state.pos = end
+
+def _advance_bytes(d: Path, state: _RunningDigest, offset: int, length: int, running: Any) -> None:
+    with state.lock:
+        if offset < state.pos:
+            # Bytes that were already hashed got rewritten; finalize re-reads the file.
+            state.valid = False
+            return
+        if offset == state.pos and running is not None:
+            state.h = running
+            state.pos += length
+        _catch_up_bytes(d, state)
+
+def _reject_span(d: Path, state: _RunningDigest, offset: int, length: int) -> None:
+    """Forget acknowledged ranges that a rejected offset write may have overwritten."""
+    end = offset + length
+    for off, n in _ranges(d):
+        if off < end and offset < off + n:
+            (d / _range_name(off, n)).unlink(missing_ok=True)
+    with state.lock:
+        if offset < state.pos:
+            state.valid = False
+
+async def _stream_to(f: Any, stream: AsyncIterator[bytes], limit: int, *digests: Any) -> int:
+    written = 0
+    async for data in stream:
+        written += len(data)
+        if written > limit:
+            raise ChunkTooLarge(f"Chunk exceeds {limit} bytes")
+        for digest in digests:
+            if digest is not None:
+                digest.update(data)
+        await f.write(data)
+    return written
+
+async def write_chunk_stream(
+    upload_id: str,
+    index: int,
+    stream: AsyncIterator[bytes],
+    max_bytes: Optional[int] = None,
+    offset: Optional[int] = None,
+    sha256: Optional[str] = None,
+) -> int:
+    """Stream a request body into the upload via worker-thread file I/O; returns bytes written.
+
+    Without `offset` the data lands in a .part file renamed to chunk `index` once
+    complete, so a dropped connection never leaves a truncated chunk behind. With
+    `offset` it is written in place into the upload's single data file, which
+    finalize then only has to rename. Chunks in either mode are hashed while
+    streaming and rejected if they do not match the client's `sha256`. A rejected or
+    interrupted offset write is never acknowledged, and neither are acknowledged
+    bytes it overwrote, so the client must resend that span. Data
+    arriving in order also feeds the upload's running content hash as it streams.
+    """
+    limit = MAX_CHUNK_BYTES if max_bytes is None else max_bytes
+    d = _upload_dir(upload_id)
+    state = _digest_state(upload_id, "bytes" if offset is not None else "chunks")
+    token = state.register(offset if offset is not None else index)
+    try:
+        await anyio.to_thread.run_sync(ensure_dir, d)
+        running = await state.begin(token)
+        if offset is not None:
+            return await _write_at_offset(d, state, offset, stream, limit, sha256, running)
+        return await _write_indexed(d, state, index, stream, limit, sha256, running)
+    finally:
+        state.end(token)
+
+async def _write_at_offset(
+    d: Path, state: _RunningDigest, offset: int, stream: AsyncIterator[bytes], limit: int, sha256: Optional[str], running: Any
+) -> int:
+    data_path = d / _DATA_FILE
+    await anyio.to_thread.run_sync(lambda: data_path.touch(exist_ok=True))
+    digest = hashlib.sha256()
+    async with await anyio.open_file(data_path, "r+b") as f:
+        await f.seek(offset)
         try:
-            p.unlink()
+            written = await _stream_to(f, stream, limit, digest, running)
+        except BaseException:
+            # A dropped or oversized body may already have overwritten acknowledged
+            # bytes in place; un-acknowledge them so the client resends that span.
+            with anyio.CancelScope(shield=True):
+                partial = await f.tell() - offset
+                if partial > 0:
+                    await anyio.to_thread.run_sync(_reject_span, d, state, offset, partial)
+            raise
+    if sha256 and sha256.strip().lower() != digest.hexdigest():
+        await anyio.to_thread.run_sync(_reject_span, d, state, offset, written)
+        raise ChecksumMismatch(f"Chunk at offset {offset} checksum mismatch")
+    if written:
+        await anyio.to_thread.run_sync(lambda: (d / _range_name(offset, written)).touch())
+        await anyio.to_thread.run_sync(_advance_bytes, d, state, offset, written, running)
+    return written
+
+async def _write_indexed(
+    d: Path, state: _RunningDigest, index: int, stream: AsyncIterator[bytes], limit: int, sha256: Optional[str], running: Any
+) -> int:
+    final = d / _chunk_name(index)
+    part = d / f"{_chunk_name(index)}.{secrets.token_hex(4)}.part"
+    digest = hashlib.sha256()
+    try:
+        async with await anyio.open_file(part, "wb") as f:
+            written = await _stream_to(f, stream, limit, digest, running)
+        actual = digest.hexdigest()
+        if sha256 and sha256.strip().lower() != actual:
+            raise ChecksumMismatch(f"Chunk {index} checksum mismatch")
+        replaced = await anyio.to_thread.run_sync(_read_sum, d, index)
+        await anyio.to_thread.run_sync((d / _sum_name(index)).write_text, actual)
+        await anyio.to_thread.run_sync(os.replace, part, final)
+    except BaseException:
+        try:
+            part.unlink()
         except Exception:
             pass
+        raise
+    await anyio.to_thread.run_sync(_advance_chunks, d, state, index, running, replaced, actual)
+    return written
+
+def _contiguous_end(ranges: List[Tuple[int, int]]) -> int:
+    end = 0
+    for off, length in ranges:
+        if off > end:
+            break
+        end = max(end, off + length)
+    return end
+
+class StreamAppender:
+    """Append a continuous byte stream to an upload's data file, resuming where the last stream stopped.
+
+    The written span is kept as one range marker, renamed after every write, so
+    acknowledged bytes are always resumable and finalize like offset-mode chunks.
+    Each frame also feeds the upload's running content hash.
+    """
+
+    def __init__(self, upload_id: str) -> None:
+        self.upload_id = upload_id
+        self.dir = _upload_dir(upload_id)
+        self.start = 0
+        self.written = 0
+        self._f: Any = None
+        self._state = _digest_state(upload_id, "bytes")
+
+    @property
+    def total(self) -> int:
+        return self.start + self.written
+
+    async def __aenter__(self) -> "StreamAppender":
+        def _prepare() -> int:
+            ensure_dir(self.dir)
+            (self.dir / _DATA_FILE).touch(exist_ok=True)
+            with self._state.lock:
+                # Resuming in a fresh process: hash what earlier streams left behind.
+                _catch_up_bytes(self.dir, self._state)
+            return _contiguous_end(_ranges(self.dir))
+
+        self.start = await anyio.to_thread.run_sync(_prepare)
+        self._f = await anyio.open_file(self.dir / _DATA_FILE, "r+b", buffering=0)
+        await self._f.seek(self.start)
+        return self
+
+    def _mark(self, before: int, after: int, data: bytes) -> None:
+        new = self.dir / _range_name(self.start, after)
+        if before:
+            os.replace(self.dir / _range_name(self.start, before), new)
+        else:
+            new.touch()
+        state = self._state
+        with state.lock:
+            if state.pos == self.start + before:
+                state.h.update(data)
+                state.pos += len(data)
+            else:
+                _catch_up_bytes(self.dir, state)
+
+    async def write(self, data: bytes) -> None:
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            n = await self._f.write(view)
+            view = view[n:]
+        before = self.written
+        self.written += len(data)
+        await anyio.to_thread.run_sync(self._mark, before, self.written, data)
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self._f.aclose()
+
+def _copy_fd(src: int, dst: int, count: int) -> None:
+    """Append `count` bytes from src to dst in the kernel (copy_file_range, then sendfile)."""
+    left = count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while left > 0:
+                n = os.copy_file_range(src, dst, left)
+                if n == 0:
+                    break
+                left -= n
+            if left == 0:
+                return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
     try:
-        d.rmdir()
-    except Exception:
+        while left > 0:
+            n = os.sendfile(dst, src, None, left)
+            if n == 0:
+                break
+            left -= n
+        if left == 0:
+            return
+    except (OSError, AttributeError):
         pass
-    return str(out_path)
\ No newline at end of file
+    while left > 0:
+        buf = os.read(src, min(left, 1024 * 1024))
+        if not buf:
+            return
+        os.write(dst, buf)
+        left -= len(buf)
+
+def _concat(parts: List[Path], out_path: Path) -> None:
+    sizes = [p.stat().st_size for p in parts]
+    fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate") and sum(sizes):
+            try:
+                os.posix_fallocate(fd, 0, sum(sizes))
+            except OSError:
+                pass
+        for p, size in zip(parts, sizes):
+            src = os.open(p, os.O_RDONLY)
+            try:
+                _copy_fd(src, fd, size)
+            finally:
+                os.close(src)
+    finally:
+        os.close(fd)
+
+def _objects() -> Path:
+    return _root() / "objects"
+
+def _finalized() -> Path:
+    return _root() / "finalized"
+
+def _previous_result(upload_id: str) -> Optional[Dict[str, Any]]:
+    """The result of an earlier finalize of this upload, if its object is still stored."""
+    try:
+        result = json.loads((_finalized() / upload_id).read_text())
+    except (OSError, ValueError):
+        return None
+    return result if _refresh(Path(result["fileId"])) else None
+
+def _extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(os.path.basename(filename or ""))[1].lower()
+    return ext if re.match(r"^\.[a-z0-9]{1,8}$", ext) else ".webm"
+
+def _hash_into(h: Any, path: Path, length: Optional[int] = None, offset: int = 0) -> None:
+    left = path.stat().st_size - offset if length is None else length
+    with path.open("rb") as f:
+        f.seek(offset)
+        while left > 0:
+            block = f.read(min(left, 1024 * 1024))
+            if not block:
+                break
+            h.update(block)
+            left -= len(block)
+
+def _file_digest(path: Path, length: int) -> str:
+    h = hashlib.sha256()
+    _hash_into(h, path, length)
+    return h.hexdigest()
+
+def _parts_digest(d: Path, parts: List[Path]) -> str:
+    """SHA-256 of the chunks' concatenation, i.e. of the assembled file."""
+    if len(parts) == 1:
+        # The checksum recorded while the only chunk streamed in already is the file's.
+        try:
+            return bytes.fromhex((d / _sum_name(_index_of(parts[0]))).read_text()).hex()
+        except (OSError, ValueError):
+            pass
+    h = hashlib.sha256()
+    for p in parts:
+        _hash_into(h, p)
+    return h.hexdigest()
+
+def _existing(digest: str) -> Optional[Path]:
+    """A stored object with this content, whatever extension it was first uploaded with."""
+    for p in _objects().glob(f"{digest}.*"):
+        if _refresh(p):
+            return p
+    return None
+
+def _refresh(path: Path) -> bool:
+    """Mark an existing object as recently used (for the janitor's LRU); False if absent."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def content_id(file_id: Optional[str]) -> Optional[str]:
+    """Content hash of a finalized upload's fileId, or None for non content-addressed paths."""
+    if not file_id:
+        return None
+    p = Path(file_id)
+    if p.parent != _objects() or not re.match(r"^[0-9a-f]{64}$", p.stem):
+        return None
+    return p.stem
+
+def finalize_upload_result(
+    upload_id: str,
+    filename: str | None = None,
+    total_chunks: Optional[int] = None,
+    total_bytes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Assemble an upload without copying bytes through Python, stored under its content hash.
+
+    Every upload mode is keyed by the SHA-256 of the assembled bytes, so the same
+    recording gets the same fileId however it was chunked or sent, and whatever
+    its filename's extension. The hash is built up while the data streams in;
+    the file is only re-read if this process did not see every write. If that
+    content was finalized before, the new bytes are discarded and the existing
+    fileId is returned. Otherwise a single chunk or the data file is renamed into
+    place and several chunks are concatenated kernel-side. Indexed uploads must have
+    every chunk from 0 to `total_chunks` - 1 (or to the highest index seen); offset
+    uploads must cover exactly `total_bytes` when it is given here or with a chunk. Runs
+    synchronously, so callers on the event loop should dispatch it to a worker thread.
+    Finalizing the same upload again returns the first result; an unknown upload
+    raises FileNotFoundError and one without any data UploadIncomplete.
+    """
+    d = _upload_dir(upload_id)
+    previous = _previous_result(upload_id)
+    if previous is not None:
+        return previous
+    if not d.is_dir():
+        raise FileNotFoundError(f"Unknown uploadId {upload_id}")
+    ensure_dir(_objects())
+    ext = _extension(filename)
+    data_path = d / _DATA_FILE
+    parts = _chunks(d)
+    ranges = _ranges(d) if data_path.exists() else []
+    if ranges and parts:
+        raise ValueError("Upload mixes indexed chunks and offset writes")
+    if not ranges and not parts:
+        raise UploadIncomplete("Upload incomplete: no data received")
+    if ranges:
+        end = _contiguous_end(ranges)
+        if end < max(off + length for off, length in ranges):
+            raise UploadIncomplete(f"Upload incomplete: missing bytes at offset {end}")
+        total = total_bytes if total_bytes is not None else _expected_bytes(d)
+        if total is not None and end < total:
+            raise UploadIncomplete(f"Upload incomplete: have {end} of {total} bytes")
+        if total is not None and end > total:
+            raise ValueError(f"Upload has {end} bytes, more than totalBytes {total}")
+        digest = _running_digest(upload_id, "bytes", end) or _file_digest(data_path, end)
+        found = _existing(digest)
+        out_path = found or _objects() / f"{digest}{ext}"
+        existed = found is not None
+        if not existed:
+            os.truncate(data_path, end)
+            os.replace(data_path, out_path)
+    else:
+        have = {_index_of(p) for p in parts}
+        expected = total_chunks if total_chunks is not None else (max(have) + 1 if have else 0)
+        missing = [i for i in range(expected) if i not in have]
+        if missing:
+            raise UploadIncomplete(f"Upload incomplete: missing chunks {missing[:20]}")
+        parts = [p for p in parts if _index_of(p) < expected]
+        digest = _running_digest(upload_id, "chunks", expected) or _parts_digest(d, parts)
+        found = _existing(digest)
+        out_path = found or _objects() / f"{digest}{ext}"
+        existed = found is not None
+        if not existed:
+            if len(parts) == 1:
+                os.replace(parts[0], out_path)
+            else:
+                tmp = _objects() / f".{digest}.{secrets.token_hex(4)}.tmp"
+                _concat(parts, tmp)
+                os.replace(tmp, out_path)
+    result = {"fileId": str(out_path), "contentHash": digest, "deduplicated": existed}
+    # A client retrying after a lost response gets the same result back.
+    ensure_dir(_finalized())
+    (_finalized() / upload_id).write_text(json.dumps(result))
+    shutil.rmtree(d, ignore_errors=True)
+    _drop_digest(upload_id)
+    return result
+
+
+def finalize_upload(
+    upload_id: str,
+    filename: str | None = None,
+    total_chunks: Optional[int] = None,
+    total_bytes: Optional[int] = None,
+) -> str:
+    return finalize_upload_result(upload_id, filename, total_chunks, total_bytes)["fileId"]
+
+
+class UploadJanitor:
+    """Background reaper for msa_uploads.
+
+    Each sweep removes partial upload directories idle for longer than
+    `partial_ttl`, finalized files older than `file_ttl`, and then the least
+    recently used finalized files until the total fits in `budget_bytes`.
+    Sweeps run on a daemon thread, never on the request path.
+    """
+
+    def __init__(
+        self,
+        partial_ttl: float = 6 * 3600,
+        file_ttl: float = 7 * 86400,
+        budget_bytes: int = 1024 * 1024 * 1024,
+        interval: float = 300,
+    ) -> None:
+        self.partial_ttl = partial_ttl
+        self.file_ttl = file_ttl
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "runs": 0,
+            "last_run": None,
+            "last_duration_ms": 0.0,
+            "partials_removed": 0,
+            "files_removed": 0,
+            "bytes_freed": 0,
+            "partial_bytes": 0,
+            "file_bytes": 0,
+            "files": 0,
+            "budget_bytes": budget_bytes,
+        }
+
+    @staticmethod
+    def _dir_activity(d: Path) -> Tuple[float, int]:
+        last = d.stat().st_mtime
+        size = 0
+        for e in os.scandir(d):
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            last = max(last, st.st_mtime)
+            size += st.st_size
+        return last, size
+
+    def sweep(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        now = time.time()
+        root = _root()
+        partials_removed = files_removed = bytes_freed = partial_bytes = 0
+        files: List[Tuple[float, int, Path]] = []
+        if root.exists():
+            for e in os.scandir(root):
+                p = Path(e.path)
+                try:
+                    if e.is_dir() and e.name.startswith("upload_"):
+                        last, size = self._dir_activity(p)
+                        if now - last > self.partial_ttl:
+                            shutil.rmtree(p, ignore_errors=True)
+                            _drop_digest(e.name[len("upload_"):])
+                            partials_removed += 1
+                            bytes_freed += size
+                        else:
+                            partial_bytes += size
+                    elif e.is_file():
+                        st = e.stat()
+                        files.append((st.st_mtime, st.st_size, p))
+                except FileNotFoundError:
+                    continue
+            finalized = _finalized()
+            if finalized.exists():
+                for e in os.scandir(finalized):
+                    try:
+                        if now - e.stat().st_mtime > self.partial_ttl:
+                            os.unlink(e.path)
+                    except FileNotFoundError:
+                        continue
+            objects = _objects()
+            if objects.exists():
+                for e in os.scandir(objects):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    p = Path(e.path)
+                    if e.name.endswith(".tmp"):
+                        # Interrupted concatenation.
+                        if now - st.st_mtime > self.partial_ttl:
+                            p.unlink(missing_ok=True)
+                            bytes_freed += st.st_size
+                        continue
+                    files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+        kept: List[Tuple[float, int, Path]] = []
+        for mtime, size, p in files:
+            if now - mtime > self.file_ttl:
+                p.unlink(missing_ok=True)
+                files_removed += 1
+                bytes_freed += size
+            else:
+                kept.append((mtime, size, p))
+        total = sum(size for _, size, _ in kept)
+        while kept and total > self.budget_bytes:
+            _, size, p = kept.pop(0)
+            p.unlink(missing_ok=True)
+            files_removed += 1
+            bytes_freed += size
+            total -= size
+        with self._lock:
+            st = self._stats
+            st["runs"] += 1
+            st["last_run"] = now
+            st["last_duration_ms"] = round((time.monotonic() - started) * 1000, 2)
+            st["partials_removed"] += partials_removed
+            st["files_removed"] += files_removed
+            st["bytes_freed"] += bytes_freed
+            st["partial_bytes"] = partial_bytes
+            st["file_bytes"] = total
+            st["files"] = len(kept)
+            return dict(st)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("upload janitor sweep failed: %s", e)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="upload-janitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+janitor = UploadJanitor(
+    partial_ttl=float(os.environ.get("SCRIBE_UPLOAD_PARTIAL_TTL", str(6 * 3600))),
+    file_ttl=float(os.environ.get("SCRIBE_UPLOAD_FILE_TTL", str(7 * 86400))),
+    budget_bytes=int(os.environ.get("SCRIBE_UPLOAD_BUDGET_BYTES", str(1024 * 1024 * 1024))),
+    interval=float(os.environ.get("SCRIBE_UPLOAD_SWEEP_INTERVAL", "300")),
+)
@@ -0,0 +1,115 @@
+"""Microbenchmark for the /welcome/ fast path.
+
+Compares the original per-request negotiation (rebuilt lists and closure,
+parse + sort on every call) against the precomputed, memoized one, both as
+bare function calls and as in-process requests through the ASGI app.
+
+    python bench/welcome_bench.py [seconds-per-case]
+"""
+import os
+import sys
+import asyncio
+import time
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi import FastAPI, Request
+from app.routers import welcome
+
+HEADERS = [
+    "en-US,en;q=0.9",
+    "de-DE,de;q=0.9,en-US;q=0.8,en;q=0.7",
+    "fr-CH, fr;q=0.9, en;q=0.8, de;q=0.7, *;q=0.5",
+    "ja,en-US;q=0.9,en;q=0.8",
+    "es-419,es;q=0.9",
+    "zh-CN,zh;q=0.9,en;q=0.8",
+]
+
+
+def legacy_pick(al: str) -> str:
+    # The original handler body, minus the response: everything rebuilt per call.
+    supported = ["en", "es", "fr", "de", "pt", "ur", "ar", "zh", "ja"]
+    def pick_lang(src: str) -> str:
+        try:
+            parts = [p.strip() for p in src.split(",") if p.strip()]
+            prefs = []
+            for p in parts:
+                if ";q=" in p:
+                    lang, q = p.split(";q=", 1)
+                    prefs.append((lang.strip().lower(), float(q)))
+                else:
+                    prefs.append((p.strip().lower(), 1.0))
+            prefs.sort(key=lambda x: x[1], reverse=True)
+            for lang, _ in prefs:
+                base = lang.split("-")[0]
+                for candidate in [lang, base]:
+                    if candidate in supported:
+                        return candidate
+        except:
+            pass
+        return "en"
+    lang = pick_lang(al)
+    messages = {
+        "en": "Welcome.", "es": "Bienvenido.", "fr": "Bienvenue.", "de": "Willkommen.", "pt": "Bem-vindo.",
+        "ur": "خوش آمدید۔", "ar": "مرحبًا.", "zh": "欢迎。", "ja": "ようこそ。",
+    }
+    messages.get(lang, "Welcome.")
+    return lang
+
+
+def legacy_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/welcome/", response_model=welcome.WelcomeOutput)
+    def legacy(payload: welcome.WelcomeInput, request: Request):
+        country = request.headers.get("x-vercel-ip-country") or request.headers.get("cf-ipcountry") or "US"
+        ip_hdr = request.headers.get("x-forwarded-for")
+        client_ip = ip_hdr.split(",")[0].strip() if ip_hdr else (request.client.host if request.client else "")
+        lang = legacy_pick(request.headers.get("accept-language") or "")
+        return {"message": welcome.MESSAGES[lang], "language": lang, "country_code": country, "ip_used": payload.ip or client_ip or "", "source": "header"}
+
+    return app
+
+
+def rate(fn, seconds: float) -> float:
+    n = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for h in HEADERS:
+            fn(h)
+        n += len(HEADERS)
+    return n / seconds
+
+
+async def arate(app: FastAPI, method: str, seconds: float) -> float:
+    # In-process ASGI calls: no sockets, so framework + handler cost is what is measured.
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        n = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for h in HEADERS:
+                if method == "POST":
+                    await c.post("/welcome/", json={}, headers={"Accept-Language": h})
+                else:
+                    await c.get("/welcome/", headers={"Accept-Language": h})
+            n += len(HEADERS)
+    return n / seconds
+
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    for h in HEADERS:
+        assert legacy_pick(h) == welcome.pick_lang(h), h
+
+    print(f"negotiation  before: {rate(legacy_pick, seconds):>12,.0f} calls/s")
+    print(f"negotiation  after:  {rate(welcome.pick_lang, seconds):>12,.0f} calls/s")
+    after = FastAPI(routes=welcome.router.routes)
+    print(f"POST /welcome before: {asyncio.run(arate(legacy_app(), 'POST', seconds)):>12,.0f} req/s")
+    print(f"POST /welcome after:  {asyncio.run(arate(after, 'POST', seconds)):>12,.0f} req/s")
+    print(f"GET  /welcome after:  {asyncio.run(arate(after, 'GET', seconds)):>12,.0f} req/s (origin only; CDN hits never reach it)")
+
+
+if __name__ == "__main__":
+    main()
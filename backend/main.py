@@ -7,9 +7,22 @@ from fastapi.middleware.cors import CORSMiddleware
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app.routers import health, welcome, scribe, model_a, horoscope
+from app.utils.admission import AdmissionMiddleware
 
 app = FastAPI(title="Personal Portfolio Backend API")
 
+# LLM-backed routes go through a bounded pool per upstream, so a slow provider
+# sheds load (429/503 + Retry-After) instead of stalling every route.
+# Added before CORS so rejections still carry CORS headers.
+app.add_middleware(
+    AdmissionMiddleware,
+    rules=[
+        ("POST", r"/api/horoscope/(daily|email)", "horoscope"),
+        ("POST", r"(/scribe)?/(attribute|summarize)(/stream)?", "scribe"),
+        ("POST", r"(/scribe)?/session/[^/]+/(segments|update)", "scribe"),
+    ],
+)
+
 # Configure CORS using a single variable: BACKEND_URL
 backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000").lower()
 env_origins = os.environ.get("ALLOWED_ORIGINS", "").strip()
@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _isolated_scribe_cache(tmp_path, monkeypatch):
+    # Keep cached LLM results from leaking between tests (and test runs).
+    monkeypatch.setenv("SCRIBE_CACHE_PATH", str(tmp_path / "scribe_cache.db"))
+
+
+@pytest.fixture
+def llm_stub():
+    """Route LLM gateway calls to a stub for one test: ``stub = llm_stub(respond)``."""
+    from app.services import llm_gateway
+
+    previous = []
+
+    def _install(respond):
+        stub = llm_gateway.StubProvider(respond)
+        previous.append(llm_gateway.set_provider(stub))
+        return stub
+
+    yield _install
+    if previous:
+        llm_gateway.set_provider(previous[0])
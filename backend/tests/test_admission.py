@@ -0,0 +1,80 @@
+from fastapi.testclient import TestClient
+import asyncio
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+from app.services import llm_gateway
+from app.utils import admission
+
+client = TestClient(app)
+
+
+def test_limiter_queues_then_sheds():
+    lim = admission.AdmissionLimiter("t", limit=1, queue=1, wait=0.2)
+
+    async def scenario():
+        await lim.acquire()
+        waiter = asyncio.ensure_future(lim.acquire())
+        await asyncio.sleep(0.01)
+        try:
+            await lim.acquire()
+        except admission.Saturated as e:
+            full = e
+        lim.release(0.05)
+        await waiter
+        try:
+            await lim.acquire()
+        except admission.Saturated as e:
+            timed_out = e
+        lim.release(0.05)
+        return full, timed_out
+
+    full, timed_out = asyncio.run(scenario())
+    assert full.status == 429 and timed_out.status == 503
+    assert full.retry_after >= 1
+    st = lim.stats()
+    assert st["admitted"] == 2 and st["rejected"] == 1 and st["timed_out"] == 1
+    assert st["active"] == 0 and st["queued"] == 0
+
+
+def test_saturated_scribe_pool_sheds_without_blocking_others():
+    gate = threading.Event()
+    prev_pool = admission.set_pool("scribe", admission.AdmissionLimiter("scribe", limit=1, queue=0, wait=0.1))
+
+    async def slow(body):
+        await asyncio.to_thread(gate.wait, 2)
+        return "# Plan"
+
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(slow))
+    responses = []
+    try:
+        t = threading.Thread(target=lambda: responses.append(client.post("/summarize", json={"transcript": "slow one", "cache": False})))
+        t.start()
+        deadline = time.monotonic() + 2
+        while admission.stats()["scribe"]["active"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        shed = client.post("/scribe/attribute", json={"segments": [{"text": "Hi"}]})
+        health = client.get("/health")
+        horoscope = client.get("/api/horoscope/cache-stats")
+        gate.set()
+        t.join(5)
+        metrics = client.get("/health/admission").json()
+    finally:
+        llm_gateway.set_provider(prev)
+        admission.set_pool("scribe", prev_pool)
+    assert shed.status_code == 429 and int(shed.headers["retry-after"]) >= 1
+    assert health.status_code == 200 and horoscope.status_code == 200
+    assert responses[0].status_code == 200
+    assert metrics["scribe"]["rejected"] == 1 and metrics["scribe"]["active"] == 0
+    assert "horoscope" in metrics and "welcome" not in metrics
+
+
+def test_welcome_is_not_admission_controlled():
+    r = client.post("/welcome/", json={}, headers={"Accept-Language": "fr"})
+    assert r.status_code == 200 and r.json()["language"] == "fr"
+    assert "welcome" not in client.get("/health/admission").json()
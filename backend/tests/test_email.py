@@ -0,0 +1,133 @@
+import smtplib
+import socket
+import sys
+import os
+
+import pytest
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import email_service
+
+
+class _Collector:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = _Collector()
+    port = _free_port()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(port))
+    monkeypatch.setenv("SMTP_FROM_EMAIL", "daily@example.com")
+    monkeypatch.setenv("SMTP_STARTTLS", "false")
+    monkeypatch.setenv("SMTP_AUTH", "false")
+    monkeypatch.delenv("SMTP_USERNAME", raising=False)
+    monkeypatch.delenv("SMTP_PASSWORD", raising=False)
+    yield handler
+    pool = email_service._get_pool()
+    if pool is not None:
+        pool.close()
+    controller.stop()
+
+
+def test_batch_reuses_one_session(smtp_server):
+    items = [(f"u{i}@example.com", "Hi", f"body {i}") for i in range(5)]
+    assert email_service.send_batch(items) == [True] * 5
+    assert email_service.send_email("solo@example.com", "Hi", "body") is True
+    pool = email_service._get_pool()
+    assert pool.connects == 1
+    assert len(smtp_server.messages) == 6
+
+
+def test_reconnects_after_server_drop(smtp_server):
+    assert email_service.send_email("a@example.com", "Hi", "one") is True
+    pool = email_service._get_pool()
+    s, _, _ = pool._idle.queue[-1]
+    s.sock.shutdown(socket.SHUT_RDWR)
+    assert email_service.send_email("b@example.com", "Hi", "two") is True
+    assert pool.reconnects == 1
+    assert len(smtp_server.messages) == 2
+
+
+def test_refuses_to_send_without_credentials_unless_opted_out(smtp_server, monkeypatch):
+    monkeypatch.setenv("SMTP_AUTH", "true")
+    assert email_service._get_pool() is None
+    assert email_service.send_email("a@example.com", "Hi", "one") is False
+    assert smtp_server.messages == []
+
+
+def test_unexpected_error_closes_session_and_frees_slot(smtp_server):
+    assert email_service.send_email("a@example.com", "Hi", "one") is True
+    pool = email_service._get_pool()
+    s, _, _ = pool._idle.queue[-1]
+
+    def boom(msg):
+        raise ValueError("bad message")
+
+    s.send_message = boom
+    assert email_service.send_email("b@example.com", "Hi", "two") is False
+    assert pool._idle.qsize() == 0
+    assert email_service.send_email("c@example.com", "Hi", "three") is True
+    assert pool.connects == 2
+
+
+def test_batch_keeps_results_around_a_failing_message(smtp_server):
+    pool = email_service._get_pool()
+    real = smtplib.SMTP.send_message
+
+    def flaky(self, msg, *args, **kwargs):
+        if msg["To"] == "bad@example.com":
+            raise ValueError("bad message")
+        return real(self, msg, *args, **kwargs)
+
+    items = [(to, "Hi", "body") for to in ("a@example.com", "bad@example.com", "c@example.com")]
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(smtplib.SMTP, "send_message", flaky)
+        assert email_service.send_batch(items) == [True, False, True]
+        assert email_service.send_batch([("x@example.com", "Hi\nBcc: y@example.com", "body")] + items[:1]) == [False, True]
+    assert sorted(e.rcpt_tos[0] for e in smtp_server.messages) == ["a@example.com", "a@example.com", "c@example.com"]
+    assert pool._idle.qsize() == 1
+
+
+def test_rebuilt_pool_quits_sessions_returned_to_the_old_one(smtp_server, monkeypatch):
+    old = email_service._get_pool()
+    s, sent = old._checkout()
+    monkeypatch.setenv("SMTP_HOST", "localhost")
+    new = email_service._get_pool()
+    assert new is not old
+    s.send_message(email_service._message("daily@example.com", "late@example.com", "Hi", "body"))
+    old._checkin(s, sent + 1)
+    assert old._idle.qsize() == 0 and s.sock is None
+    assert len(smtp_server.messages) == 1
+
+
+def test_failed_login_closes_the_connection(smtp_server, monkeypatch):
+    closed = []
+    real_close = smtplib.SMTP.close
+
+    def tracking_close(self):
+        closed.append(self)
+        real_close(self)
+
+    monkeypatch.setattr(smtplib.SMTP, "close", tracking_close)
+    pool = email_service.SMTPPool("127.0.0.1", int(os.environ["SMTP_PORT"]), "user", "pw", starttls=False)
+    with pytest.raises(smtplib.SMTPException):
+        pool._connect()
+    assert len(closed) == 1 and closed[0].sock is None
+    assert pool.send_batch([email_service._message("daily@example.com", "a@example.com", "Hi", "x")]) == [False]
@@ -0,0 +1,362 @@
+from fastapi.testclient import TestClient
+import asyncio
+import json
+import threading
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+from app.services import horoscope_service, llm_gateway
+from app.utils.cache import BoundedCache
+
+client = TestClient(app)
+
+_HOROSCOPE = json.dumps({
+    "text": "A good day.", "mood": "calm", "energy": 3, "focus": "work", "lucky_color": "blue",
+    "lucky_number": 7, "do": "Rest", "dont": "Rush", "method_note": "stub",
+})
+
+
+def test_bounded_cache_lru_and_bytes():
+    c = BoundedCache(max_entries=2, max_bytes=20, sizeof=len)
+    c.put("a", "xxxx")
+    c.put("b", "yyyy")
+    assert c.get("a") == "xxxx"
+    c.put("c", "zzzz")
+    assert c.get("b") is None
+    c.put("d", "w" * 18)
+    assert len(c) == 1 and c.get("d")
+    s = c.stats()
+    assert s["evictions"] == 3
+    assert s["hits"] == 2 and s["misses"] == 1
+
+
+def test_bounded_cache_day_rollover():
+    day = {"v": "2025-01-01"}
+    c = BoundedCache(max_entries=10, epoch=lambda: day["v"])
+    c.put("k", 1)
+    assert c.get("k") == 1
+    day["v"] = "2025-01-02"
+    assert c.get("k") is None
+    assert c.stats()["expirations"] == 1 and len(c) == 0
+
+
+def test_daily_cache_hit_counted():
+    payload = {"philosophy": "western", "mode": "basic", "inputs": {"sign": "Leo-cache"}}
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(lambda body: _HOROSCOPE))
+    try:
+        before = client.get("/api/horoscope/cache-stats").json()
+        assert client.post("/api/horoscope/daily", json=payload).status_code == 200
+        assert client.post("/api/horoscope/daily", json=payload).status_code == 200
+    finally:
+        llm_gateway.set_provider(prev)
+    after = client.get("/api/horoscope/cache-stats").json()
+    assert after["hits"] - before["hits"] >= 1
+    assert after["misses"] - before["misses"] >= 1
+
+
+def test_concurrent_misses_share_one_generation():
+    gate = threading.Event()
+
+    def slow(body):
+        gate.wait(2)
+        return _HOROSCOPE
+
+    stub = llm_gateway.StubProvider(lambda body: asyncio.to_thread(slow, body))
+    prev = llm_gateway.set_provider(stub)
+    inputs = {"sign": "Virgo-flight"}
+    results = []
+    try:
+        threads = [
+            threading.Thread(target=lambda: results.append(horoscope_service.generate_daily("western", "basic", inputs, {})))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+
+        async def _async_caller():
+            return await horoscope_service.generate_daily_async("western", "basic", inputs, {})
+
+        async_thread = threading.Thread(target=lambda: results.append(asyncio.run(_async_caller())))
+        async_thread.start()
+        time.sleep(0.2)
+        gate.set()
+        for t in threads + [async_thread]:
+            t.join(5)
+    finally:
+        llm_gateway.set_provider(prev)
+    assert len(results) == 6
+    assert all(r is results[0] for r in results)
+    assert len(stub.calls) == 1
+
+
+def test_sqlite_store_claims_and_prunes(tmp_path):
+    from app.utils.result_store import SQLiteResultStore
+
+    store = SQLiteResultStore(str(tmp_path / "h.db"))
+    store.put("old", "2025-01-01", {"text": "old"})
+    assert store.claim("k", ttl=30) is True
+    assert store.claim("k", ttl=30) is False
+    store.put("k", "2025-01-02", {"text": "new"})
+    assert store.get("k") == {"text": "new"}
+    assert store.get("old") is None
+    assert store.claim("k", ttl=30) is True
+
+
+def test_store_survives_memory_cache_loss(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOROSCOPE_STORE_PATH", str(tmp_path / "shared.db"))
+    stub = llm_gateway.StubProvider(lambda body: _HOROSCOPE)
+    prev = llm_gateway.set_provider(stub)
+    inputs = {"sign": "Pisces-store"}
+    try:
+        first = horoscope_service.generate_daily("western", "basic", inputs, {})
+        horoscope_service._cache.clear()
+        second = asyncio.run(horoscope_service.generate_daily_async("western", "basic", inputs, {}))
+    finally:
+        llm_gateway.set_provider(prev)
+    assert first == second
+    assert len(stub.calls) == 1
+
+
+def test_fallback_results_are_not_cached_or_persisted(tmp_path, monkeypatch):
+    from app.utils.result_store import SQLiteResultStore
+
+    monkeypatch.setenv("HOROSCOPE_STORE_PATH", str(tmp_path / "shared.db"))
+    stub = llm_gateway.StubProvider(lambda body: None)
+    prev = llm_gateway.set_provider(stub)
+    inputs = {"sign": "Aquarius-outage"}
+    try:
+        first = horoscope_service.generate_daily("western", "basic", inputs, {})
+        second = asyncio.run(horoscope_service.generate_daily_async("western", "basic", inputs, {}))
+    finally:
+        llm_gateway.set_provider(prev)
+    assert first == second and first["mood"] == "calm"
+    assert len(stub.calls) == 2
+    assert SQLiteResultStore(str(tmp_path / "shared.db")).stats()["rows"] == 0
+
+
+def test_store_waiters_take_over_released_claim(tmp_path, monkeypatch):
+    from app.utils.result_store import SQLiteResultStore
+
+    monkeypatch.setenv("HOROSCOPE_STORE_PATH", str(tmp_path / "shared.db"))
+    monkeypatch.setattr(horoscope_service, "_LLM_TIMEOUT", 3.0)
+    monkeypatch.setattr(horoscope_service, "_STORE_POLL", 0.05)
+    other_worker = SQLiteResultStore(str(tmp_path / "shared.db"))
+    stub = llm_gateway.StubProvider(lambda body: _HOROSCOPE)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        for i, call in enumerate([
+            lambda inputs: horoscope_service.generate_daily("western", "basic", inputs, {}),
+            lambda inputs: asyncio.run(horoscope_service.generate_daily_async("western", "basic", inputs, {})),
+        ]):
+            inputs = {"sign": f"Cancer-claim{i}"}
+            hashed = horoscope_service._cache_key("western", "basic", inputs, {})
+            assert other_worker.claim(hashed, ttl=60) is True
+            # The claiming worker fails shortly after and releases its claim.
+            threading.Timer(0.2, other_worker.release, (hashed,)).start()
+            started = time.monotonic()
+            result = call(inputs)
+            assert time.monotonic() - started < 1.5
+            assert result["mood"] == "calm" and result["text"] == "A good day."
+    finally:
+        llm_gateway.set_provider(prev)
+    assert len(stub.calls) == 2
+
+
+def _wait_for_job(job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        st = client.get(f"/api/horoscope/jobs/{job_id}").json()
+        if st["status"] == "completed":
+            return st
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish: {st}")
+
+
+def test_send_daily_job_generates_once_per_profile(tmp_path, monkeypatch):
+    from app.services import mailing_service
+
+    subs = [
+        {"email": f"u{i}@example.com", "philosophy": "western", "mode": "basic",
+         "inputs": {"sign": "Aries-fanout" if i % 2 else "Taurus-fanout"}, "preferences": {}}
+        for i in range(10)
+    ]
+    delivered = []
+    monkeypatch.setenv("MAILING_JOBS_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(mailing_service, "iter_subscribers", lambda: iter(subs))
+    monkeypatch.setattr(mailing_service, "send_batch", lambda items: [delivered.append(to) or True for to, _, _ in items])
+    stub = llm_gateway.StubProvider(lambda body: _HOROSCOPE)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        r = client.post("/api/horoscope/send-daily?shards=3")
+        assert r.status_code == 202
+        job = r.json()
+        assert job["total"] == 10 and job["shards"] == 3
+        st = _wait_for_job(job["job_id"])
+        # Same UTC day: send-daily returns the existing job instead of re-sending.
+        again = client.post("/api/horoscope/send-daily").json()
+    finally:
+        llm_gateway.set_provider(prev)
+    assert st["sent"] == 10 and st["failed"] == 0 and st["pending"] == 0
+    assert st["shards_done"] == 3
+    assert len(stub.calls) == 2
+    assert again["job_id"] == job["job_id"]
+    _wait_for_job(job["job_id"])
+    assert sorted(delivered) == sorted(s["email"] for s in subs)
+
+
+def test_forced_send_daily_requires_admin_token(tmp_path, monkeypatch):
+    from app.services import mailing_service
+
+    monkeypatch.setenv("MAILING_JOBS_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(mailing_service, "iter_subscribers", lambda: iter([]))
+    monkeypatch.delenv("ADMIN_API_TOKEN", raising=False)
+    assert client.post("/api/horoscope/send-daily?force=true").status_code == 403
+    monkeypatch.setenv("ADMIN_API_TOKEN", "s3cret")
+    assert client.post("/api/horoscope/send-daily?force=true").status_code == 401
+    first = client.post("/api/horoscope/send-daily").json()
+    r = client.post("/api/horoscope/send-daily?force=true", headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code == 202 and r.json()["job_id"] != first["job_id"]
+
+
+def test_mailing_job_resumes_without_resending(tmp_path, monkeypatch):
+    from app.services import mailing_service
+
+    store = mailing_service.MailingJobStore(str(tmp_path / "jobs.db"))
+    subs = [{"email": f"r{i}@example.com", "philosophy": "western", "mode": "basic", "inputs": {"sign": "Leo"}} for i in range(4)]
+    job_id = store.create_job("2025-01-01", subs, 1)
+    store.mark(job_id, [("r0@example.com", True), ("r1@example.com", True)])
+    delivered = []
+    monkeypatch.setattr(mailing_service, "get_store", lambda: store)
+    monkeypatch.setattr(mailing_service, "send_batch", lambda items: [delivered.append(to) or True for to, _, _ in items])
+    asyncio.run(mailing_service.run_job(job_id))
+    assert sorted(delivered) == ["r2@example.com", "r3@example.com"]
+    st = store.status(job_id)
+    assert st["status"] == "completed" and st["sent"] == 4
+    assert st["unique_profiles"] == 1
+
+
+def test_failed_deliveries_are_retried_until_the_attempt_limit(tmp_path, monkeypatch):
+    from app.services import mailing_service
+
+    store = mailing_service.MailingJobStore(str(tmp_path / "jobs.db"))
+    subs = [{"email": f"f{i}@example.com", "philosophy": "western", "mode": "basic", "inputs": {"sign": "Leo"}} for i in range(3)]
+    job_id = store.create_job("2025-01-01", subs, 1)
+    attempts = {}
+
+    def flaky(items):
+        out = []
+        for to, _, _ in items:
+            attempts[to] = attempts.get(to, 0) + 1
+            # f0 recovers on its second try; f2 never gets through.
+            out.append(to == "f1@example.com" or (to == "f0@example.com" and attempts[to] > 1))
+        return out
+
+    monkeypatch.setattr(mailing_service, "_RETRY_DELAY", 0)
+    monkeypatch.setattr(mailing_service, "get_store", lambda: store)
+    monkeypatch.setattr(mailing_service, "send_batch", flaky)
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(lambda body: _HOROSCOPE))
+    try:
+        asyncio.run(mailing_service.run_job(job_id))
+    finally:
+        llm_gateway.set_provider(prev)
+    assert attempts == {"f0@example.com": 2, "f1@example.com": 1, "f2@example.com": mailing_service._MAX_ATTEMPTS}
+    st = store.status(job_id)
+    assert st["status"] == "completed" and st["sent"] == 2 and st["failed"] == 1 and st["pending"] == 0
+
+
+def test_stale_shard_owner_cannot_finish_reclaimed_shard(tmp_path):
+    from app.services import mailing_service
+
+    store = mailing_service.MailingJobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create_job("2025-01-01", [{"email": "s@example.com", "inputs": {"sign": "Leo"}}], 1)
+    assert store.claim_shard(job_id, "old", lease=-1) == 0
+    assert store.claim_shard(job_id, "new", lease=60) == 0
+    assert store.finish_shard(job_id, 0, "old") is False
+    assert store.status(job_id)["status"] == "running"
+    assert store.finish_shard(job_id, 0, "new") is True
+    assert store.status(job_id)["status"] == "completed"
+
+
+def test_second_runner_cannot_reclaim_shard_during_generation(tmp_path, monkeypatch):
+    from app.services import mailing_service
+
+    store = mailing_service.MailingJobStore(str(tmp_path / "jobs.db"))
+    subs = [{"email": f"g{i}@example.com", "philosophy": "western", "mode": "basic",
+             "inputs": {"sign": f"Gemini-lease{i % 2}"}} for i in range(4)]
+    job_id = store.create_job("2025-01-01", subs, 1)
+    delivered = []
+    monkeypatch.setattr(mailing_service, "_SHARD_LEASE", 0.15)
+    monkeypatch.setattr(mailing_service, "get_store", lambda: store)
+    monkeypatch.setattr(mailing_service, "send_batch", lambda items: [delivered.append(to) or True for to, _, _ in items])
+
+    def slow(body):
+        time.sleep(0.6)
+        return _HOROSCOPE
+
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(lambda body: asyncio.to_thread(slow, body)))
+    try:
+        first = mailing_service.start_runner(job_id)
+        time.sleep(0.35)
+        # Well past the original lease: only the heartbeat keeps the first runner's claim alive.
+        second = mailing_service.start_runner(job_id)
+        first.join(5)
+        second.join(5)
+    finally:
+        llm_gateway.set_provider(prev)
+    assert sorted(delivered) == sorted(s["email"] for s in subs)
+    st = store.status(job_id)
+    assert st["status"] == "completed" and st["sent"] == 4
+
+
+def test_lost_lease_stops_renewal_and_marking(tmp_path):
+    from app.services import mailing_service
+
+    store = mailing_service.MailingJobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create_job("2025-01-01", [{"email": "m@example.com", "inputs": {"sign": "Leo"}}], 1)
+    assert store.claim_shard(job_id, "old", lease=-1) == 0
+    assert store.claim_shard(job_id, "new", lease=60) == 0
+    assert store.renew(job_id, 0, "old", 60) is False
+    store.mark(job_id, [("m@example.com", True)], "old")
+    assert store.status(job_id)["pending"] == 1
+    assert store.renew(job_id, 0, "new", 60) is True
+    store.mark(job_id, [("m@example.com", True)], "new")
+    assert store.status(job_id)["sent"] == 1
+
+
+def test_bulk_routes_require_admin_token(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUBSCRIBERS_DB_PATH", str(tmp_path / "subs.db"))
+    monkeypatch.delenv("ADMIN_API_TOKEN", raising=False)
+    assert client.get("/api/horoscope/subscribers/export").status_code == 403
+    monkeypatch.setenv("ADMIN_API_TOKEN", "s3cret")
+    assert client.get("/api/horoscope/subscribers/export").status_code == 401
+    assert client.get("/api/horoscope/subscribers/export", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    r = client.post("/api/horoscope/subscribers/import", content=b'{"email": "x@example.com"}\n')
+    assert r.status_code == 401
+
+
+def test_bulk_import_and_streaming_export(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUBSCRIBERS_DB_PATH", str(tmp_path / "subs.db"))
+    monkeypatch.setenv("ADMIN_API_TOKEN", "s3cret")
+    rows = [
+        {"email": "bulk1@example.com", "philosophy": "Western", "mode": "basic", "inputs": {"sign": "Leo"}},
+        {"email": "bulk2@example.com", "philosophy": "chinese", "mode": "basic", "inputs": {"birth_year": 1990}},
+        {"email": "bad@example.com", "philosophy": "western", "mode": "basic", "inputs": {}},
+    ]
+    body = "\n".join(json.dumps(r) for r in rows) + "\n{not json\n"
+    r = client.post("/api/horoscope/subscribers/import", content=body.encode("utf-8"),
+                    headers={"Content-Type": "application/x-ndjson", "X-Admin-Token": "s3cret"})
+    assert r.status_code == 200
+    j = r.json()
+    assert j["imported"] == 2 and j["failed"] == 2
+    assert [e["line"] for e in j["errors"]] == [3, 4]
+    assert "sign is required" in j["errors"][0]["error"]
+
+    r = client.get("/api/horoscope/subscribers/export", headers={"X-Admin-Token": "s3cret"})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    exported = {json.loads(line)["email"]: json.loads(line) for line in r.text.splitlines()}
+    assert exported["bulk1@example.com"]["philosophy"] == "western"
+    assert "bulk2@example.com" in exported and "bad@example.com" not in exported
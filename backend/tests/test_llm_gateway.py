@@ -0,0 +1,174 @@
+from fastapi.testclient import TestClient
+import asyncio
+import httpx
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+from app.services import llm_gateway
+
+client = TestClient(app)
+
+
+def _horoscope_json(body):
+    return json.dumps({
+        "text": "Stub day.", "mood": "bright", "energy": 4, "focus": "work",
+        "lucky_color": "green", "lucky_number": 3, "do": "Ship it", "dont": "Dither",
+        "method_note": "stub",
+    })
+
+
+def test_stub_provider_serves_horoscope():
+    stub = llm_gateway.StubProvider(_horoscope_json)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        r = client.post("/api/horoscope/daily", json={
+            "philosophy": "western", "mode": "basic", "inputs": {"sign": "Gemini-gateway"},
+        })
+    finally:
+        llm_gateway.set_provider(prev)
+    assert r.status_code == 200
+    assert r.json()["text"] == "Stub day."
+    assert len(stub.calls) == 1
+    assert stub.calls[0]["model"] == llm_gateway.default_model()
+
+
+def test_stub_provider_serves_scribe():
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(lambda body: "# Subjective\n- cough\n# Plan\n- rest"))
+    try:
+        r = client.post("/summarize", json={"transcript": "[Patient] I have a cough."})
+    finally:
+        llm_gateway.set_provider(prev)
+    assert r.status_code == 200
+    assert r.json() == {"note": "# Subjective\n- cough\n# Plan\n- rest", "provider": "huggingface"}
+
+
+def test_per_call_timeout_budget():
+    async def slow(body):
+        await asyncio.sleep(1)
+        return "too late"
+
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(slow))
+    try:
+        assert llm_gateway.chat([{"role": "user", "content": "hi"}], timeout=0.05) is None
+    finally:
+        llm_gateway.set_provider(prev)
+
+
+def test_hf_provider_reuses_pooled_client():
+    provider = llm_gateway.HFRouterProvider()
+    assert provider._get_client() is provider._get_client()
+
+
+def _sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_summarize_stream_forwards_deltas_over_sse():
+    stub = llm_gateway.StubProvider(lambda body: ["# Subjective", "\n- cough", "\n# Plan\n- rest"])
+    prev = llm_gateway.set_provider(stub)
+    try:
+        r = client.post("/summarize/stream", json={"transcript": "[Patient] I have a cough."})
+    finally:
+        llm_gateway.set_provider(prev)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(r.text)
+    assert [e for e, _ in events] == ["delta", "delta", "delta", "done"]
+    assert "".join(d["text"] for e, d in events if e == "delta") == "# Subjective\n- cough\n# Plan\n- rest"
+    assert events[-1][1] == {"note": "# Subjective\n- cough\n# Plan\n- rest", "provider": "huggingface"}
+
+
+def test_attribute_stream_falls_back_without_upstream():
+    prev = llm_gateway.set_provider(llm_gateway.StubProvider(lambda body: None))
+    try:
+        r = client.post("/scribe/attribute/stream", json={"segments": [{"text": "Hi"}, {"text": "Hello"}]})
+    finally:
+        llm_gateway.set_provider(prev)
+    events = _sse_events(r.text)
+    assert events == [
+        ("delta", {"text": "[Clinician] Hi\n[Patient] Hello"}),
+        ("done", {"dialogue": "[Clinician] Hi\n[Patient] Hello", "provider": "fallback"}),
+    ]
+
+
+def test_hf_provider_parses_streamed_chunks(monkeypatch):
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        chunks = [{"choices": [{"delta": {"content": t}}]} for t in ("Hel", "lo")]
+        body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setenv("HF_API_KEY", "test")
+    provider = llm_gateway.HFRouterProvider()
+    provider._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    prev = llm_gateway.set_provider(provider)
+
+    async def collect():
+        return [p async for p in llm_gateway.chat_stream([{"role": "user", "content": "hi"}])]
+
+    try:
+        assert asyncio.run(collect()) == ["Hel", "lo"]
+    finally:
+        llm_gateway.set_provider(prev)
+
+
+def test_breaker_trips_serves_fallback_fast_and_recovers(monkeypatch):
+    import time
+    monkeypatch.setattr(llm_gateway, "_BREAKER_COOLDOWN", 0.05)
+    state = {"down": True}
+
+    def responder(body):
+        if state["down"]:
+            raise httpx.ConnectError("upstream down")
+        return "# Plan\n- rest"
+
+    stub = llm_gateway.StubProvider(responder)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        msgs = [{"role": "user", "content": "hi"}]
+        for _ in range(5):
+            assert llm_gateway.chat(msgs) is None
+        assert llm_gateway.breaker_stats()[llm_gateway.default_model()]["state"] == "open"
+        calls = len(stub.calls)
+        started = time.monotonic()
+        r = client.post("/summarize", json={"transcript": "breaker", "cache": False})
+        assert time.monotonic() - started < 0.5
+        assert r.json()["provider"] == "fallback"
+        state["down"] = False
+        deadline = time.monotonic() + 2
+        while llm_gateway.breaker_stats()[llm_gateway.default_model()]["state"] == "open":
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # Only the background probe reached the provider while the breaker was open.
+        assert all(c.get("max_tokens") == 1 for c in stub.calls[calls:])
+        assert llm_gateway.chat(msgs) == "# Plan\n- rest"
+        assert client.get("/health/upstream").json()[llm_gateway.default_model()]["trips"] == 1
+    finally:
+        llm_gateway.set_provider(prev)
+
+
+def test_hedges_slow_primary_with_secondary_model(monkeypatch):
+    monkeypatch.setenv("HF_SECONDARY_MODEL", "backup/model")
+    monkeypatch.setattr(llm_gateway, "_HEDGE_AFTER", 0.05)
+
+    async def responder(body):
+        if body["model"] != "backup/model":
+            await asyncio.sleep(2)
+            return "primary"
+        return "secondary"
+
+    stub = llm_gateway.StubProvider(responder)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        assert llm_gateway.chat([{"role": "user", "content": "hi"}], timeout=5) == "secondary"
+    finally:
+        llm_gateway.set_provider(prev)
+    assert [c["model"] for c in stub.calls] == [llm_gateway.default_model(), "backup/model"]
@@ -1,13 +1,17 @@
 from fastapi.testclient import TestClient
+import json
 import sys
 import os
 
+import pytest
+
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from main import app
 
 client = TestClient(app)
 
+
 def test_upload_flow_and_finalize():
     r = client.post("/upload_init")
     assert r.status_code == 200
@@ -20,6 +24,7 @@ def test_upload_flow_and_finalize():
     file_id = r3.json().get("fileId")
     assert isinstance(file_id, str) and len(file_id) > 0
 
+
 def test_attribute_segments():
     payload = {"segments": [{"ts": 0, "text": "Hello"}, {"ts": 1, "text": "Hi"}]}
     r = client.post("/attribute", json=payload)
@@ -28,10 +33,551 @@ def test_attribute_segments():
     assert "dialogue" in j and "provider" in j
     assert "Clinician" in j["dialogue"] and "Patient" in j["dialogue"]
 
+
 def test_summarize_transcript():
     payload = {"transcript": "[Clinician] How can I help?\n[Patient] I have a cough."}
     r = client.post("/summarize", json=payload)
     assert r.status_code == 200
     j = r.json()
     assert "note" in j and "provider" in j
-    assert "Subjective" in j["note"] and "Plan" in j["note"]
\ No newline at end of file
+    assert "Subjective" in j["note"] and "Plan" in j["note"]
+
+
+def test_upload_chunk_streams_and_counts_bytes():
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    r0 = client.post(f"/upload_chunk?uploadId={upload_id}&index=0", content=b"a" * 1000)
+    r1 = client.post(f"/upload_chunk?uploadId={upload_id}&index=1", content=b"b" * 24)
+    assert r0.json() == {"ok": True, "index": 0, "bytes": 1000, "totalBytes": 1000}
+    assert r1.json()["totalBytes"] == 1024
+    file_id = client.post("/upload_finalize", json={"uploadId": upload_id}).json()["fileId"]
+    with open(file_id, "rb") as f:
+        assert f.read() == b"a" * 1000 + b"b" * 24
+
+
+def test_upload_chunk_rejects_oversize_and_bad_id(monkeypatch):
+    from app.utils import uploads
+    monkeypatch.setattr(uploads, "MAX_CHUNK_BYTES", 10)
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&index=0", content=b"x" * 11)
+    assert r.status_code == 413
+    assert uploads.uploaded_bytes(upload_id) == 0
+    r = client.post("/upload_chunk?uploadId=../etc&index=0", content=b"x")
+    assert r.status_code == 400
+
+
+def test_finalize_concatenates_chunks_in_index_order():
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    for i in (2, 0, 1):
+        client.post(f"/upload_chunk?uploadId={upload_id}&index={i}", content=bytes([65 + i]) * 70000)
+    file_id = client.post("/upload_finalize", json={"uploadId": upload_id, "filename": "../escape.webm"}).json()["fileId"]
+    assert file_id.endswith(".webm") and "msa_uploads" in file_id and "escape" not in file_id
+    with open(file_id, "rb") as f:
+        assert f.read() == b"A" * 70000 + b"B" * 70000 + b"C" * 70000
+
+
+def test_offset_writes_finalize_by_rename():
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=5", content=b"world")
+    r = client.post("/upload_finalize", json={"uploadId": upload_id})
+    assert r.status_code == 409
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=b"hello")
+    assert r.json()["totalBytes"] == 10
+    file_id = client.post("/upload_finalize", json={"uploadId": upload_id}).json()["fileId"]
+    with open(file_id, "rb") as f:
+        assert f.read() == b"helloworld"
+
+
+def test_out_of_order_chunks_with_checksums_and_resume_status():
+    import hashlib
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    chunks = [b"one-", b"two-", b"three"]
+    good = hashlib.sha256(chunks[2]).hexdigest()
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&index=2", content=chunks[2], headers={"X-Chunk-Sha256": good})
+    assert r.status_code == 200
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&index=0&sha256={'0' * 64}", content=chunks[0])
+    assert r.status_code == 422
+    st = client.get(f"/upload_status?uploadId={upload_id}&totalChunks=3").json()
+    assert st["received"] == [2] and st["missing"] == [0, 1]
+    assert st["checksums"] == {"2": good}
+    r = client.post("/upload_finalize", json={"uploadId": upload_id, "totalChunks": 3})
+    assert r.status_code == 409
+    for i in st["missing"]:
+        client.post(f"/upload_chunk?uploadId={upload_id}&index={i}", content=chunks[i])
+    file_id = client.post("/upload_finalize", json={"uploadId": upload_id, "totalChunks": 3}).json()["fileId"]
+    with open(file_id, "rb") as f:
+        assert f.read() == b"one-two-three"
+
+
+def test_offset_chunk_checksum_mismatch_is_rejected():
+    import hashlib
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=b"hello",
+                    headers={"X-Chunk-Sha256": hashlib.sha256(b"hello").hexdigest()})
+    assert r.status_code == 200
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&offset=5&sha256={'0' * 64}", content=b"world")
+    assert r.status_code == 422
+    assert client.get(f"/upload_status?uploadId={upload_id}").json()["totalBytes"] == 5
+    # A corrupt resend over acknowledged bytes un-acknowledges them.
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&offset=0&sha256={'0' * 64}", content=b"HELLO")
+    assert r.status_code == 422
+    assert client.get(f"/upload_status?uploadId={upload_id}").json()["totalBytes"] == 0
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=b"hello")
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=5", content=b"world")
+    result = client.post("/upload_finalize", json={"uploadId": upload_id}).json()
+    assert result["contentHash"] == hashlib.sha256(b"helloworld").hexdigest()
+    with open(result["fileId"], "rb") as f:
+        assert f.read() == b"helloworld"
+
+
+def test_offset_upload_reports_spans_and_rejects_missing_tail():
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0&totalBytes=15", content=b"hello")
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=10", content=b"there")
+    st = client.get(f"/upload_status?uploadId={upload_id}").json()
+    assert st["ranges"] == [[0, 5], [10, 15]] and st["missingRanges"] == [[5, 10]]
+    assert st["expectedBytes"] == 15
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=5", content=b"-big-")
+    r = client.post("/upload_finalize", json={"uploadId": upload_id, "totalBytes": 20})
+    assert r.status_code == 409
+    r = client.post(f"/upload_chunk?uploadId={upload_id}&offset=15&totalBytes=99", content=b"x")
+    assert r.status_code == 400
+    assert client.get(f"/upload_status?uploadId={upload_id}").json()["missingRanges"] == []
+    file_id = client.post("/upload_finalize", json={"uploadId": upload_id}).json()["fileId"]
+    with open(file_id, "rb") as f:
+        assert f.read() == b"hello-big-there"
+
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0&totalBytes=10", content=b"hello")
+    r = client.post("/upload_finalize", json={"uploadId": upload_id})
+    assert r.status_code == 409 and "5 of 10" in r.json()["detail"]["error"]
+
+
+def test_interrupted_offset_resend_unacknowledges_overwritten_bytes():
+    import asyncio
+    import hashlib
+    from app.utils import uploads
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=b"helloworld!!!!")
+
+    async def dropped():
+        yield b"HELLO"
+        raise ConnectionResetError("client went away")
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(uploads.write_chunk_stream(upload_id, 0, dropped(), offset=0))
+    assert client.get(f"/upload_status?uploadId={upload_id}").json()["totalBytes"] == 0
+    assert client.post("/upload_finalize", json={"uploadId": upload_id}).status_code == 409
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=b"helloworld!!!!")
+    result = client.post("/upload_finalize", json={"uploadId": upload_id}).json()
+    assert result["contentHash"] == hashlib.sha256(b"helloworld!!!!").hexdigest()
+    with open(result["fileId"], "rb") as f:
+        assert f.read() == b"helloworld!!!!"
+
+
+def test_websocket_stream_resumes_and_finalizes():
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    with client.websocket_connect(f"/upload_stream?uploadId={upload_id}") as ws:
+        assert ws.receive_json() == {"type": "ready", "uploadId": upload_id, "offset": 0}
+        ws.send_bytes(b"live-")
+        assert ws.receive_json() == {"type": "ack", "bytes": 5}
+    # Dropped socket: reconnect and keep appending where the stream stopped.
+    with client.websocket_connect(f"/upload_stream?uploadId={upload_id}") as ws:
+        assert ws.receive_json()["offset"] == 5
+        ws.send_bytes(b"audio")
+        assert ws.receive_json()["bytes"] == 10
+        ws.send_text('{"type": "finalize"}')
+        done = ws.receive_json()
+    assert done["type"] == "finalized"
+    with open(done["fileId"], "rb") as f:
+        assert f.read() == b"live-audio"
+
+
+def test_finalize_deduplicates_by_content_and_reuses_results(llm_stub):
+    import secrets
+    recording = b"same recording " + secrets.token_bytes(8)
+    results = []
+    for _ in range(2):
+        upload_id = client.post("/upload_init").json()["uploadId"]
+        client.post(f"/upload_chunk?uploadId={upload_id}&index=0", content=recording)
+        results.append(client.post("/upload_finalize", json={"uploadId": upload_id}).json())
+    file_ids = [r["fileId"] for r in results]
+    assert file_ids[0] == file_ids[1]
+    assert [r["deduplicated"] for r in results] == [False, True]
+
+    stub = llm_stub(lambda body: "[Clinician] Hi\n[Patient] Hello")
+    first = client.post("/attribute", json={"fileId": file_ids[0]}).json()
+    second = client.post("/attribute", json={"fileId": file_ids[1]}).json()
+    assert first["provider"] == "huggingface" and second["provider"] == "cache"
+    assert first["dialogue"] == second["dialogue"]
+    assert len(stub.calls) == 1
+
+
+def test_content_key_ignores_chunking_mode_and_extension():
+    import hashlib
+    import secrets
+    recording = b"one visit " + secrets.token_bytes(16)
+    results = []
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    for i in range(3):
+        client.post(f"/upload_chunk?uploadId={upload_id}&index={i}", content=recording[i * 9:(i + 1) * 9 if i < 2 else None])
+    results.append(client.post("/upload_finalize", json={"uploadId": upload_id, "filename": "a.webm"}).json())
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=recording)
+    results.append(client.post("/upload_finalize", json={"uploadId": upload_id, "filename": "a.wav"}).json())
+    with client.websocket_connect("/upload_stream") as ws:
+        ws.receive_json()
+        ws.send_bytes(recording)
+        ws.receive_json()
+        ws.send_text('{"type": "finalize", "filename": "a.ogg"}')
+        results.append(ws.receive_json())
+    assert {r["contentHash"] for r in results} == {hashlib.sha256(recording).hexdigest()}
+    assert len({r["fileId"] for r in results}) == 1
+    assert [r["deduplicated"] for r in results] == [False, True, True]
+
+
+def test_finalize_uses_hash_built_while_streaming(monkeypatch):
+    import hashlib
+    import secrets
+    from app.utils import uploads
+    recording = b"streamed " + secrets.token_bytes(32)
+    pieces = [recording[:10], recording[10:20], recording[20:]]
+    upload_ids = []
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    for i in (2, 0, 1):
+        client.post(f"/upload_chunk?uploadId={upload_id}&index={i}", content=pieces[i])
+    upload_ids.append(upload_id)
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=10", content=recording[10:])
+    client.post(f"/upload_chunk?uploadId={upload_id}&offset=0", content=recording[:10])
+    upload_ids.append(upload_id)
+
+    def no_reread(*args, **kwargs):
+        raise AssertionError("finalize re-read the upload")
+
+    monkeypatch.setattr(uploads, "_hash_into", no_reread)
+    with client.websocket_connect("/upload_stream") as ws:
+        ws.receive_json()
+        for piece in pieces:
+            ws.send_bytes(piece)
+            ws.receive_json()
+        ws.send_text('{"type": "finalize"}')
+        ws_result = ws.receive_json()
+    results = [client.post("/upload_finalize", json={"uploadId": u}).json() for u in upload_ids] + [ws_result]
+    assert [r["contentHash"] for r in results] == [hashlib.sha256(recording).hexdigest()] * 3
+
+
+def test_finalize_rejects_empty_uploads_and_replays_on_retry():
+    assert client.post("/upload_finalize", json={"uploadId": "never-initialized"}).status_code == 404
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    r = client.post("/upload_finalize", json={"uploadId": upload_id})
+    assert r.status_code == 409
+    client.post(f"/upload_chunk?uploadId={upload_id}&index=0", content=b"retried visit")
+    first = client.post("/upload_finalize", json={"uploadId": upload_id}).json()
+    again = client.post("/upload_finalize", json={"uploadId": upload_id})
+    assert again.status_code == 200 and again.json() == first
+    with open(first["fileId"], "rb") as f:
+        assert f.read() == b"retried visit"
+
+
+def test_parallel_in_order_writes_hash_while_streaming(monkeypatch):
+    import asyncio
+    import hashlib
+    import time
+    from app.utils import uploads
+
+    def no_reread(*args, **kwargs):
+        raise AssertionError("upload was hashed from disk")
+
+    async def body(data, delay):
+        await asyncio.sleep(delay)
+        yield data
+
+    async def parallel(upload_id, indexed):
+        # The first write is still streaming when the second one arrives.
+        writes = []
+        for i, (data, delay) in enumerate([(b"first-", 0.1), (b"second", 0.0)]):
+            where = {"index": i} if indexed else {"offset": i * 6}
+            writes.append(uploads.write_chunk_stream(upload_id, where.get("index", 0), body(data, delay), offset=where.get("offset")))
+        return await asyncio.gather(*writes)
+
+    setup = uploads.ensure_dir
+    setup_delays = []
+
+    def slow_setup(path):
+        # The first write's directory setup returns last; it must still hash first.
+        time.sleep(setup_delays.pop(0) if setup_delays else 0)
+        setup(path)
+
+    monkeypatch.setattr(uploads, "_hash_into", no_reread)
+    monkeypatch.setattr(uploads, "ensure_dir", slow_setup)
+    for indexed in (True, False):
+        upload_id = client.post("/upload_init").json()["uploadId"]
+        setup_delays[:] = [0.05, 0.0]
+        assert asyncio.run(parallel(upload_id, indexed)) == [6, 6]
+        result = client.post("/upload_finalize", json={"uploadId": upload_id}).json()
+        assert result["contentHash"] == hashlib.sha256(b"first-second").hexdigest()
+
+
+def test_janitor_evicts_stale_partials_and_enforces_budget(tmp_path, monkeypatch):
+    import time
+    from app.utils import uploads
+    monkeypatch.setattr(uploads, "_root", lambda: tmp_path)
+    old = time.time() - 3600
+    stale = tmp_path / "upload_stale"
+    stale.mkdir()
+    (stale / "chunk_000000").write_bytes(b"x" * 10)
+    os.utime(stale / "chunk_000000", (old, old))
+    os.utime(stale, (old, old))
+    live = tmp_path / "upload_live"
+    live.mkdir()
+    (live / "chunk_000000").write_bytes(b"y" * 10)
+    objects = tmp_path / "objects"
+    objects.mkdir()
+    for i, name in enumerate(["a.bin", "b.bin", "c.bin"]):
+        p = objects / name
+        p.write_bytes(b"z" * 100)
+        os.utime(p, (old + i, old + i))
+
+    j = uploads.UploadJanitor(partial_ttl=60, file_ttl=86400, budget_bytes=250)
+    st = j.sweep()
+    assert not stale.exists() and live.exists()
+    assert sorted(p.name for p in objects.iterdir()) == ["b.bin", "c.bin"]
+    assert st["partials_removed"] == 1 and st["files_removed"] == 1
+    assert st["file_bytes"] == 200 and st["partial_bytes"] == 10
+    assert st["bytes_freed"] == 110
+    assert client.get("/scribe/upload_janitor").status_code == 200
+
+
+def test_long_transcript_is_summarized_map_reduce(monkeypatch, llm_stub):
+    import asyncio
+    from app.services import scribe_service
+    monkeypatch.setattr(scribe_service, "_WINDOW_TOKENS", 40)
+    monkeypatch.setattr(scribe_service, "_MAP_CONCURRENCY", 3)
+    turns = [f"[{'Clinician' if i % 2 else 'Patient'}] turn {i} " + "words " * 10 for i in range(12)]
+    windows = scribe_service._windows("\n".join(turns), 40)
+    assert len(windows) > 3
+    assert all(line in turns for w in windows for line in w.splitlines())
+
+    active = {"now": 0, "peak": 0}
+
+    async def respond(body):
+        system = body["messages"][0]["content"]
+        if "Merge these notes" in system:
+            return "# Subjective\n- merged"
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.05)
+        active["now"] -= 1
+        return "- partial"
+
+    stub = llm_stub(respond)
+    r = client.post("/summarize", json={"transcript": "\n".join(turns)})
+    assert r.json() == {"note": "# Subjective\n- merged", "provider": "huggingface"}
+    assert len(stub.calls) == len(windows) + 1
+    assert active["peak"] == 3
+
+
+def test_session_updates_note_from_deltas_only(tmp_path, monkeypatch, llm_stub):
+    monkeypatch.setenv("SCRIBE_SESSIONS_PATH", str(tmp_path / "sessions.db"))
+    prompts = []
+
+    def respond(body):
+        user = body["messages"][-1]["content"]
+        prompts.append(user)
+        return f"note v{len(prompts)}"
+
+    stub = llm_stub(respond)
+    sid = client.post("/session").json()["sessionId"]
+    r1 = client.post(f"/session/{sid}/segments", json={"segments": [{"text": "[Patient] I have a cough."}]}).json()
+    r2 = client.post(f"/scribe/session/{sid}/segments", json={"segments": [{"text": "[Clinician] Since when?"}, {"text": "[Patient] Two days."}]}).json()
+    idle = client.post(f"/session/{sid}/update").json()
+    assert r1["note"] == "note v1" and r1["summarized"] == 1 and r1["provider"] == "huggingface"
+    assert r2["note"] == "note v2" and r2["summarized"] == r2["segments"] == 3
+    assert "note v1" in prompts[1] and "Two days." in prompts[1]
+    assert "I have a cough." not in prompts[1]
+    assert idle["provider"] == "unchanged" and len(stub.calls) == 2
+    full = client.get(f"/session/{sid}?dialogue=true").json()
+    assert full["dialogue"].splitlines()[-1] == "[Patient] Two days."
+    assert client.delete(f"/session/{sid}").status_code == 200
+    assert client.get(f"/session/{sid}").status_code == 404
+
+
+def test_response_cache_normalizes_input_and_honours_opt_out(llm_stub):
+    stub = llm_stub(lambda body: "# Plan\n- rest")
+    first = client.post("/summarize", json={"transcript": "[Patient] I have a cough."}).json()
+    again = client.post("/summarize", json={"transcript": "  [Patient]  I have a cough.\r\n\n"}).json()
+    skipped = client.post("/summarize", json={"transcript": "[Patient] I have a cough.", "cache": False}).json()
+    header = client.post("/summarize", json={"transcript": "[Patient] I have a cough."},
+                         headers={"Cache-Control": "no-cache"}).json()
+    assert first["provider"] == "huggingface"
+    assert again == {"note": "# Plan\n- rest", "provider": "cache"}
+    assert skipped["provider"] == header["provider"] == "huggingface"
+    assert len(stub.calls) == 3
+    stats = client.get("/scribe/cache-stats").json()
+    assert stats["entries"] == 1 and stats["hits"] >= 1
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    from app.utils.disk_cache import SQLiteLRUCache
+    c = SQLiteLRUCache(str(tmp_path / "c.db"), max_entries=2)
+    c.put("a", {"v": 1})
+    c.put("b", {"v": 2})
+    assert c.get("a") == {"v": 1}
+    c.put("c", {"v": 3})
+    assert c.get("b") is None and c.get("a") == {"v": 1}
+    assert c.stats()["evictions"] == 1
+    # Entries are shared through the file, e.g. with another worker process.
+    assert SQLiteLRUCache(str(tmp_path / "c.db"), max_entries=2).get("c") == {"v": 3}
+
+
+def test_file_jobs_run_in_background_and_call_back(tmp_path, monkeypatch, llm_stub):
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    monkeypatch.setenv("SCRIBE_JOBS_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setenv("SCRIBE_CALLBACK_HOSTS", "127.0.0.1")
+    received = []
+
+    class Hook(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Hook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gate = threading.Event()
+    stub = llm_stub(lambda body: gate.wait(2) and "[Clinician] Hi")
+    try:
+        r = client.post("/jobs/attribute", json={
+            "segments": [{"text": "Hi"}],
+            "callbackUrl": f"http://127.0.0.1:{server.server_port}/hook",
+        })
+        assert r.status_code == 202
+        job = r.json()
+        assert job["status"] in ("queued", "running")
+        gate.set()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            state = client.get(f"/jobs/{job['jobId']}").json()
+            if state["status"] == "completed" and state["callbackStatus"]:
+                break
+            time.sleep(0.02)
+    finally:
+        server.shutdown()
+    assert state["result"] == {"dialogue": "[Clinician] Hi", "provider": "huggingface"}
+    assert state["callbackStatus"] == "delivered"
+    assert received[0]["jobId"] == job["jobId"] and received[0]["status"] == "completed"
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.post("/jobs/summarize", json={"transcript": "x", "callbackUrl": "file:///etc"}).status_code == 400
+
+
+def test_job_callbacks_refuse_malformed_and_internal_urls(tmp_path, monkeypatch):
+    monkeypatch.setenv("SCRIBE_JOBS_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.delenv("SCRIBE_CALLBACK_HOSTS", raising=False)
+    for url in ["http://x/\x00", "http://[::1/", "http://", "http://127.0.0.1:8000/hook",
+                "http://localhost/hook", "http://169.254.169.254/latest", "http://[::ffff:10.0.0.1]/"]:
+        r = client.post("/jobs/summarize", json={"transcript": "x", "callbackUrl": url})
+        assert r.status_code == 400, url
+
+
+def test_job_workers_survive_failures_and_keep_leases(tmp_path, monkeypatch, llm_stub):
+    import asyncio
+    import time
+    from app.services import scribe_job_service as jobs
+    monkeypatch.setenv("SCRIBE_JOBS_PATH", str(tmp_path / "jobs.db"))
+    store = jobs.get_store()
+
+    # A job that lost its worker _MAX_ATTEMPTS times is failed and handed back for its callback.
+    lost = store.create("summarize", {"transcript": "x"})
+    for _ in range(jobs._MAX_ATTEMPTS):
+        assert store.claim("gone", lease=-1)["id"] == lost
+    assert store.claim("next", lease=60) == {"id": lost, "lost": True}
+    assert store.get(lost)["error"] == "worker lost"
+
+    def wait(job_id):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            st = jobs.job_state(job_id)
+            if st["status"] in ("completed", "failed"):
+                return st
+            time.sleep(0.02)
+        raise AssertionError(st)
+
+    # finish() blowing up must not kill the worker tasks.
+    real_finish = jobs.ScribeJobStore.finish
+    monkeypatch.setattr(jobs.ScribeJobStore, "finish", lambda *a: 1 / 0)
+    broken = [jobs.submit("summarize", {"transcript": f"t{i}", "cache": False}) for i in range(jobs._runner.workers + 1)]
+    time.sleep(0.3)
+    monkeypatch.setattr(jobs.ScribeJobStore, "finish", real_finish)
+    assert all(jobs.job_state(j)["status"] == "running" for j in broken)
+
+    # The heartbeat keeps a slow job's lease, so it is not reclaimed and run twice.
+    monkeypatch.setattr(jobs, "_LEASE", 0.3)
+
+    async def slow(body):
+        await asyncio.sleep(1.0)
+        return "# Plan"
+
+    llm_stub(slow)
+    st = wait(jobs.submit("summarize", {"transcript": "long visit", "cache": False}))
+    assert st["status"] == "completed" and st["attempts"] == 1
+
+
+def test_websocket_stream_survives_writer_failure(monkeypatch):
+    from app.routers import scribe
+    from app.utils.uploads import StreamAppender
+
+    async def broken(self, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(StreamAppender, "write", broken)
+    monkeypatch.setattr(scribe, "_STREAM_QUEUE_FRAMES", 1)
+    upload_id = client.post("/upload_init").json()["uploadId"]
+    with client.websocket_connect(f"/upload_stream?uploadId={upload_id}") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        for _ in range(4):
+            ws.send_bytes(b"frame")
+        assert ws.receive_json() == {"type": "error", "error": "write failed"}
+        assert ws.receive()["code"] == 1011
+
+
+def test_map_reduce_never_drops_a_failed_window(monkeypatch, llm_stub):
+    import asyncio
+    from app.services import scribe_service
+    monkeypatch.setattr(scribe_service, "_WINDOW_TOKENS", 40)
+    turns = [f"[{'Clinician' if i % 2 else 'Patient'}] turn {i} " + "words " * 10 for i in range(12)]
+    transcript = "\n".join(turns)
+    windows = scribe_service._windows(transcript, 40)
+    failures = {"left": 1, "always": False}
+
+    def respond(body):
+        system, user = body["messages"][0]["content"], body["messages"][-1]["content"]
+        if "Merge these notes" in system:
+            return "# Subjective\n- merged"
+        if "turn 5 " in user and (failures["always"] or failures["left"] > 0):
+            failures["left"] -= 1
+            return None
+        return "- partial"
+
+    stub = llm_stub(respond)
+    # A window that fails once is retried, not dropped.
+    retried = scribe_service.summarize_note(transcript, use_cache=False)
+
+    async def from_running_loop():
+        return scribe_service.summarize_note(transcript + "\n[Patient] loop", use_cache=False)
+
+    in_loop = asyncio.run(from_running_loop())
+    failures["always"] = True
+    calls = len(stub.calls)
+    failed = client.post("/summarize", json={"transcript": transcript + "\n[Patient] again"}).json()
+    merges = [c for c in stub.calls[calls:] if "Merge these notes" in c["messages"][0]["content"]]
+    again = client.post("/summarize", json={"transcript": transcript + "\n[Patient] again"}).json()
+    assert retried["provider"] == "huggingface"
+    assert len(windows) > 3
+    assert failed["provider"] == "fallback" and merges == []
+    assert in_loop == {"note": "# Subjective\n- merged", "provider": "huggingface"}
+    assert again["provider"] == "fallback"
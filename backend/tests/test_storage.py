@@ -0,0 +1,49 @@
+import json
+import multiprocessing
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.storage import SubscriberStore
+
+
+def _bulk_upsert(path, worker):
+    store = SubscriberStore(path)
+    for i in range(50):
+        store.upsert({"email": f"w{worker}-{i}@example.com", "philosophy": "western"})
+
+
+def test_migrates_legacy_json_once(tmp_path):
+    legacy = tmp_path / "subscribers.json"
+    legacy.write_text(json.dumps([{"email": "a@example.com", "mode": "basic"}, {"email": "b@example.com"}]))
+    db = str(tmp_path / "subs.db")
+    store = SubscriberStore(db, legacy_json=str(legacy))
+    assert store.count() == 2
+    store.delete("b@example.com")
+    assert SubscriberStore(db, legacy_json=str(legacy)).count() == 1
+
+
+def test_upsert_merges_and_delete_reports(tmp_path):
+    store = SubscriberStore(str(tmp_path / "subs.db"))
+    store.upsert({"email": "a@example.com", "mode": "basic", "inputs": {"sign": "Leo"}})
+    store.upsert({"email": "a@example.com", "mode": "advanced"})
+    assert store.get("a@example.com") == {"email": "a@example.com", "mode": "advanced", "inputs": {"sign": "Leo"}}
+    assert store.delete("a@example.com") is True
+    assert store.delete("a@example.com") is False
+
+
+def test_concurrent_processes_do_not_lose_writes(tmp_path):
+    path = str(tmp_path / "subs.db")
+    SubscriberStore(path)
+    # Spawn, like separate uvicorn workers: SQLite connections must not cross a fork.
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_bulk_upsert, args=(path, w)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+    assert [p.exitcode for p in procs] == [0, 0, 0, 0]
+    store = SubscriberStore(path)
+    assert store.count() == 200
+    assert len(list(store.iter_all(page_size=7))) == 200
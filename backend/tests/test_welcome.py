@@ -0,0 +1,153 @@
+from fastapi.testclient import TestClient
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import app
+from app.routers.welcome import pick_lang
+
+client = TestClient(app)
+
+
+def test_negotiation_prefers_highest_q_then_header_order():
+    assert pick_lang("") == "en"
+    assert pick_lang("de-DE,de;q=0.9,en;q=0.8") == "de"
+    assert pick_lang("en;q=0.5, fr-CA;q=0.9") == "fr"
+    assert pick_lang("xx, ja, es") == "ja"
+    assert pick_lang("es;q=0.7, pt;q=0.7") == "es"
+    assert pick_lang("fr;q=abc") == "en"
+
+
+def test_post_is_private_and_get_is_cdn_cacheable():
+    r = client.post("/welcome/", json={"ip": "8.8.8.8"}, headers={"Accept-Language": "ur-PK,ur;q=0.9"})
+    assert r.json()["language"] == "ur" and r.json()["ip_used"] == "8.8.8.8"
+    assert r.headers["cache-control"].startswith("private")
+    assert "Accept-Language" in r.headers["vary"]
+
+    r = client.get("/welcome/", headers={"Accept-Language": "fr-FR", "CF-IPCountry": "FR", "X-Forwarded-For": "1.2.3.4"})
+    assert r.json() == {"message": "Bienvenue.", "language": "fr", "country_code": "FR", "ip_used": "", "source": "header"}
+    assert "public" in r.headers["cache-control"] and "s-maxage" in r.headers["cache-control"]
+    assert "Accept-Language" in r.headers["vary"]
+
+
+def test_prefix_cache_groups_networks_for_ipv4_and_ipv6():
+    from app.utils.ip_cache import PrefixCache
+    c = PrefixCache(v4_prefix=24, v6_prefix=48, max_entries=10)
+    assert c.put("203.0.113.7", "v4")
+    assert c.put("2001:db8:abcd:1::1", "v6")
+    assert not c.put("not-an-ip", "x")
+    assert c.get("203.0.113.200") == "v4"
+    assert c.get("::ffff:203.0.113.9") == "v4"
+    assert c.get("203.0.114.1") is None
+    assert c.get("2001:db8:abcd:ffff::2") == "v6"
+    assert c.get("2001:db8:abce::1") is None
+    # A shorter explicit prefix is the fallback when no /24 matches.
+    c.put("198.51.0.0", "wide", prefix=16)
+    c.put("198.51.100.1", "narrow")
+    assert c.get("198.51.100.9") == "narrow" and c.get("198.51.7.7") == "wide"
+    s = c.stats()
+    assert s["entries"] == 4 and s["hits"] == 5 and s["misses"] == 2
+
+
+def test_prefix_cache_evicts_lru_and_expires(monkeypatch):
+    import time
+    from app.utils import ip_cache
+    c = ip_cache.PrefixCache(max_entries=2, ttl=60)
+    c.put("10.0.1.1", 1)
+    c.put("10.0.2.1", 2)
+    assert c.get("10.0.1.5") == 1
+    c.put("10.0.3.1", 3)
+    assert c.get("10.0.2.5") is None and c.get("10.0.1.5") == 1 and c.get("10.0.3.5") == 3
+    now = time.monotonic()
+    monkeypatch.setattr(ip_cache.time, "monotonic", lambda: now + 61)
+    assert c.get("10.0.1.5") is None
+    s = c.stats()
+    assert s["evictions"] == 1 and s["expirations"] == 1 and s["entries"] == 1
+
+
+def test_welcome_service_caches_ipv6_clients():
+    from app.services import llm_gateway, welcome_service
+    answer = '{"country_code": "de", "language": "DE", "message": "Willkommen."}'
+    stub = llm_gateway.StubProvider(lambda body: answer)
+    prev = llm_gateway.set_provider(stub)
+    try:
+        first = welcome_service.get_welcome_message("2a02:8108:1:2::10")
+        second = welcome_service.get_welcome_message("2a02:8108:1:9::20")
+    finally:
+        llm_gateway.set_provider(prev)
+    assert first["source"] == "ai" and second["source"] == "cache"
+    assert second["country_code"] == "DE" and second["language"] == "de"
+    assert len(stub.calls) == 1
+
+
+def test_geoip_table_bisects_ranges_from_csv_and_binary(tmp_path, monkeypatch):
+    from app.utils.geoip import GeoIPTable, build
+    from app.pipelines import welcome_translator
+    src = tmp_path / "ranges.csv"
+    src.write_text(
+        "ip_start,ip_end,country\n"
+        "1.0.0.0,1.0.0.255,AU\n"
+        "\"16777472\",\"16778239\",\"CN\"\n"
+        "8.8.8.0,8.8.8.255,us\n"
+        "10.0.0.0,10.255.255.255,ZZ\n"
+        "2001:db8::,2001:db8:ffff:ffff:ffff:ffff:ffff:ffff,DE\n"
+        "::ffff:5.5.5.0,::ffff:5.5.5.255,FR\n"
+        "garbage\n",
+        encoding="utf-8",
+    )
+    out = str(tmp_path / "geoip.bin")
+    assert build(str(src), out) == (4, 1)
+    for table in (GeoIPTable.from_csv(str(src)), GeoIPTable.load(out)):
+        assert table.lookup("1.0.0.7") == "AU"
+        assert table.lookup("1.0.2.9") == "CN"
+        assert table.lookup("1.0.4.0") is None
+        assert table.lookup("8.8.8.8") == "US"
+        assert table.lookup("10.1.2.3") is None
+        assert table.lookup("::ffff:5.5.5.5") == "FR"
+        assert table.lookup("2001:db8:1::1") == "DE"
+        assert table.lookup("2001:db9::1") is None
+        assert table.lookup("nope") is None
+        ips = ["8.8.8.8", "2001:db8::2", "bad", "1.0.0.1", "0.0.0.1", "1.0.1.1"]
+        assert table.lookup_many(ips) == ["US", "DE", None, "AU", None, "CN"]
+
+    monkeypatch.setenv("GEOIP_DB_PATH", out)
+    assert welcome_translator.get_country_from_ip("8.8.8.8") == "US"
+    assert welcome_translator.translate_welcome("5.5.5.5") == "Bienvenue"
+    assert welcome_translator.get_countries_from_ips(["1.0.0.1", "9.9.9.9"]) == ["AU", "default"]
+    monkeypatch.delenv("GEOIP_DB_PATH")
+    assert welcome_translator.get_country_from_ip("8.8.8.8") == "DE"
+
+
+def test_bad_geoip_table_path_falls_back_and_backs_off(tmp_path, monkeypatch, caplog):
+    from app.utils.geoip import GeoIPTable, build
+    from app.pipelines import welcome_translator
+    corrupt = tmp_path / "corrupt.bin"
+    corrupt.write_bytes(b"not a table at all")
+    src = tmp_path / "ranges.csv"
+    src.write_text("8.8.8.0,8.8.8.255,US\n", encoding="utf-8")
+    good = str(tmp_path / "geoip.bin")
+    build(str(src), good)
+    truncated = tmp_path / "truncated.bin"
+    truncated.write_bytes(open(good, "rb").read()[:-4])
+    loads = []
+    real_load = GeoIPTable.load.__func__
+    monkeypatch.setattr(GeoIPTable, "load", classmethod(lambda cls, path: loads.append(path) or real_load(cls, path)))
+    for path in (tmp_path / "missing.bin", corrupt, truncated):
+        monkeypatch.setenv("GEOIP_DB_PATH", str(path))
+        caplog.clear()
+        loads.clear()
+        for _ in range(3):
+            assert welcome_translator.get_country_from_ip("8.8.8.8") == "DE"
+        assert len(loads) == 1
+        assert len([r for r in caplog.records if "could not load GeoIP table" in r.getMessage()]) == 1
+    # Once the backoff has passed the path is retried, and the fixed table is picked up.
+    monkeypatch.setattr(welcome_translator, "_failed_until", 0.0)
+    truncated.write_bytes(open(good, "rb").read())
+    assert welcome_translator.get_country_from_ip("8.8.8.8") == "US"
+    monkeypatch.setenv("GEOIP_DB_PATH", good)
+    assert welcome_translator.get_country_from_ip("8.8.8.8") == "US"
+    monkeypatch.delenv("GEOIP_DB_PATH")
+    assert welcome_translator.get_country_from_ip("8.8.8.8") == "DE"
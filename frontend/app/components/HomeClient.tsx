@@ -49,10 +49,10 @@ function TypewriterWelcome({ onContinue }: { onContinue?: () => void }) {
       } catch {}
       try {
         const backendBase = getBackendBaseUrl();
+        // GET is CDN-cacheable per Accept-Language and, without a JSON body, needs no CORS preflight.
         const response = await fetch(`${backendBase}/welcome/`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json", Accept: "application/json" },
-          body: JSON.stringify({}),
+          method: "GET",
+          headers: { Accept: "application/json" },
         });
         if (!response.ok) throw new Error(`Network response was not ok (${response.status})`);
         const data = await response.json();
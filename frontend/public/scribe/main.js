@@ -130,56 +130,132 @@ function stopRecording() {
   recognition.stop();
 }
 
+const uploadKey = "scribe_uploads";
+const uploadParallelism = 4;
+
+async function sha256Hex(blob) {
+  if (!(window.crypto && crypto.subtle)) return "";
+  const buf = await crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+  return Array.from(new Uint8Array(buf)).map((b) => b.toString(16).padStart(2, "0")).join("");
+}
+
 async function uploadAudioFile() {
   const file = els.audioFileInput.files && els.audioFileInput.files[0];
   if (!file) { setStatus("No file selected"); return; }
-  setStatus("Upload init");
-  const initRes = await fetch(config.apiBase + "/upload_init", { method: "POST" });
-  if (!initRes.ok) { setStatus("Init failed"); return; }
-  const initJson = await initRes.json();
-  const uploadId = initJson.uploadId;
   const chunkSize = 1024 * 1024;
-  const total = Math.ceil(file.size / chunkSize);
-  for (let i = 0; i < total; i++) {
-    const start = i * chunkSize;
-    const end = Math.min(file.size, start + chunkSize);
-    const chunk = file.slice(start, end);
-    setStatus("Uploading chunk " + (i + 1) + "/" + total);
-    const u = new URL(config.apiBase + "/upload_chunk");
-    u.searchParams.set("uploadId", uploadId);
-    u.searchParams.set("index", String(i));
-    const cRes = await fetch(u.toString(), { method: "POST", body: chunk });
-    if (!cRes.ok) { setStatus("Chunk failed"); return; }
+  const total = Math.max(1, Math.ceil(file.size / chunkSize));
+  // Resume a previous upload of the same file if the server still has it
+  const fileKey = [file.name, file.size, file.lastModified].join(":");
+  const pending = storage.get(uploadKey, {});
+  let uploadId = pending[fileKey] || null;
+  let missing = null;
+  if (uploadId) {
+    const su = new URL(config.apiBase + "/upload_status");
+    su.searchParams.set("uploadId", uploadId);
+    su.searchParams.set("totalChunks", String(total));
+    try {
+      const sRes = await fetch(su.toString());
+      if (sRes.ok) missing = (await sRes.json()).missing;
+    } catch {}
+  }
+  if (!missing) {
+    setStatus("Upload init");
+    const initRes = await fetch(config.apiBase + "/upload_init", { method: "POST" });
+    if (!initRes.ok) { setStatus("Init failed"); return; }
+    const initJson = await initRes.json();
+    uploadId = initJson.uploadId;
+    pending[fileKey] = uploadId;
+    storage.set(uploadKey, pending);
+    missing = Array.from({ length: total }, (_, i) => i);
   }
+  let done = total - missing.length;
+  let failed = false;
+  const queue = missing.slice();
+  async function worker() {
+    while (queue.length && !failed) {
+      const i = queue.shift();
+      const start = i * chunkSize;
+      const chunk = file.slice(start, Math.min(file.size, start + chunkSize));
+      const u = new URL(config.apiBase + "/upload_chunk");
+      u.searchParams.set("uploadId", uploadId);
+      u.searchParams.set("index", String(i));
+      const sum = await sha256Hex(chunk);
+      const headers = sum ? { "X-Chunk-Sha256": sum } : {};
+      let ok = false;
+      for (let attempt = 0; attempt < 3 && !ok; attempt++) {
+        try {
+          const cRes = await fetch(u.toString(), { method: "POST", body: chunk, headers });
+          ok = cRes.ok;
+        } catch {}
+      }
+      if (!ok) { failed = true; return; }
+      done++;
+      setStatus("Uploaded chunk " + done + "/" + total);
+    }
+  }
+  await Promise.all(Array.from({ length: Math.min(uploadParallelism, queue.length) }, worker));
+  if (failed) { setStatus("Chunk failed - retry to resume"); return; }
   setStatus("Finalizing");
-  const finRes = await fetch(config.apiBase + "/upload_finalize", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ uploadId }) });
+  const finRes = await fetch(config.apiBase + "/upload_finalize", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ uploadId, totalChunks: total }) });
   if (!finRes.ok) { setStatus("Finalize failed"); return; }
   const finJson = await finRes.json();
   currentFileId = finJson.fileId || null;
+  delete pending[fileKey];
+  storage.set(uploadKey, pending);
   setStatus("Upload complete");
 }
 
+async function streamInto(path, payload, target, field) {
+  // Streams deltas over SSE into `target`; falls back to the JSON endpoint if streaming is unavailable.
+  const headers = { "Content-Type": "application/json" };
+  const body = JSON.stringify(payload);
+  const res = await fetch(resolveApiBase() + path + "/stream", { method: "POST", headers, body });
+  if (!res.ok || !res.body) {
+    const plain = await fetch(resolveApiBase() + path, { method: "POST", headers, body });
+    if (!plain.ok) return false;
+    const v = (await plain.json())[field];
+    target.value = typeof v === "string" ? v : JSON.stringify(v, null, 2);
+    return true;
+  }
+  target.value = "";
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  let ok = false;
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let cut;
+    while ((cut = buf.indexOf("\n\n")) >= 0) {
+      const block = buf.slice(0, cut);
+      buf = buf.slice(cut + 2);
+      const ev = (block.match(/^event: (.*)$/m) || [])[1];
+      const data = JSON.parse((block.match(/^data: (.*)$/m) || [, "{}"])[1]);
+      if (ev === "delta") target.value += data.text || "";
+      else if (ev === "done") { target.value = data[field] || ""; ok = true; }
+    }
+  }
+  return ok;
+}
+
 async function attributeSpeakers() {
   if (!currentFileId) { setStatus("No file uploaded"); return; }
   setStatus("Attributing");
-  const res = await fetch(resolveApiBase() + "/attribute", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ fileId: currentFileId }) });
-  if (!res.ok) { setStatus("Attribute failed"); return; }
-  const json = await res.json();
-  const d = json.dialogue;
-  els.dialogue.value = typeof d === "string" ? d : JSON.stringify(d, null, 2);
-  setStatus("Attributed");
+  try {
+    const ok = await streamInto("/attribute", { fileId: currentFileId }, els.dialogue, "dialogue");
+    setStatus(ok ? "Attributed" : "Attribute failed");
+  } catch (e) {
+    setStatus("Attribute failed");
+  }
 }
 
 async function summarize() {
   setStatus("Summarizing");
   const payload = { transcript: els.transcript.value, dialogue: els.dialogue.value };
   try {
-    const res = await fetch(resolveApiBase() + "/summarize", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(payload) });
-    if (!res.ok) { setStatus("Summarize failed"); return; }
-    const json = await res.json();
-    const n = json.note;
-    els.note.value = typeof n === "string" ? n : JSON.stringify(n, null, 2);
-    setStatus("Summarized");
+    const ok = await streamInto("/summarize", payload, els.note, "note");
+    setStatus(ok ? "Summarized" : "Summarize failed");
   } catch (e) {
     setStatus("Summarize failed");
   }